@@ -0,0 +1,706 @@
+import asyncio
+import functools
+
+import telebot
+
+from common import (BOT_TOKEN, BOT_MODE, SCHEDULE_GROUP_URL, SCHEDULE_TEACHER_URL, ANYWHERE_COMMANDS, ENTITY_TEXTS,
+                    LOGIN_REQUIRED_TEXT, MENU_TEXT, SESSION_EXPIRED_TEXT, WELCOME_TEXT, not_auth_commands,
+                    menu_commands, UserStates, get_current_semester, current_quarter, anywhere_handler,
+                    create_schedule_group_keyboard, create_schedule_teacher_keyboard, create_start_keyboard,
+                    create_menu_keyboard, create_confirm_keyboard, create_discipline_keyboard,
+                    create_candidates_keyboard, get_week_dates, week_cache_key)
+from telebot import asyncio_filters, types
+from telebot.types import BotCommandScopeDefault, BotCommandScopeChat
+from cache import schedule_cache, auth_cache, message_fingerprints, content_fingerprint
+from digest import digest_command, run_digest_scheduler_async
+from http_client import open_async_session, export_async_cookies, close_connector
+from metrics import instrument_handlers, start_metrics_server
+from notifications import run_notifier_async, toggle_subscription, unsubscribe_command
+from prefetch import async_prefetcher
+from profiling import profiler, is_admin, start_control_socket
+from render import (format_empty_week, format_week_schedule, format_discipline_info, format_disciplines_list,
+                    format_semester_report)
+from report import build_report_async
+from upstream import (fetch_journal_async, fetch_disciplines_async, fetch_profile_async, search_async,
+                      request_search_async, submit_login_async, submit_code_async, Unauthorized)
+from outbound import QueuedAsyncTeleBot, PRIORITY_BULK
+from semester import fetch_week_async
+from splitter import split_long_message
+from search_index import search_index, exact_match, merge_candidates
+from state_storage import create_async_state_storage
+from webhook import run_webhook
+
+state_storage = create_async_state_storage()
+
+bot = QueuedAsyncTeleBot(BOT_TOKEN, state_storage=state_storage)
+
+background_tasks = set()
+
+
+def async_task(func):
+    # dispatches through __wrapped__ so the profiler can swap the task body at runtime
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        task = asyncio.create_task(wrapper.__wrapped__(*args, **kwargs))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        return task
+
+    return wrapper
+
+
+async def get_user_session(user_id, chat_id):
+    async with bot.retrieve_data(user_id, chat_id) as data:
+        return open_async_session(data.get('cookies'))
+
+
+async def save_user_session(user_id, chat_id, user_session):
+    async with bot.retrieve_data(user_id, chat_id) as data:
+        data['cookies'] = export_async_cookies(user_session)
+
+
+async def find_candidates(search_type, text):
+    candidates = search_index.lookup(search_type, text)
+    if candidates and exact_match(text, candidates[0]):
+        return candidates
+    # only neighbours in the index: the group itself may be missing from it, so upstream is asked as well
+    return merge_candidates(text, candidates, search_index.add(search_type, await search_async(search_type, text)))
+
+
+async def get_profile(user_id, chat_id):
+    profile = auth_cache.get(f"auth_{user_id}")
+    if profile is None:
+        async with await get_user_session(user_id, chat_id) as user_session:
+            profile = await fetch_profile_async(user_session)
+        auth_cache.set(f"auth_{user_id}", profile)
+    return profile
+
+
+def invalidate_profile(user_id):
+    auth_cache.delete(f"auth_{user_id}")
+
+
+async def check_authorization(user_id, chat_id):
+    if not (await get_profile(user_id, chat_id))['authorized']:
+        return False
+    await update_menu_buttons(user_id, chat_id)
+    return True
+
+
+async def update_menu_buttons(user_id, chat_id, commands='auth'):
+    async with bot.retrieve_data(user_id, chat_id) as data:
+        if data.get('menu_commands') == commands:
+            return
+    await bot.set_my_commands(
+        menu_commands[commands],
+        scope=BotCommandScopeChat(user_id)
+    )
+    async with bot.retrieve_data(user_id, chat_id) as data:
+        data['menu_commands'] = commands
+
+
+async def login_account(message, user_login, user_password):
+    async with await get_user_session(message.from_user.id, message.chat.id) as user_session:
+        login_page = await submit_login_async(user_session, user_login, user_password)
+    if login_page is None:
+        await bot.send_message(message.from_user.id, 'Неверный логин или пароль')
+        await bot.send_message(message.from_user.id, 'Введи свой логин')
+        await bot.set_state(message.from_user.id, UserStates.waiting_login, message.chat.id)
+        async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+            data['user_password'] = None
+            data['user_login'] = None
+        return 'Invalid credentials'
+
+    await save_user_session(message.from_user.id, message.chat.id, user_session)
+    user_email, session_id = login_page
+
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data['session_id'] = session_id
+    await bot.send_message(message.chat.id, f"Введи код, отправленный на {user_email}")
+
+
+async def delete_messages(chat_id, message_ids):
+    for msg_id in message_ids:
+        try:
+            await bot.delete_message(chat_id, msg_id)
+        except Exception:
+            pass
+
+
+async def edit_rendered(chat_id, message_id, text, parse_mode='HTML', reply_markup=None):
+    fingerprint = content_fingerprint(text, parse_mode, reply_markup)
+    if message_fingerprints.get((chat_id, message_id)) == fingerprint:
+        return
+    try:
+        await bot.edit_message_text(chat_id=chat_id,
+                                    message_id=message_id,
+                                    text=text,
+                                    parse_mode=parse_mode,
+                                    reply_markup=reply_markup)
+    except telebot.asyncio_helper.ApiTelegramException as e:
+        if "message is not modified" not in str(e).lower():
+            raise e
+    message_fingerprints.set((chat_id, message_id), fingerprint)
+
+
+async def send_rendered(chat_id, text, parse_mode='HTML', reply_markup=None):
+    msg = await bot.send_message(chat_id=chat_id,
+                                 text=text,
+                                 parse_mode=parse_mode,
+                                 reply_markup=reply_markup)
+    message_fingerprints.set((chat_id, msg.message_id), content_fingerprint(text, parse_mode, reply_markup))
+    return msg.message_id
+
+
+async def send_long_message(bot, chat_id, text, parse_mode='HTML', reply_markup=None, message_id=None,
+                            prev_messages_id=None):
+    parts = split_long_message(text, parse_mode)
+    previous = list(prev_messages_id or [])
+    if message_id and previous and previous[-1] == message_id:
+        # the tapped message closes the previous render: reuse every part in place
+        existing = previous
+    else:
+        await delete_messages(chat_id, [msg_id for msg_id in previous if msg_id != message_id])
+        existing = [message_id] if message_id else []
+
+    sent_messages = []
+    for i, part in enumerate(parts):
+        markup = reply_markup if i == len(parts) - 1 else None
+        if i < len(existing):
+            try:
+                await edit_rendered(chat_id, existing[i], part, parse_mode, markup)
+                sent_messages.append(existing[i])
+                continue
+            except telebot.asyncio_helper.ApiTelegramException:
+                pass
+        sent_messages.append(await send_rendered(chat_id, part, parse_mode, markup))
+    await delete_messages(chat_id, existing[len(parts):])
+    return sent_messages
+
+
+# every render, an empty week or an error included, replaces all parts of the previous one
+async def show_rendered(chat_id, text, markup, message_id, previous_messages_ids, messages_key, parse_mode='HTML'):
+    new_message_ids = await send_long_message(
+        bot=bot,
+        chat_id=chat_id,
+        text=text,
+        parse_mode=parse_mode,
+        reply_markup=markup,
+        message_id=message_id,
+        prev_messages_id=previous_messages_ids
+    )
+    async with bot.retrieve_data(chat_id, chat_id) as data:
+        data[messages_key] = new_message_ids
+
+
+async def show_week(chat_id, lessons, start_date, end_date, markup, message_id, previous_messages_ids):
+    if lessons:
+        text = format_week_schedule(lessons, start_date, end_date)
+    else:
+        text = format_empty_week(start_date)
+    await show_rendered(chat_id, text, markup, message_id, previous_messages_ids, 'last_schedule_messages')
+
+
+async def show_week_schedule(chat_id, kind, entity_id, url, markup, offset=0, message_id=None):
+    async with bot.retrieve_data(chat_id, chat_id) as data:
+        previous_messages_ids = data.get('last_schedule_messages', [])
+
+    start_date, end_date = get_week_dates(offset)
+    cache_key = week_cache_key(kind, entity_id, start_date)
+    # weeks are cached as lesson records and rendered on every read
+    lessons = await schedule_cache.get_async(cache_key, namespace='schedule')
+
+    if lessons is None:
+        async_prefetcher.cancel(cache_key)
+        lessons = tuple(await fetch_week_async(kind, url, entity_id, start_date, end_date))
+        await schedule_cache.set_async(cache_key, lessons, namespace='schedule')
+    await show_week(chat_id, lessons, start_date, end_date, markup, message_id, previous_messages_ids)
+    async_prefetcher.prefetch_neighbours(kind, url, entity_id, offset)
+
+
+@async_task
+async def show_group_schedule(bot, chat_id, offset=0, message_id=None):
+    async with bot.retrieve_data(chat_id, chat_id) as data:
+        group_id = data['group_id']
+    await show_week_schedule(chat_id, 'group', group_id, SCHEDULE_GROUP_URL,
+                             create_schedule_group_keyboard(offset), offset, message_id)
+
+
+@async_task
+async def show_teacher_schedule(bot, chat_id, offset=0, message_id=None):
+    async with bot.retrieve_data(chat_id, chat_id) as data:
+        teacher_id = data['teacher_id']
+    await show_week_schedule(chat_id, 'teacher', teacher_id, SCHEDULE_TEACHER_URL,
+                             create_schedule_teacher_keyboard(offset), offset, message_id)
+
+
+@async_task
+async def show_discipline_info(bot, chat_id, discipline_id, offset=0, message_id=None):
+    start_date, end_date, quarter = current_quarter(offset)
+    cache_key = f"{chat_id}_{discipline_id}_{offset}"
+    markup = create_discipline_keyboard(discipline_id, quarter, offset)
+    cached_data = schedule_cache.get(cache_key, namespace='journal')
+
+    async with bot.retrieve_data(chat_id, chat_id) as data:
+        previous_messages_ids = data.get('last_discipline_messages', [])
+
+    if cached_data:
+        student_id, discipline_data = cached_data
+    else:
+        student_id = (await get_profile(chat_id, chat_id))['student_id']
+        try:
+            async with await get_user_session(chat_id, chat_id) as user_session:
+                discipline_data = await fetch_journal_async(user_session, student_id, discipline_id,
+                                                            start_date, end_date)
+        except Unauthorized:
+            invalidate_profile(chat_id)
+            await bot.send_message(chat_id, SESSION_EXPIRED_TEXT)
+            return
+
+        if discipline_data.get('error') == 1:
+            text_data_not_found = f'<b>📅{start_date} - {end_date}\n Данные не найдены</b>'
+            await show_rendered(chat_id, text_data_not_found, markup, message_id, previous_messages_ids,
+                                'last_discipline_messages')
+            return
+
+        if str(student_id) not in discipline_data['rows']:
+            text_student_not_found = f"⚠️ Данные для студента ID {student_id} не найдены"
+            await show_rendered(chat_id, text_student_not_found, markup, message_id, previous_messages_ids,
+                                'last_discipline_messages', parse_mode=None)
+            return
+        schedule_cache.set(cache_key, (student_id, discipline_data), namespace='journal')
+
+    await show_rendered(chat_id, format_discipline_info(discipline_data, student_id, quarter), markup, message_id,
+                        previous_messages_ids, 'last_discipline_messages')
+
+
+@bot.message_handler(commands=['profile'], func=lambda message: is_admin(message.from_user.id))
+async def handle_profile(message):
+    chat_id = message.chat.id
+    loop = asyncio.get_running_loop()
+
+    def on_finish(path):
+        asyncio.run_coroutine_threadsafe(bot.send_message(chat_id, f"Профиль сохранён: {path}"), loop)
+
+    await bot.send_message(chat_id, profiler.handle_command(message.text, on_finish))
+
+
+@bot.message_handler(commands=ANYWHERE_COMMANDS, state='*')
+async def handle_commands_anywhere(message):
+    # looked up by name, so a handler the profiler swapped in is the one that runs
+    handler = anywhere_handler(message.text)
+    if handler is not None:
+        await globals()[handler](message)
+
+
+async def cancel(message):
+    await bot.send_message(message.chat.id, "Текущее действие отменено.")
+
+
+@bot.message_handler(commands=['start'])
+async def start(message):
+    markup = create_start_keyboard(await check_authorization(message.from_user.id, message.chat.id))
+    await bot.send_message(message.from_user.id, WELCOME_TEXT, reply_markup=markup)
+
+
+@bot.message_handler(func=lambda message: message.text.lower() in ['/login', 'войти в аккаунт'])
+async def login(message):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        user_login = data.get('user_login')
+        user_password = data.get('user_password')
+
+    if user_login and user_password:
+        if await check_authorization(message.from_user.id, message.chat.id):
+            await bot.set_state(message.from_user.id, UserStates.final, message.chat.id)
+            await menu(message)
+            return
+        await bot.set_state(message.from_user.id, UserStates.waiting_code, message.chat.id)
+        await login_account(message, user_login=user_login, user_password=user_password)
+    elif user_login:
+        await bot.set_state(message.from_user.id, UserStates.waiting_password, message.chat.id)
+        await bot.send_message(message.from_user.id, 'Отлично, теперь введи пароль')
+    else:
+        markup = types.ReplyKeyboardRemove()
+        await bot.send_message(message.chat.id, 'Привет, введи свой логин', reply_markup=markup)
+        await bot.set_state(message.from_user.id, UserStates.waiting_login, message.chat.id)
+
+
+@bot.message_handler(state=UserStates.waiting_login)
+async def process_login(message):
+    if message.text.startswith('/'):
+        return
+    try:
+        user_login = message.text
+        if len(user_login) != 6:
+            raise ValueError
+        async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+            data['user_login'] = user_login
+        await bot.send_message(message.chat.id, "Отлично, теперь введи пароль")
+        await bot.set_state(message.from_user.id, UserStates.waiting_password, message.chat.id)
+    except ValueError:
+        await bot.send_message(message.chat.id, "Логин должен содердать 6 цифр")
+
+
+@bot.message_handler(state=UserStates.waiting_password)
+async def process_password(message):
+    if message.text.startswith('/'):
+        return
+    user_password = message.text
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data['user_password'] = user_password
+        user_login = data['user_login']
+    if await login_account(message, user_login=user_login, user_password=user_password) == 'Invalid credentials':
+        return
+    await bot.set_state(message.from_user.id, UserStates.waiting_code, message.chat.id)
+
+
+@bot.message_handler(state=UserStates.waiting_code)
+async def process_code(message):
+    if message.text.startswith('/'):
+        return
+    try:
+        user_code = message.text
+        if len(user_code) != 6:
+            raise ValueError
+        async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+            session_id = data['session_id']
+
+        async with await get_user_session(message.from_user.id, message.chat.id) as user_session:
+            await submit_code_async(user_session, user_code, session_id)
+        await save_user_session(message.from_user.id, message.chat.id, user_session)
+        invalidate_profile(message.from_user.id)
+        if not await check_authorization(message.from_user.id, message.chat.id):
+            await bot.send_message(message.chat.id, "Неправильный код")
+            return
+        await bot.set_state(message.from_user.id, UserStates.final, message.chat.id)
+        await menu(message)
+
+    except ValueError:
+        await bot.send_message(message.chat.id, "Код должен содердать 6 цифр")
+
+
+@bot.message_handler(commands=['menu'])
+async def menu(message):
+    markup = create_menu_keyboard(await check_authorization(message.from_user.id, message.chat.id))
+    await bot.send_message(message.from_user.id, MENU_TEXT, reply_markup=markup)
+
+
+@bot.message_handler(func=lambda message: message.text.lower() == 'расписание группы'
+                     or message.text == '/schedule_group')
+async def handle_group_choose(message):
+    await bot.send_message(message.chat.id, ENTITY_TEXTS['group']['ask'], reply_markup=types.ReplyKeyboardRemove())
+    await bot.set_state(message.from_user.id, UserStates.waiting_group, message.chat.id)
+
+
+@bot.message_handler(func=lambda message: message.text.lower() == 'расписание преподавателя'
+                     or message.text == '/schedule_teacher')
+async def handle_teacher_choose(message):
+    await bot.send_message(message.chat.id, ENTITY_TEXTS['teacher']['ask'], reply_markup=types.ReplyKeyboardRemove())
+    await bot.set_state(message.from_user.id, UserStates.waiting_teacher, message.chat.id)
+
+
+@bot.message_handler(state=[UserStates.waiting_group, UserStates.waiting_teacher])
+async def process_group_input(message):
+    if message.text in ['Баллы и посещения', '/disciplines']:
+        await bot.set_state(message.from_user.id, UserStates.final, message.chat.id)
+        await handle_disciplines_list(message)
+        return
+    state = await bot.get_state(user_id=message.from_user.id, chat_id=message.chat.id)
+    kind = 'teacher' if state == 'UserStates:waiting_teacher' else 'group'
+
+    schedule_data = await find_candidates('person' if kind == 'teacher' else 'group', message.text)
+    if not schedule_data:
+        await bot.send_message(message.from_user.id, text=ENTITY_TEXTS[kind]['not_found'])
+        return
+
+    if len(schedule_data) > 1 and not exact_match(message.text, schedule_data[0]):
+        await bot.send_message(message.from_user.id, text=ENTITY_TEXTS[kind]['pick'],
+                               reply_markup=create_candidates_keyboard(kind, schedule_data))
+        await bot.set_state(message.from_user.id, UserStates.final, message.chat.id)
+        return
+
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        data[f'{kind}_id'] = schedule_data[0]['id']
+    await bot.send_message(message.from_user.id,
+                           text=ENTITY_TEXTS[kind]['confirm'].format(label=schedule_data[0]['label']),
+                           reply_markup=create_confirm_keyboard(kind))
+    await bot.set_state(message.from_user.id, UserStates.final, message.chat.id)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('pick_'))
+async def handle_candidate_pick(call):
+    _, kind, entity_id = call.data.split('_', 2)
+    async with bot.retrieve_data(call.from_user.id, call.message.chat.id) as data:
+        data[f'{kind}_id'] = entity_id
+    await bot.answer_callback_query(call.id, "Загрузка...")
+    if kind == 'teacher':
+        show_teacher_schedule(bot, call.message.chat.id, 0, call.message.message_id)
+    else:
+        show_group_schedule(bot, call.message.chat.id, 0, call.message.message_id)
+
+
+async def ask_again(call, kind, state):
+    await bot.delete_message(call.message.chat.id, call.message.message_id)
+
+    await bot.send_message(call.message.chat.id, ENTITY_TEXTS[kind]['ask_again'])
+    await bot.set_state(call.from_user.id, state, call.message.chat.id)
+
+
+@bot.callback_query_handler(func=lambda call: call.data == "group_incorrect")
+async def handle_group_incorrect(call):
+    await ask_again(call, 'group', UserStates.waiting_group)
+
+
+@bot.callback_query_handler(func=lambda call: call.data == "teacher_incorrect")
+async def handle_teacher_incorrect(call):
+    await ask_again(call, 'teacher', UserStates.waiting_teacher)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('schedule_group'))
+async def handle_schedule_group_navigation(call):
+    try:
+        offset_str = call.data.split('_')[-1]
+        offset = int(offset_str)
+        await bot.answer_callback_query(call.id, "Загрузка...")
+        state = await bot.get_state(call.from_user.id, call.message.chat.id)
+        if state == 'UserStates:waiting_teacher':
+            show_teacher_schedule(
+                bot,
+                call.message.chat.id,
+                offset,
+                call.message.message_id
+            )
+        else:
+            show_group_schedule(
+                bot,
+                call.message.chat.id,
+                offset,
+                call.message.message_id
+            )
+
+    except Exception as e:
+        await bot.answer_callback_query(
+            call.id,
+            f"Ошибка: {str(e)}",
+            show_alert=True
+        )
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('schedule_teacher'))
+async def handle_schedule_teacher_navigation(call):
+    try:
+        offset_str = call.data.split('_')[-1]
+        offset = int(offset_str)
+        await bot.answer_callback_query(call.id, "Загрузка...")
+        show_teacher_schedule(
+            bot,
+            call.message.chat.id,
+            offset,
+            call.message.message_id
+        )
+        await bot.set_state(call.from_user.id, UserStates.final, call.message.chat.id)
+
+    except Exception as e:
+        await bot.answer_callback_query(
+            call.id,
+            f"Ошибка: {str(e)}",
+            show_alert=True
+        )
+
+
+@bot.callback_query_handler(func=lambda call: call.data in ('notify_group', 'notify_teacher'))
+async def handle_notify_toggle(call):
+    kind = call.data.split('_', 1)[1]
+    chat_id = call.message.chat.id
+    async with bot.retrieve_data(call.from_user.id, chat_id) as data:
+        entity_id = data.get(f'{kind}_id')
+    # the subscription store is sqlite, kept off the event loop
+    text, show_alert = await asyncio.to_thread(toggle_subscription, chat_id, kind, entity_id)
+    await bot.answer_callback_query(call.id, text, show_alert=show_alert)
+
+
+@bot.message_handler(commands=['unsubscribe'])
+async def handle_unsubscribe(message):
+    await bot.send_message(message.chat.id, await asyncio.to_thread(unsubscribe_command, message.chat.id))
+
+
+@bot.message_handler(commands=['digest'])
+async def handle_digest(message):
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        group_id = data.get('group_id')
+    reply = await asyncio.to_thread(digest_command, message.chat.id, message.text.partition(' ')[2].strip(), group_id)
+    await bot.send_message(message.chat.id, reply)
+
+
+async def send_notification(chat_id, text):
+    await bot.send_message(chat_id, text, parse_mode='HTML', priority=PRIORITY_BULK)
+
+
+@bot.message_handler(commands=['logout'])
+async def logout(message):
+    if await check_authorization(message.from_user.id, message.chat.id):
+        async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+            data.clear()
+        invalidate_profile(message.from_user.id)
+        await update_menu_buttons(message.from_user.id, message.chat.id, 'not_auth')
+        await bot.send_message(message.from_user.id, 'Вы успешно вышли из аккаунта')
+        return
+    await bot.send_message(message.from_user.id, 'Вы не авторизованы')
+
+
+@bot.message_handler(func=lambda message: message.text.lower() == 'баллы и посещения'
+                     or message.text == '/disciplines')
+async def handle_disciplines_list(message):
+    if not await check_authorization(message.from_user.id, message.chat.id):
+        await bot.send_message(message.from_user.id, LOGIN_REQUIRED_TEXT)
+        return
+
+    remove_msg = await bot.send_message(
+        chat_id=message.chat.id,
+        text="Ожидайте, происходит загрузка",
+        reply_markup=types.ReplyKeyboardRemove())
+
+    student_id = (await get_profile(message.from_user.id, message.chat.id))['student_id']
+    start_date, end_date = get_current_semester()
+    cache_key = f"{student_id}_{message.chat.id}"
+    disciplines_data = schedule_cache.get(cache_key, namespace='journal')
+
+    if disciplines_data is None:
+        try:
+            async with await get_user_session(message.from_user.id, message.chat.id) as user_session:
+                disciplines_data = await fetch_disciplines_async(user_session, student_id, start_date, end_date)
+        except Unauthorized:
+            invalidate_profile(message.from_user.id)
+            await bot.delete_message(message.chat.id, remove_msg.message_id)
+            await bot.send_message(message.chat.id, SESSION_EXPIRED_TEXT)
+            return
+        schedule_cache.set(cache_key, disciplines_data, namespace='journal')
+
+    final_text, markup = format_disciplines_list(disciplines_data)
+    await bot.send_message(
+        chat_id=message.chat.id,
+        text=final_text,
+        parse_mode='HTML',
+        reply_markup=markup
+    )
+    await bot.delete_message(message.chat.id, remove_msg.message_id)
+
+
+@bot.message_handler(commands=['report'])
+async def handle_report(message):
+    if not await check_authorization(message.from_user.id, message.chat.id):
+        await bot.send_message(message.from_user.id, LOGIN_REQUIRED_TEXT)
+        return
+
+    wait_msg = await bot.send_message(message.chat.id, "Ожидайте, собираю сводку за семестр")
+    student_id = (await get_profile(message.from_user.id, message.chat.id))['student_id']
+    try:
+        async with await get_user_session(message.from_user.id, message.chat.id) as user_session:
+            report = await build_report_async(user_session, student_id)
+    except Unauthorized:
+        invalidate_profile(message.from_user.id)
+        await bot.delete_message(message.chat.id, wait_msg.message_id)
+        await bot.send_message(message.chat.id, SESSION_EXPIRED_TEXT)
+        return
+    except Exception:
+        # one failing journal request must not leave the wait message hanging forever
+        await bot.edit_message_text('Не удалось собрать сводку, попробуй позже', message.chat.id, wait_msg.message_id)
+        return
+    await send_long_message(
+        bot=bot,
+        chat_id=message.chat.id,
+        text=format_semester_report(report),
+        parse_mode='HTML',
+        message_id=wait_msg.message_id,
+        prev_messages_id=[wait_msg.message_id]
+    )
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('discipline_'))
+async def handle_discipline_by_id(call):
+    try:
+        if not await check_authorization(call.from_user.id, call.message.chat.id):
+            await bot.send_message(call.message.chat.id, SESSION_EXPIRED_TEXT)
+            raise RuntimeError
+        offset = int(call.data.split('_')[-1])
+        discipline_id = call.data.split('_')[1]
+        await bot.answer_callback_query(call.id, "Загрузка...")
+        show_discipline_info(
+            bot,
+            call.message.chat.id,
+            discipline_id,
+            offset,
+            message_id=call.message.message_id
+        )
+
+    except Exception as e:
+        await bot.answer_callback_query(
+            call.id,
+            f"Ошибка: {str(e)}",
+        )
+
+
+bot.add_custom_filter(asyncio_filters.StateFilter(bot))
+instrument_handlers(bot)
+profiler.attach(bot, globals())
+
+
+async def process_update(payload):
+    await bot.process_new_updates([types.Update.de_json(payload)])
+
+
+async def shutdown(*background):
+    for task in background:
+        if task is not None:
+            task.cancel()
+    async_prefetcher.cancel_all()
+    bot.send_queue.close()
+    await close_connector()
+
+
+async def main():
+    start_metrics_server()
+    start_control_socket()
+    await bot.set_my_commands(
+        not_auth_commands,
+        scope=BotCommandScopeDefault()
+    )
+    refresher = asyncio.create_task(search_index.run_refresher_async(request_search_async))
+    notifier = asyncio.create_task(run_notifier_async(send_notification))
+    digests = asyncio.create_task(run_digest_scheduler_async(send_notification))
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook(process_update, bot.set_webhook)
+        else:
+            await bot.infinity_polling()
+    finally:
+        await shutdown(refresher, notifier, digests)
+
+
+async def serve_shard(queue, shard):
+    start_metrics_server(shard + 1)
+    start_control_socket(f'.{shard}')
+    refresher = asyncio.create_task(search_index.run_refresher_async(request_search_async)) if shard == 0 else None
+    notifier = asyncio.create_task(run_notifier_async(send_notification)) if shard == 0 else None
+    digests = asyncio.create_task(run_digest_scheduler_async(send_notification)) if shard == 0 else None
+    tasks = set()
+    try:
+        while (payload := await asyncio.to_thread(queue.get)) is not None:
+            task = asyncio.create_task(process_update(payload))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await shutdown(refresher, notifier, digests)
+
+
+def run():
+    asyncio.run(main())
+
+
+def run_shard(queue, shard):
+    asyncio.run(serve_shard(queue, shard))
+
+
+if __name__ == '__main__':
+    run()
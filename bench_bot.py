@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import os
+import random
+import tempfile
+import time
+
+
+def scenarios(chat_id, labels):
+    login = str(100000 + chat_id % 900000)
+    group = labels['group'][chat_id % len(labels['group'])]
+    teacher = labels['person'][chat_id % len(labels['person'])]
+    return {
+        'start': [
+            ('start', 'message', '/start', 'Добро пожаловать'),
+        ],
+        'group': [
+            ('group_choose', 'message', 'Расписание группы', 'Введите название группы'),
+            ('group_search', 'message', group, 'Твоя группа это'),
+            ('schedule', 'callback', 'schedule_group_0', 'schedule_group_1'),
+            ('schedule_next', 'callback', 'schedule_group_1', 'schedule_group_2'),
+            ('schedule_back', 'callback', 'schedule_group_0', 'schedule_group_1'),
+        ],
+        'teacher': [
+            ('teacher_choose', 'message', 'Расписание преподавателя', 'Введите ФИО'),
+            ('teacher_search', 'message', teacher, 'Ты хочешь посмотреть расписание'),
+            ('schedule', 'callback', 'schedule_teacher_0', 'schedule_teacher_1'),
+        ],
+        'journal': [
+            ('login', 'message', '/login', 'введи свой логин'),
+            ('login_user', 'message', login, 'введи пароль'),
+            ('login_password', 'message', 'password', 'Введи код'),
+            ('login_code', 'message', '123456', 'Выбери что ты хочешь сделать'),
+            ('disciplines', 'message', 'Баллы и посещения', 'Ваша успеваемость'),
+            ('discipline', 'callback', 'discipline_100_0', 'discipline_100_0'),
+            ('report', 'message', '/report', 'Сводка за семестр'),
+        ],
+    }
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Bench:
+    def __init__(self, bot_module, api, client, labels, args):
+        self.bot_module = bot_module
+        self.api = api
+        self.client = client
+        self.labels = labels
+        self.args = args
+        self.chat_ids = itertools.count(1)
+        self.latencies = {}
+        self.timeouts = {}
+        self.updates = 0
+
+    async def step(self, chat_id, name, kind, value, marker):
+        if kind == 'message':
+            payload = self.client.message(chat_id, value)
+        else:
+            payload = self.client.callback(chat_id, value, self.api.last_message(chat_id))
+        future = self.api.expect(chat_id, marker)
+        started = time.perf_counter()
+        await self.bot_module.process_update(payload)
+        self.updates += 1
+        try:
+            answered = await self.api.wait(chat_id, future, self.args.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+            return False
+        self.latencies.setdefault(name, []).append(answered - started)
+        return True
+
+    async def user(self, deadline, mix):
+        names, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            chat_id = next(self.chat_ids)
+            scenario = random.choices(names, weights)[0]
+            for step in scenarios(chat_id, self.labels)[scenario]:
+                if not await self.step(chat_id, *step):
+                    break
+                if self.args.think:
+                    await asyncio.sleep(self.args.think)
+
+    async def run(self):
+        mix = parse_mix(self.args.mix)
+        deadline = time.perf_counter() + self.args.duration
+        started = time.perf_counter()
+        await asyncio.gather(*(self.user(deadline, mix) for _ in range(self.args.users)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        timeouts = sum(self.timeouts.values())
+        print(f'{self.args.runtime} runtime, {self.args.users} users, {elapsed:.1f} s, {self.updates} updates, '
+              f'{self.updates / elapsed:.1f} updates/s, {timeouts} timeouts')
+        print(f'{"step":<16} {"count":>7} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        everything = []
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            everything.extend(values)
+            self.print_row(name, values)
+        everything.sort()
+        self.print_row('all', everything)
+
+    def print_row(self, name, values):
+        timeouts = self.timeouts.get(name, 0)
+        print(f'{name:<16} {len(values):>7} {percentile(values, 50) * 1000:>9.1f} '
+              f'{percentile(values, 95) * 1000:>9.1f} {percentile(values, 99) * 1000:>9.1f}'
+              + (f'  {timeouts} timeouts' if timeouts else ''))
+
+
+def configure(args):
+    # the bot reads its endpoints and storages at import time
+    os.environ['ORG_URL'] = f'http://localhost:{args.org_port}'
+    os.environ.setdefault('BOT_TOKEN', '123456:bench')
+    os.environ.setdefault('STATE_STORAGE', 'memory')
+    directory = tempfile.mkdtemp()
+    os.environ.setdefault('SEARCH_INDEX_PATH', os.path.join(directory, 'search_index.json'))
+    # a cold on-disk cache per run, pass CACHE_SHARED_SQLITE_PATH to measure a warm start
+    os.environ.setdefault('CACHE_SHARED_SQLITE_PATH', os.path.join(directory, 'cache.sqlite3'))
+    os.environ.setdefault('OUTBOUND_QUEUE_ENABLED', '1' if args.outbound else '0')
+    os.environ.setdefault('METRICS_PORT', '0')
+
+
+async def amain(args):
+    configure(args)
+    from telebot import apihelper, asyncio_helper
+
+    from fake_org import FakeOrg
+    from fake_telegram import FakeBotApi, FakeTelegramClient
+    from http_client import close_connector
+
+    org = FakeOrg(latency=args.upstream_latency, lessons_per_day=args.lessons_per_day,
+                  disciplines=args.disciplines, journal_lessons=args.journal_lessons,
+                  groups=args.groups, teachers=args.teachers)
+    api = FakeBotApi(latency=args.telegram_latency)
+    await org.start(port=args.org_port)
+    await api.start(port=args.api_port)
+    apihelper.API_URL = asyncio_helper.API_URL = f'http://localhost:{args.api_port}/bot{{0}}/{{1}}'
+
+    bot_module = importlib.import_module('threaded_bot' if args.runtime == 'sync' else 'async_bot')
+    # a running bot answers most searches from the index its refresher keeps filled
+    for search_type in ('group', 'person'):
+        bot_module.search_index.add(search_type, org.catalogue(search_type))
+    bench = Bench(bot_module, api, FakeTelegramClient(''), org.labels, args)
+    try:
+        elapsed = await bench.run()
+    finally:
+        if args.runtime == 'async':
+            await bot_module.shutdown(None)
+            await bot_module.bot.close_session()
+        await close_connector()
+        await api.stop()
+        await org.stop()
+    bench.report(elapsed)
+    print('upstream requests: ' + ', '.join(f'{name}={count}' for name, count in sorted(org.requests.items())))
+    print('telegram calls: ' + ', '.join(f'{name}={count}' for name, count in sorted(api.calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end handler latency against fake org.fa.ru and Bot API')
+    parser.add_argument('--runtime', choices=['sync', 'async'], default='async')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--mix', default='start=1,group=4,teacher=2,journal=1')
+    parser.add_argument('--think', type=float, default=0)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--upstream-latency', type=float, default=0.05)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--lessons-per-day', type=int, default=4)
+    parser.add_argument('--disciplines', type=int, default=12)
+    parser.add_argument('--journal-lessons', type=int, default=30)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--teachers', type=int, default=20)
+    parser.add_argument('--outbound', action='store_true', help='pace replies through the outbound queue')
+    parser.add_argument('--org-port', type=int, default=18180)
+    parser.add_argument('--api-port', type=int, default=18181)
+    args = parser.parse_args()
+    asyncio.run(amain(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import datetime
+import json
+import timeit
+import tracemalloc
+
+from lessons import parse_lessons
+from render import format_week_schedule, format_discipline_info
+
+BEGIN_TIMES = ['8:30', '10:10', '11:50', '14:00', '15:40', '17:20', '18:55', '20:30']
+
+
+def teacher_week_payload(lessons_per_day):
+    monday = datetime.date(2025, 9, 1)
+    lessons = []
+    for day in range(6):
+        date = (monday + datetime.timedelta(days=day)).strftime('%Y.%m.%d')
+        for i in range(lessons_per_day):
+            lessons.append({
+                'date': date,
+                'discipline': f'Дисциплина {i}',
+                'kindOfWork': 'Лекции',
+                'lecturer': 'Иванов Иван Иванович',
+                'beginLesson': BEGIN_TIMES[i % len(BEGIN_TIMES)],
+                'endLesson': '10:00',
+                'auditorium': f'Ленинградский пр-т, 49/2, ауд. {400 + i}',
+            })
+    return lessons, monday, monday + datetime.timedelta(days=6)
+
+
+def teacher_week(lessons_per_day):
+    lessons, start_date, end_date = teacher_week_payload(lessons_per_day)
+    return parse_lessons(lessons), start_date, end_date
+
+
+def discipline_journal(lessons_count):
+    lessons = []
+    student_lessons = {}
+    for i in range(lessons_count):
+        lessons.append({
+            'id': i,
+            'hold_at': (datetime.date(2025, 9, 1) + datetime.timedelta(days=i)).isoformat(),
+            'start_at': '10:10:00',
+            'finish_at': '11:40:00',
+            'kind_of_work': 'Семинар',
+            'profile_fio': 'Иванов Иван Иванович',
+        })
+        student_lessons[str(i)] = {'attendance': {'visit_status_id': 2 if i % 5 else 4},
+                                   'marks': [{'mark_val': 1.5}]}
+    return {'lessons': lessons, 'rows': {'1': {'mark_sum': 10, 'lessons': student_lessons}}}
+
+
+def measure(name, func, lessons_count, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f'{name:<20} {lessons_count:>5} lessons  {seconds * 1e6:>10.1f} us/render  '
+          f'{seconds * 1e6 / lessons_count:>7.2f} us/lesson')
+
+
+def measure_memory(lessons_per_day, weeks):
+    payload = json.dumps(teacher_week_payload(lessons_per_day)[0])
+    for name, load in (('api dicts', json.loads), ('lesson records', lambda text: parse_lessons(json.loads(text)))):
+        tracemalloc.start()
+        kept = [load(payload) for _ in range(weeks)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'{name:<20} {len(kept[0]):>5} lessons  {size / weeks / 1024:>10.1f} KiB/week')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render cost per lesson')
+    parser.add_argument('--lessons-per-day', type=int, default=12)
+    parser.add_argument('--journal-lessons', type=int, default=60)
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--weeks', type=int, default=200)
+    args = parser.parse_args()
+
+    lessons, start_date, end_date = teacher_week(args.lessons_per_day)
+    measure('teacher week', lambda: format_week_schedule(lessons, start_date, end_date), len(lessons), args.number)
+    measure('teacher week text', lambda: format_week_schedule(lessons, start_date, end_date, output='text'),
+            len(lessons), args.number)
+    journal = discipline_journal(args.journal_lessons)
+    measure('discipline journal', lambda: format_discipline_info(journal, 1, 1), args.journal_lessons, args.number)
+    measure_memory(args.lessons_per_day, args.weeks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import time
+
+from bench_render import teacher_week
+from render import format_week_schedule
+from splitter import split_message
+
+
+def large_message(megabytes):
+    lessons, start_date, end_date = teacher_week(12)
+    week = format_week_schedule(lessons, start_date, end_date)
+    return week * max(1, int(megabytes * 1024 * 1024 // len(week.encode())))
+
+
+def measure(name, text, html):
+    started = time.perf_counter()
+    parts = sum(1 for _ in split_message(text, html=html))
+    elapsed = time.perf_counter() - started
+    size = len(text.encode()) / 1024 / 1024
+    print(f'{name:<6} {size:>6.1f} MB  {parts:>6} parts  {elapsed * 1000:>9.1f} ms  {size / elapsed:>7.1f} MB/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Message splitter throughput')
+    parser.add_argument('--megabytes', type=float, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    for megabytes in args.megabytes:
+        text = large_message(megabytes)
+        measure('html', text, html=True)
+        measure('plain', text, html=False)
+
+
+if __name__ == '__main__':
+    main()
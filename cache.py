@@ -0,0 +1,358 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from metrics import register_cache
+from state_storage import RespClient
+
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 5000))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_SCHEDULE_TTL = int(os.getenv('CACHE_SCHEDULE_TTL', 3600))
+CACHE_JOURNAL_TTL = int(os.getenv('CACHE_JOURNAL_TTL', 600))
+CACHE_SEMESTER_TTL = int(os.getenv('CACHE_SEMESTER_TTL', 6 * 3600))
+CACHE_REPORT_TTL = int(os.getenv('CACHE_REPORT_TTL', 24 * 3600))
+CACHE_SWEEP_INTERVAL = int(os.getenv('CACHE_SWEEP_INTERVAL', 60))
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))
+CACHE_SEARCH_TTL = int(os.getenv('CACHE_SEARCH_TTL', 24 * 3600))
+CACHE_SHARED_TIER = os.getenv('CACHE_SHARED_TIER', 'sqlite')
+CACHE_SHARED_SQLITE_PATH = os.getenv('CACHE_SHARED_SQLITE_PATH', 'data/cache.sqlite3')
+CACHE_SHARED_REDIS_URL = os.getenv('CACHE_SHARED_REDIS_URL', 'redis://localhost:6379/1')
+CACHE_SHARED_PREFIX = os.getenv('CACHE_SHARED_PREFIX', 'cache:')
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', 512))
+CACHE_COMPRESS_LEVEL = int(os.getenv('CACHE_COMPRESS_LEVEL', 6))
+# only namespaces that hold the same value for every user may leave the process
+CACHE_SHARED_NAMESPACES = ('schedule', 'semester', 'search')
+# bump when cached values change shape, entries written by older code are then never read
+CACHE_FORMAT_VERSION = 2
+DECODE_ERRORS = (pickle.UnpicklingError, zlib.error, AttributeError, ImportError, EOFError)
+FINGERPRINT_TTL = int(os.getenv('FINGERPRINT_TTL', 48 * 3600))
+FINGERPRINT_MAX_ENTRIES = int(os.getenv('FINGERPRINT_MAX_ENTRIES', 100000))
+
+
+# shared objects, such as interned strings of lesson records, are counted once per value
+def estimate_size(value, depth=0, seen=None):
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if depth > 8 or isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, depth + 1, seen) + estimate_size(v, depth + 1, seen)
+                          for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(item, depth + 1, seen) for item in value)
+    if hasattr(value, '__dict__'):
+        size += estimate_size(vars(value), depth + 1, seen)
+    for cls in type(value).__mro__:
+        slots = getattr(cls, '__slots__', ())
+        for name in (slots,) if isinstance(slots, str) else slots:
+            if name not in ('__dict__', '__weakref__') and hasattr(value, name):
+                size += estimate_size(getattr(value, name), depth + 1, seen)
+    return size
+
+
+def encode_value(value):
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(data) >= CACHE_COMPRESS_MIN_BYTES:
+        return zlib.compress(data, CACHE_COMPRESS_LEVEL)
+    return data
+
+
+def decode_value(data):
+    # pickles start with the PROTO opcode, anything else was compressed
+    if data[:1] != b'\x80':
+        data = zlib.decompress(data)
+    return pickle.loads(data)
+
+
+def content_fingerprint(text, parse_mode=None, reply_markup=None):
+    markup = reply_markup.to_json() if reply_markup else ''
+    return hashlib.blake2b(f"{parse_mode}\0{markup}\0{text}".encode(), digest_size=8).digest()
+
+
+class Cache:
+    def __init__(self, ttl=300, max_entries=None, max_bytes=None, namespace_ttls=None,
+                 sweep_interval=CACHE_SWEEP_INTERVAL, shared=None, shared_namespaces=()):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.namespace_ttls = namespace_ttls or {}
+        self.sweep_interval = sweep_interval
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.next_sweep = time.monotonic() + sweep_interval
+        self.shared = shared
+        self.shared_namespaces = shared_namespaces
+        self.shared_hits = 0
+
+    def get(self, key, namespace=None):
+        value = self._get_local(key)
+        if value is not None or not self._shares(namespace):
+            return value
+        return self._keep_shared(key, self.shared.get(key))
+
+    def set(self, key, value, namespace=None, ttl=None):
+        if ttl is None:
+            ttl = self.namespace_ttls.get(namespace, self.ttl)
+        self._set_local(key, value, ttl)
+        if self._shares(namespace):
+            self.shared.set(key, value, ttl)
+
+    def delete(self, key, namespace=None):
+        self._delete_local(key)
+        if self._shares(namespace):
+            self.shared.delete(key)
+
+    # the shared tiers block on a socket or on sqlite, so the event loop hands them to a thread
+    async def get_async(self, key, namespace=None):
+        value = self._get_local(key)
+        if value is not None or not self._shares(namespace):
+            return value
+        return self._keep_shared(key, await asyncio.to_thread(self.shared.get, key))
+
+    async def set_async(self, key, value, namespace=None, ttl=None):
+        if ttl is None:
+            ttl = self.namespace_ttls.get(namespace, self.ttl)
+        self._set_local(key, value, ttl)
+        if self._shares(namespace):
+            await asyncio.to_thread(self.shared.set, key, value, ttl)
+
+    async def delete_async(self, key, namespace=None):
+        self._delete_local(key)
+        if self._shares(namespace):
+            await asyncio.to_thread(self.shared.delete, key)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.size_bytes = 0
+
+    def sweep(self):
+        with self.lock:
+            self._sweep(time.monotonic())
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.cache),
+                'bytes': self.size_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'shared_hits': self.shared_hits,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self.cache)
+
+    def _shares(self, namespace):
+        return self.shared is not None and namespace in self.shared_namespaces
+
+    def _get_local(self, key):
+        now = time.monotonic()
+        with self.lock:
+            self._maybe_sweep(now)
+            entry = self.cache.get(key)
+            if entry is not None and entry[1] <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return None
+
+    def _keep_shared(self, key, found):
+        if found is None:
+            return None
+        value, ttl = found
+        self._set_local(key, value, ttl)
+        with self.lock:
+            self.shared_hits += 1
+        return value
+
+    def _delete_local(self, key):
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
+
+    def _set_local(self, key, value, ttl):
+        now = time.monotonic()
+        size = estimate_size(value) if self.max_bytes else 0
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
+            self.cache[key] = (value, now + ttl, size)
+            self.size_bytes += size
+            self._maybe_sweep(now)
+            self._evict()
+
+    def _remove(self, key):
+        _, _, size = self.cache.pop(key)
+        self.size_bytes -= size
+
+    def _maybe_sweep(self, now):
+        if now >= self.next_sweep:
+            self._sweep(now)
+
+    def _sweep(self, now):
+        expired = [key for key, (_, expires_at, _) in self.cache.items() if expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        self.next_sweep = now + self.sweep_interval
+
+    def _evict(self):
+        while self.cache and (
+                (self.max_entries and len(self.cache) > self.max_entries)
+                or (self.max_bytes and self.size_bytes > self.max_bytes)):
+            key = next(iter(self.cache))
+            self._remove(key)
+            self.evictions += 1
+
+
+class SQLiteTier:
+    def __init__(self, path=CACHE_SHARED_SQLITE_PATH):
+        self.path = path
+        self.prefix = f'v{CACHE_FORMAT_VERSION}:'
+        self.lock = threading.Lock()
+        self.connection = None
+        self.writes = 0
+
+    # opened on first use, so importing the bot never touches the disk
+    def connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                               '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)')
+            with connection:
+                connection.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),))
+            self.connection = connection
+        return self.connection
+
+    def get(self, key):
+        try:
+            with self.lock:
+                row = self.connect().execute('SELECT value, expires_at FROM entries WHERE key = ?',
+                                             (self.prefix + key,)).fetchone()
+            if row is None or row[1] <= time.time():
+                return None
+            return decode_value(row[0]), row[1] - time.time()
+        except (sqlite3.Error,) + DECODE_ERRORS:
+            return None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        data = encode_value(value)
+        try:
+            with self.lock, self.connect():
+                self.connection.execute(
+                    'INSERT INTO entries (key, value, expires_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at',
+                    (self.prefix + key, data, now + ttl))
+                self.writes += 1
+                if self.writes % 1000 == 0:
+                    self.connection.execute('DELETE FROM entries WHERE expires_at <= ?', (now,))
+        except sqlite3.Error:
+            pass
+
+    def delete(self, key):
+        try:
+            with self.lock, self.connect():
+                self.connection.execute('DELETE FROM entries WHERE key = ?', (self.prefix + key,))
+        except sqlite3.Error:
+            pass
+
+
+class RedisTier:
+    def __init__(self, url=CACHE_SHARED_REDIS_URL, prefix=CACHE_SHARED_PREFIX):
+        self.client = RespClient(url)
+        self.prefix = f'{prefix}v{CACHE_FORMAT_VERSION}:'
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        try:
+            with self.lock:
+                raw, ttl_ms = self.client.pipeline([('GET', self.prefix + key), ('PTTL', self.prefix + key)])
+        except Exception:
+            return None
+        if raw is None or ttl_ms <= 0:
+            return None
+        try:
+            return decode_value(raw), ttl_ms / 1000
+        except DECODE_ERRORS:
+            return None
+
+    def set(self, key, value, ttl):
+        try:
+            with self.lock:
+                self.client.execute('SET', self.prefix + key, encode_value(value), 'PX', max(1, int(ttl * 1000)))
+        except Exception:
+            pass
+
+    def delete(self, key):
+        try:
+            with self.lock:
+                self.client.execute('DEL', self.prefix + key)
+        except Exception:
+            pass
+
+
+def create_shared_tier():
+    if CACHE_SHARED_TIER == 'sqlite':
+        return SQLiteTier()
+    if CACHE_SHARED_TIER == 'redis':
+        return RedisTier()
+    return None
+
+
+schedule_cache = Cache(ttl=CACHE_SCHEDULE_TTL,
+                       max_entries=CACHE_MAX_ENTRIES,
+                       max_bytes=CACHE_MAX_BYTES,
+                       namespace_ttls={'schedule': CACHE_SCHEDULE_TTL,
+                                       'journal': CACHE_JOURNAL_TTL,
+                                       'semester': CACHE_SEMESTER_TTL,
+                                       'report': CACHE_REPORT_TTL,
+                                       'search': CACHE_SEARCH_TTL},
+                       shared=create_shared_tier(),
+                       shared_namespaces=CACHE_SHARED_NAMESPACES)
+
+auth_cache = Cache(ttl=AUTH_CACHE_TTL,
+                   max_entries=CACHE_MAX_ENTRIES)
+
+message_fingerprints = Cache(ttl=FINGERPRINT_TTL,
+                             max_entries=FINGERPRINT_MAX_ENTRIES)
+
+register_cache('schedule', schedule_cache)
+register_cache('auth', auth_cache)
+register_cache('message_fingerprints', message_fingerprints)
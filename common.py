@@ -0,0 +1,331 @@
+import datetime
+import os
+
+from dotenv import load_dotenv
+from telebot import types
+from telebot.handler_backends import StatesGroup, State
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))
+ORG_URL = os.getenv('ORG_URL', 'https://org.fa.ru').rstrip('/')
+LOGIN_URL = f"{ORG_URL}/login/"
+SCHEDULE_GROUP_URL = f"{ORG_URL}/ruzapi/schedule/group"
+SCHEDULE_TEACHER_URL = f"{ORG_URL}/ruzapi/schedule/person"
+PROFILE_URL = f"{ORG_URL}/bitrix/vuz/api/profile/"
+DISCIPLINES_LIST_URL = f"{ORG_URL}/bitrix/vuz/api/atlog/get_journals_by_contingent"
+DISCIPLINE_URL = f"{ORG_URL}/bitrix/vuz/api/atlog/get_journal"
+SEARCH_URL = f'{ORG_URL}/ruzapi/search'
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+              "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36")
+
+weekday_int_str = {1: 'Понедельник',
+                   2: 'Вторник',
+                   3: 'Среда',
+                   4: 'Четверг',
+                   5: 'Пятница',
+                   6: 'Суббота',
+                   7: 'Воскресенье'}
+
+time_begin_to_pair = {'8:30': 1,
+                      '10:10': 2,
+                      '11:50': 3,
+                      '14:00': 4,
+                      '15:40': 5,
+                      '17:20': 6,
+                      '18:55': 7,
+                      '20:30': 8}
+
+not_auth_commands = [
+    types.BotCommand("/start", "Запустить бота"),
+    types.BotCommand("/menu", "Главное меню"),
+    types.BotCommand("/login", "Войти в аккаунт"),
+    types.BotCommand("/schedule_group", "Показать расписание группы"),
+    types.BotCommand("/schedule_teacher", "Показать расписание преподавателя"),
+    types.BotCommand("/disciplines", "Список баллов и посещений"),
+    types.BotCommand("/unsubscribe", "Отключить уведомления об изменениях"),
+    types.BotCommand("/digest", "Пары на сегодня каждое утро"),
+]
+
+auth_commands = [
+    types.BotCommand("/start", "Запустить бота"),
+    types.BotCommand("/menu", "Главное меню"),
+    types.BotCommand("/logout", "Выйти из аккаунта"),
+    types.BotCommand("/schedule_group", "Показать расписание группы"),
+    types.BotCommand("/schedule_teacher", "Показать расписание преподавателя"),
+    types.BotCommand("/disciplines", "Список баллов и посещений"),
+    types.BotCommand("/report", "Сводка за семестр"),
+    types.BotCommand("/unsubscribe", "Отключить уведомления об изменениях"),
+    types.BotCommand("/digest", "Пары на сегодня каждое утро"),
+]
+
+menu_commands = {
+    'auth': auth_commands,
+    'not_auth': not_auth_commands,
+}
+
+# the replies, keyboards and routing below are shared by the threaded and the asyncio handlers
+SESSION_EXPIRED_TEXT = 'Сессия истекла, введи свои данные заново с помощью команды /start'
+LOGIN_REQUIRED_TEXT = 'Для этой функции нужно войти в аккаунт с помощью команды /login'
+MENU_TEXT = 'Выбери что ты хочешь сделать'
+WELCOME_TEXT = ('Добро пожаловать в FinBot\n'
+                'Функционал Бота:\n'
+                '1. Посмотреть Расписание\n'
+                '2. Посмотреть Расписание преподавателя\n'
+                '3. Посмотреть свои баллы(нужно войти в аккаунт)\n\n'
+                f'{MENU_TEXT}')
+
+ENTITY_TEXTS = {
+    'group': {
+        'ask': 'Введите название группы',
+        'ask_again': 'Пожалуйста, введите название группы ещё раз',
+        'not_found': 'Группа не найдена, попробуй ввести снова',
+        'pick': 'Выбери группу из списка',
+        'confirm': 'Твоя группа это {label}, верно?',
+    },
+    'teacher': {
+        'ask': 'Введите ФИО преподаваетля',
+        'ask_again': 'Пожалуйста, введите ФИО преподавателя ещё раз',
+        'not_found': 'Преподаватель не найден, попробуй ввести снова',
+        'pick': 'Выбери преподавателя из списка',
+        'confirm': 'Ты хочешь посмотреть расписание {label}, верно?',
+    },
+}
+
+ANYWHERE_COMMANDS = ['start', 'menu', 'cancel', 'disciplines', 'report', 'schedule', 'schedule_group',
+                     'schedule_teacher', 'login', 'unsubscribe', 'digest']
+ANYWHERE_HANDLERS = {
+    '/start': 'start',
+    '/menu': 'menu',
+    '/login': 'login',
+    '/cancel': 'cancel',
+    'Баллы и посещения': 'handle_disciplines_list',
+    '/disciplines': 'handle_disciplines_list',
+    '/report': 'handle_report',
+    '/unsubscribe': 'handle_unsubscribe',
+    '/digest': 'handle_digest',
+    'Расписание группы': 'handle_group_choose',
+    '/schedule_group': 'handle_group_choose',
+    'Расписание преподавателя': 'handle_teacher_choose',
+    '/schedule_teacher': 'handle_teacher_choose',
+}
+
+
+def anywhere_handler(text):
+    command = text.split(maxsplit=1)[0] if text.startswith('/') else text
+    return ANYWHERE_HANDLERS.get(command.split('@', 1)[0])
+
+
+class UserStates(StatesGroup):
+    waiting_login = State()
+    waiting_password = State()
+    waiting_code = State()
+    waiting_group = State()
+    waiting_teacher = State()
+    final = State()
+
+
+def upstream_headers(referer):
+    return {
+        "User-Agent": USER_AGENT,
+        "Referer": referer,
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+
+
+def get_current_semester():
+    today = datetime.date.today()
+    year = today.year
+
+    if 9 <= today.month <= 12:
+        start_date = f"{year}-09-01"
+        end_date = f"{year + 1}-02-09"
+
+    elif 2 <= today.month <= 8:
+        start_date = f"{year}-02-10"
+        end_date = f"{year}-08-31"
+
+    else:
+        start_date = f"{year - 1}-09-01"
+        end_date = f"{year}-02-09"
+
+    return start_date, end_date
+
+
+def current_quarter(offset=0):
+    today = datetime.date.today()
+    year = today.year
+
+    if 9 <= today.month <= 10:
+        base_year = year
+        quarter = 1
+    elif today.month == 11 or today.month == 12 or (today.month == 1 and today.day <= 9) or (
+            today.month == 2 and today.day <= 9):
+        if today.month >= 11:
+            base_year = year
+        else:
+            base_year = year - 1
+        quarter = 2
+    elif 2 <= today.month <= 3 or (today.month == 4 and today.day < 1):
+        base_year = year - 1
+        quarter = 3
+    else:
+        base_year = year - 1
+        quarter = 4
+
+    total_quarters = base_year * 4 + (quarter - 1) + offset
+    new_year = total_quarters // 4
+    new_quarter = total_quarters % 4 + 1
+
+    if new_quarter == 1:
+        start_date = f"{new_year}-09-01"
+        end_date = f"{new_year}-10-31"
+    elif new_quarter == 2:
+        start_date = f"{new_year}-11-01"
+        end_date = f"{new_year + 1}-02-09"
+    elif new_quarter == 3:
+        start_date = f"{new_year + 1}-02-10"
+        end_date = f"{new_year + 1}-03-31"
+    else:
+        start_date = f"{new_year + 1}-04-01"
+        end_date = f"{new_year + 1}-08-31"
+
+    return start_date, end_date, new_quarter
+
+
+def create_schedule_group_keyboard(offset=0):
+    markup = types.InlineKeyboardMarkup(row_width=3)
+
+    markup.add(
+        types.InlineKeyboardButton(
+            "⬅️",
+            callback_data=f'schedule_group_{offset - 1}'
+        ),
+        types.InlineKeyboardButton(
+            "🔄",
+            callback_data=f'schedule_group_{offset}'
+        ),
+        types.InlineKeyboardButton(
+            "➡️",
+            callback_data=f'schedule_group_{offset + 1}'
+        )
+    )
+    markup.row(types.InlineKeyboardButton("🔔 Уведомлять об изменениях", callback_data='notify_group'))
+    return markup
+
+
+def create_schedule_teacher_keyboard(offset=0):
+    markup = types.InlineKeyboardMarkup(row_width=3)
+
+    markup.add(
+        types.InlineKeyboardButton(
+            "⬅️",
+            callback_data=f'schedule_teacher_{offset - 1}'
+        ),
+        types.InlineKeyboardButton(
+            "🔄",
+            callback_data=f'schedule_teacher_{offset}'
+        ),
+        types.InlineKeyboardButton(
+            "➡️",
+            callback_data=f'schedule_teacher_{offset + 1}'
+        )
+    )
+    markup.row(types.InlineKeyboardButton("🔔 Уведомлять об изменениях", callback_data='notify_teacher'))
+    return markup
+
+
+def create_discipline_keyboard(discipline_id, quarter, offset=0):
+    markup = types.InlineKeyboardMarkup(row_width=3)
+    if quarter % 2:
+        markup.add(
+            types.InlineKeyboardButton(
+                "🔄",
+                callback_data=f'discipline_{discipline_id}_{offset}'
+            ),
+            types.InlineKeyboardButton(
+                "➡️",
+                callback_data=f'discipline_{discipline_id}_{offset + 1}'
+            )
+        )
+    else:
+        markup.add(
+            types.InlineKeyboardButton(
+                "⬅️",
+                callback_data=f'discipline_{discipline_id}_{offset - 1}'
+            ),
+            types.InlineKeyboardButton(
+                "🔄",
+                callback_data=f'discipline_{discipline_id}_{offset}'
+            ))
+    return markup
+
+
+def create_start_keyboard(authorized):
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    if authorized:
+        markup.add(
+            types.KeyboardButton('Расписание группы'),
+            types.KeyboardButton('Баллы и посещения')
+        )
+    else:
+        markup.add(
+            types.KeyboardButton('Расписание группы'),
+            types.KeyboardButton('Расписание преподавателя'),
+            types.KeyboardButton('Войти в аккаунт'),
+        )
+    return markup
+
+
+def create_menu_keyboard(authorized):
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    if authorized:
+        markup.add(
+            types.KeyboardButton('Расписание группы'),
+            types.KeyboardButton('Расписание преподавателя'),
+            types.KeyboardButton('Баллы и посещения')
+        )
+    else:
+        markup.add(
+            types.KeyboardButton('Расписание группы'),
+            types.KeyboardButton('Расписание преподавателя'),
+            types.KeyboardButton('Войти в аккаунт'),
+        )
+    return markup
+
+
+def create_confirm_keyboard(kind):
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(types.InlineKeyboardButton('Да, верно', callback_data=f"schedule_{kind}_0"),
+               types.InlineKeyboardButton('Нет, выбрать заново', callback_data=f"{kind}_incorrect"))
+    return markup
+
+
+def create_candidates_keyboard(kind, candidates):
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for candidate in candidates:
+        text = candidate['label']
+        if candidate.get('description'):
+            text = f"{text} ({candidate['description']})"
+        markup.add(types.InlineKeyboardButton(text[:64], callback_data=f"pick_{kind}_{candidate['id']}"))
+    markup.add(types.InlineKeyboardButton('Нет нужного, ввести заново', callback_data=f'{kind}_incorrect'))
+    return markup
+
+
+def get_current_monday():
+    today = datetime.datetime.now().date()
+    return today - datetime.timedelta(days=today.weekday())
+
+
+def get_week_dates(offset=0):
+    today = datetime.datetime.now().date()
+    monday = today - datetime.timedelta(days=today.weekday()) + datetime.timedelta(weeks=offset)
+    sunday = monday + datetime.timedelta(days=6)
+    return monday, sunday
+
+
+def week_cache_key(kind, entity_id, monday):
+    return f"{kind}_{entity_id}_{monday.isoformat()}"
@@ -0,0 +1,222 @@
+import asyncio
+import datetime
+import heapq
+import os
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from common import SCHEDULE_GROUP_URL
+from metrics import register_queue
+from notifications import deliver, deliver_async
+from render import format_day_digest
+from search_index import search_index
+from semester import fetch_week, fetch_week_async
+from subscriptions import subscriptions
+
+DIGEST_ENABLED = os.getenv('DIGEST_ENABLED', '1') == '1'
+DIGEST_UTC_OFFSET = float(os.getenv('DIGEST_UTC_OFFSET', 3))
+DIGEST_SYNC_INTERVAL = float(os.getenv('DIGEST_SYNC_INTERVAL', 30))
+DIGEST_MAX_DELAY = int(os.getenv('DIGEST_MAX_DELAY', 2 * 3600))
+DIGEST_RETRY_DELAY = int(os.getenv('DIGEST_RETRY_DELAY', 60))
+DIGEST_CONCURRENCY = int(os.getenv('DIGEST_CONCURRENCY', 4))
+
+DIGEST_TIMEZONE = datetime.timezone(datetime.timedelta(hours=DIGEST_UTC_OFFSET))
+# rows another process wrote in the same instant as the last one seen are read once more
+SYNC_OVERLAP = 5
+DIGEST_USAGE = ("Каждый день пришлю пары на сегодня для последней выбранной группы\n"
+                "/digest 7:30 - включить или изменить время\n"
+                "/digest off - отключить")
+
+
+def local_now():
+    return datetime.datetime.now(DIGEST_TIMEZONE)
+
+
+def parse_send_at(text):
+    match = re.fullmatch(r'(\d{1,2})[:.](\d{2})', text.strip())
+    if match is None:
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+
+def format_send_at(send_at):
+    return f'{send_at // 60}:{send_at % 60:02d}'
+
+
+# the reply to "/digest [time|off]"; group_id is the group last picked in the chat
+def digest_command(chat_id, argument, group_id):
+    if argument.lower() == 'off':
+        if subscriptions.cancel_digest(chat_id):
+            return 'Утренняя рассылка расписания отключена'
+        return 'Утренняя рассылка расписания не была включена'
+    if not argument:
+        digest = subscriptions.digest(chat_id)
+        if digest is None:
+            return DIGEST_USAGE
+        return f"Каждый день в {format_send_at(digest[3])} присылаю пары группы {digest[2]}\n{DIGEST_USAGE}"
+    send_at = parse_send_at(argument)
+    if send_at is None:
+        return DIGEST_USAGE
+    if group_id is None:
+        return 'Сначала выбери группу с помощью команды /schedule_group'
+    label = search_index.label('group', group_id) or str(group_id)
+    subscriptions.set_digest(chat_id, group_id, label, send_at)
+    return f"Буду присылать пары группы {label} каждый день в {format_send_at(send_at)}"
+
+
+def next_delivery(send_at, last_sent, now):
+    day = now.date()
+    due = datetime.datetime.combine(day, datetime.time(), DIGEST_TIMEZONE) + datetime.timedelta(minutes=send_at)
+    # a morning missed by more than DIGEST_MAX_DELAY, e.g. during a restart, is skipped
+    if last_sent == day.isoformat() or (now - due).total_seconds() > DIGEST_MAX_DELAY:
+        due += datetime.timedelta(days=1)
+    return due.timestamp()
+
+
+def delivery_date(due):
+    return datetime.datetime.fromtimestamp(due, DIGEST_TIMEZONE).date()
+
+
+def deliver_batch(group_id, date, label, chat_ids, send):
+    try:
+        lessons = fetch_week('group', SCHEDULE_GROUP_URL, group_id, date, date)
+    except Exception:
+        return False
+    if lessons:
+        deliver(chat_ids, format_day_digest(label, date, lessons), send, subscriptions.cancel_digest)
+    subscriptions.mark_digests_sent(chat_ids, date)
+    return True
+
+
+async def deliver_batch_async(group_id, date, label, chat_ids, send):
+    try:
+        lessons = await fetch_week_async('group', SCHEDULE_GROUP_URL, group_id, date, date)
+    except Exception:
+        return False
+    if lessons:
+        await deliver_async(chat_ids, format_day_digest(label, date, lessons), send, subscriptions.cancel_digest)
+    subscriptions.mark_digests_sent(chat_ids, date)
+    return True
+
+
+# a heap of (due, chat_id, row); a row replaced in entries leaves its old heap item behind, which is skipped
+class DigestScheduler:
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.synced_at = 0
+
+    def sync(self):
+        now = local_now()
+        for row in subscriptions.digests_changed(self.synced_at - SYNC_OVERLAP):
+            chat_id, _, _, send_at, last_sent, enabled, updated_at = row
+            self.synced_at = max(self.synced_at, updated_at)
+            known = self.entries.get(chat_id)
+            if known is not None and known[6] == updated_at:
+                continue
+            if not enabled:
+                self.entries.pop(chat_id, None)
+                continue
+            self.entries[chat_id] = row
+            heapq.heappush(self.heap, (next_delivery(send_at, last_sent, now), chat_id, row))
+
+    # due digests grouped by (group_id, date): one fetch and one render per group
+    def take_due(self, now):
+        batches = {}
+        while self.heap and self.heap[0][0] <= now:
+            due, chat_id, row = heapq.heappop(self.heap)
+            if self.entries.get(chat_id) is not row:
+                continue
+            batches.setdefault((row[1], delivery_date(due)), []).append((due, chat_id, row))
+        return batches
+
+    def finish(self, date, items, delivered):
+        now = time.time()
+        for due, chat_id, row in items:
+            if self.entries.get(chat_id) is not row:
+                continue
+            if delivered:
+                row = row[:4] + (date.isoformat(),) + row[5:]
+                self.entries[chat_id] = row
+            elif now - due < DIGEST_MAX_DELAY:
+                heapq.heappush(self.heap, (now + DIGEST_RETRY_DELAY, chat_id, row))
+                continue
+            heapq.heappush(self.heap, (next_delivery(row[3], row[4], local_now()), chat_id, row))
+
+    def wait_time(self):
+        if not self.heap:
+            return DIGEST_SYNC_INTERVAL
+        return min(DIGEST_SYNC_INTERVAL, max(0.5, self.heap[0][0] - time.time()))
+
+    def run_once(self, send):
+        self.sync()
+        batches = list(self.take_due(time.time()).items())
+
+        def run(batch):
+            (group_id, date), items = batch
+            try:
+                return deliver_batch(group_id, date, items[0][2][2], [chat_id for _, chat_id, _ in items], send)
+            except Exception:
+                return False
+
+        with ThreadPoolExecutor(max_workers=DIGEST_CONCURRENCY, thread_name_prefix='digest') as pool:
+            results = list(pool.map(run, batches))
+        for ((_, date), items), delivered in zip(batches, results):
+            self.finish(date, items, delivered)
+
+    async def run_once_async(self, send):
+        self.sync()
+        batches = list(self.take_due(time.time()).items())
+        semaphore = asyncio.Semaphore(DIGEST_CONCURRENCY)
+
+        async def run(batch):
+            (group_id, date), items = batch
+            async with semaphore:
+                try:
+                    return await deliver_batch_async(group_id, date, items[0][2][2],
+                                                     [chat_id for _, chat_id, _ in items], send)
+                except Exception:
+                    return False
+
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+        for ((_, date), items), delivered in zip(batches, results):
+            self.finish(date, items, delivered)
+
+
+def start_digest_scheduler(send):
+    if not DIGEST_ENABLED:
+        return None
+
+    def run():
+        while True:
+            try:
+                digest_scheduler.run_once(send)
+            except Exception:
+                pass
+            time.sleep(digest_scheduler.wait_time())
+
+    thread = threading.Thread(target=run, name='digest', daemon=True)
+    thread.start()
+    return thread
+
+
+async def run_digest_scheduler_async(send):
+    if not DIGEST_ENABLED:
+        return
+    while True:
+        try:
+            await digest_scheduler.run_once_async(send)
+        except Exception:
+            pass
+        await asyncio.sleep(digest_scheduler.wait_time())
+
+
+digest_scheduler = DigestScheduler()
+
+register_queue('digest', lambda: len(digest_scheduler.heap))
@@ -0,0 +1,166 @@
+import asyncio
+import datetime
+import random
+import secrets
+import zlib
+
+from aiohttp import web
+
+from bench_render import BEGIN_TIMES
+from otp_sum_checker import otpchksum
+
+UNAUTHORIZED_PAGE = '<html><head><title>Unauthorized</title></head></html>'
+
+
+def parse_date(value):
+    return datetime.date.fromisoformat(value.replace('.', '-'))
+
+
+def group_label(i):
+    return f'ПИ{i}-1'
+
+
+def teacher_label(i):
+    return f'Преподаватель {i}'
+
+
+class FakeOrg:
+    def __init__(self, latency=0.05, jitter=0.2, lessons_per_day=4, disciplines=12, journal_lessons=30,
+                 groups=50, teachers=20, search_results=20):
+        self.latency = latency
+        self.jitter = jitter
+        self.lessons_per_day = lessons_per_day
+        self.disciplines = disciplines
+        self.journal_lessons = journal_lessons
+        self.search_results = search_results
+        self.labels = {'group': [group_label(i) for i in range(groups)],
+                       'person': [teacher_label(i) for i in range(teachers)]}
+        self.sessions = {}
+        self.requests = {}
+        self.runner = None
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post('/login/', self.handle_login)
+        app.router.add_get('/bitrix/vuz/api/profile/', self.handle_profile)
+        app.router.add_post('/bitrix/vuz/api/atlog/get_journals_by_contingent', self.handle_disciplines)
+        app.router.add_post('/bitrix/vuz/api/atlog/get_journal', self.handle_journal)
+        app.router.add_post('/ruzapi/schedule/{kind}/{entity_id}', self.handle_schedule)
+        app.router.add_get('/ruzapi/search', self.handle_search)
+        return app
+
+    async def delay(self, endpoint):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def session(self, request):
+        return self.sessions.get(request.cookies.get('PHPSESSID'))
+
+    def authorized(self, request):
+        session = self.session(request)
+        return session is not None and session['authorized']
+
+    async def handle_login(self, request):
+        await self.delay('login')
+        form = await request.post()
+        if form.get('TYPE') == 'OTP':
+            session = self.session(request)
+            code = form.get('OTP_CODE', '')
+            if (session is not None and form.get('sessid') == session['sessid']
+                    and form.get('OTP_CODE_CHECKSUM0') == otpchksum(code)):
+                session['authorized'] = True
+            return web.Response(text='<html>OK</html>', content_type='text/html')
+
+        user_login = form.get('USER_LOGIN', '')
+        if not user_login.isdigit() or form.get('USER_PASSWORD') == 'wrong':
+            return web.Response(text='<html>Неверный логин или пароль</html>', content_type='text/html')
+        session_cookie = secrets.token_hex(8)
+        sessid = secrets.token_hex(8)
+        self.sessions[session_cookie] = {'sessid': sessid, 'student_id': int(user_login), 'authorized': False}
+        response = web.Response(text=(f"<html>Код отправлен на student{user_login}@edu.fa.ru"
+                                      f"<script>BX.message({{'bitrix_sessid':'{sessid}'}})</script></html>"),
+                                content_type='text/html')
+        response.set_cookie('PHPSESSID', session_cookie)
+        return response
+
+    async def handle_profile(self, request):
+        await self.delay('profile')
+        if not self.authorized(request):
+            return web.Response(text=UNAUTHORIZED_PAGE, content_type='text/html')
+        return web.json_response([{'id': self.session(request)['student_id']}])
+
+    async def handle_disciplines(self, request):
+        await self.delay('disciplines_list')
+        if not self.authorized(request):
+            return web.Response(text=UNAUTHORIZED_PAGE, content_type='text/html')
+        return web.json_response({
+            'attendance_percent': 87,
+            'disciplines': [{'discipline_id': 100 + i,
+                             'discipline_name': f'Дисциплина {i}',
+                             'teachers': [{'fio': 'Иванов Иван Иванович'}]}
+                            for i in range(self.disciplines)],
+        })
+
+    async def handle_journal(self, request):
+        await self.delay('discipline')
+        if not self.authorized(request):
+            return web.Response(text=UNAUTHORIZED_PAGE, content_type='text/html')
+        body = await request.json()
+        start_date = parse_date(body['date_from'])
+        lessons = []
+        student_lessons = {}
+        for i in range(self.journal_lessons):
+            lessons.append({
+                'id': i,
+                'hold_at': (start_date + datetime.timedelta(days=i * 2)).isoformat(),
+                'start_at': '10:10:00',
+                'finish_at': '11:40:00',
+                'kind_of_work': 'Семинар',
+                'profile_fio': 'Иванов Иван Иванович',
+            })
+            student_lessons[str(i)] = {'attendance': {'visit_status_id': 2 if i % 5 else 4},
+                                       'marks': [{'mark_val': 1.5}]}
+        rows = {str(body['student_id']): {'mark_sum': 1.5 * len(lessons), 'lessons': student_lessons}}
+        return web.json_response({'lessons': lessons, 'rows': rows})
+
+    async def handle_schedule(self, request):
+        await self.delay('schedule_' + request.match_info['kind'])
+        start_date = parse_date(request.query['start'])
+        end_date = parse_date(request.query['finish'])
+        lessons = []
+        day = start_date
+        while day <= end_date:
+            if day.weekday() < 6:
+                for i in range(self.lessons_per_day):
+                    lessons.append({
+                        'date': day.strftime('%Y.%m.%d'),
+                        'discipline': f'Дисциплина {i}',
+                        'kindOfWork': 'Лекции' if i % 2 else 'Практические (семинарские) занятия',
+                        'lecturer': 'Иванов Иван Иванович',
+                        'beginLesson': BEGIN_TIMES[i % len(BEGIN_TIMES)],
+                        'endLesson': '10:00',
+                        'auditorium': f'Ленинградский пр-т, 49/2, ауд. {400 + i}',
+                    })
+            day += datetime.timedelta(days=1)
+        return web.json_response(lessons)
+
+    def catalogue(self, search_type):
+        return [{'id': zlib.crc32(f'{search_type}:{label}'.encode()), 'label': label, 'description': ''}
+                for label in self.labels[search_type]]
+
+    async def handle_search(self, request):
+        await self.delay('search')
+        term = request.query.get('term', '').lower()
+        items = [item for item in self.catalogue(request.query.get('type', 'group')) if term in item['label'].lower()]
+        return web.json_response(items[:self.search_results])
+
+    async def start(self, host='localhost', port=18180):
+        self.runner = web.AppRunner(self.create_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,163 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import aiohttp
+from aiohttp import web
+
+from webhook import WEBHOOK_PATH, WEBHOOK_SECRET, SECRET_HEADER
+
+
+class FakeTelegramClient:
+    def __init__(self, base_url, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH):
+        self.url = base_url.rstrip('/') + path
+        self.secret = secret
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.session = None
+
+    def user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+    def message(self, chat_id, text, user_id=None):
+        return {
+            'update_id': next(self.update_ids),
+            'message': {
+                'message_id': next(self.message_ids),
+                'from': self.user(user_id or chat_id),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'date': int(time.time()),
+                'text': text,
+            },
+        }
+
+    def callback(self, chat_id, data, message_id, user_id=None):
+        return {
+            'update_id': next(self.update_ids),
+            'callback_query': {
+                'id': str(next(self.update_ids)),
+                'from': self.user(user_id or chat_id),
+                'chat_instance': str(chat_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'date': int(time.time()),
+                    'text': '',
+                },
+            },
+        }
+
+    async def post(self, payload, secret=None):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        headers = {SECRET_HEADER: self.secret if secret is None else secret}
+        async with self.session.post(self.url, json=payload, headers=headers) as response:
+            return response.status
+
+    async def send_message(self, chat_id, text, user_id=None):
+        return await self.post(self.message(chat_id, text, user_id))
+
+    async def press(self, chat_id, data, message_id, user_id=None):
+        return await self.post(self.callback(chat_id, data, message_id, user_id))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, jitter=0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.message_ids = itertools.count(1000)
+        self.last_messages = {}
+        self.waiters = {}
+        self.calls = {}
+        self.runner = None
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_call)
+        return app
+
+    def message(self, chat_id, params, message_id=None):
+        message = {
+            'message_id': message_id or next(self.message_ids),
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'},
+            'chat': {'id': chat_id, 'type': 'private'},
+            'date': int(time.time()),
+            'text': params.get('text', ''),
+        }
+        markup = json.loads(params.get('reply_markup') or '{}')
+        # only inline keyboards are echoed back with the message
+        if 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        return message
+
+    def result(self, method, chat_id, params):
+        if method == 'sendMessage':
+            message = self.message(chat_id, params)
+            self.last_messages[chat_id] = message['message_id']
+            return message
+        if method in ('editMessageText', 'editMessageReplyMarkup'):
+            return self.message(chat_id, params, int(params['message_id']))
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'bench_bot'}
+        if method == 'getUpdates':
+            return []
+        return True
+
+    async def handle_call(self, request):
+        method = request.match_info['method']
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        result = self.result(method, chat_id, params)
+        if chat_id is not None:
+            self.notify(chat_id, method, params)
+        return web.json_response({'ok': True, 'result': result})
+
+    def notify(self, chat_id, method, params):
+        content = f"{params.get('text', '')}{params.get('reply_markup', '')}"
+        for waiter in list(self.waiters.get(chat_id, ())):
+            methods, marker, future = waiter
+            if method in methods and marker in content and not future.done():
+                future.set_result(time.perf_counter())
+                self.waiters[chat_id].remove(waiter)
+
+    # register the expectation before the update is sent, the answer may arrive before it is awaited
+    def expect(self, chat_id, marker, methods=('sendMessage', 'editMessageText')):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(chat_id, []).append((methods, marker, future))
+        return future
+
+    async def wait(self, chat_id, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.waiters[chat_id] = [waiter for waiter in self.waiters[chat_id] if waiter[2] is not future]
+
+    def last_message(self, chat_id):
+        return self.last_messages.get(chat_id)
+
+    async def start(self, host='localhost', port=18181):
+        # the threaded bot sends parameters in the query string, long schedules exceed the default line limit
+        self.runner = web.AppRunner(self.create_app(), max_line_size=1 << 20)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
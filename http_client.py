@@ -0,0 +1,92 @@
+import os
+import time
+
+import aiohttp
+import requests
+
+from requests.adapters import HTTPAdapter
+from metrics import endpoint_name, observe_upstream
+
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 20))
+
+shared_adapter = HTTPAdapter(pool_connections=max(1, HTTP_POOL_LIMIT // HTTP_POOL_LIMIT_PER_HOST),
+                             pool_maxsize=HTTP_POOL_LIMIT_PER_HOST,
+                             pool_block=True)
+
+shared_connector = None
+
+
+class PooledSession(requests.Session):
+    def __init__(self, cookies=None):
+        super().__init__()
+        self.mount('https://', shared_adapter)
+        self.mount('http://', shared_adapter)
+        if cookies:
+            self.cookies = requests.utils.cookiejar_from_dict(cookies)
+
+    def request(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            observe_upstream(endpoint_name(url), status, time.perf_counter() - started)
+
+    def export_cookies(self):
+        return requests.utils.dict_from_cookiejar(self.cookies)
+
+    def close(self):
+        # the adapters are shared between every session and must outlive it
+        pass
+
+
+def open_session(cookies=None):
+    return PooledSession(cookies)
+
+
+async def on_request_start(session, context, params):
+    context.endpoint = endpoint_name(str(params.url))
+    context.started = time.perf_counter()
+
+
+async def on_request_end(session, context, params):
+    observe_upstream(context.endpoint, params.response.status, time.perf_counter() - context.started)
+
+
+async def on_request_exception(session, context, params):
+    observe_upstream(context.endpoint, 'error', time.perf_counter() - context.started)
+
+
+trace_config = aiohttp.TraceConfig()
+trace_config.on_request_start.append(on_request_start)
+trace_config.on_request_end.append(on_request_end)
+trace_config.on_request_exception.append(on_request_exception)
+
+
+def get_connector():
+    global shared_connector
+    if shared_connector is None or shared_connector.closed:
+        shared_connector = aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT,
+                                                limit_per_host=HTTP_POOL_LIMIT_PER_HOST)
+    return shared_connector
+
+
+def open_async_session(cookies=None):
+    return aiohttp.ClientSession(connector=get_connector(),
+                                 connector_owner=False,
+                                 cookies=cookies,
+                                 trace_configs=[trace_config])
+
+
+def export_async_cookies(session):
+    return {cookie.key: cookie.value for cookie in session.cookie_jar}
+
+
+async def close_connector():
+    global shared_connector
+    if shared_connector is not None:
+        await shared_connector.close()
+        shared_connector = None
@@ -0,0 +1,45 @@
+import datetime
+import functools
+import sys
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_date(date_str):
+    return datetime.date(*map(int, date_str.split('.')))
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Lesson:
+    __slots__ = ('date', 'begin', 'end', 'discipline', 'kind_of_work', 'lecturer', 'auditorium')
+
+    def __init__(self, date, begin, end, discipline, kind_of_work, lecturer, auditorium):
+        self.date = date
+        self.begin = intern(begin)
+        self.end = intern(end)
+        self.discipline = intern(discipline)
+        self.kind_of_work = intern(kind_of_work)
+        self.lecturer = intern(lecturer)
+        self.auditorium = intern(auditorium)
+
+    # loading goes through __init__, so strings are interned again in the process that unpickles
+    def __reduce__(self):
+        return Lesson, (self.date, self.begin, self.end, self.discipline, self.kind_of_work, self.lecturer,
+                        self.auditorium)
+
+    def __eq__(self, other):
+        return isinstance(other, Lesson) and self.__reduce__()[1] == other.__reduce__()[1]
+
+    def __hash__(self):
+        return hash(self.__reduce__()[1])
+
+    @classmethod
+    def from_api(cls, item):
+        return cls(parse_date(item['date']), item['beginLesson'], item['endLesson'], item['discipline'],
+                   item['kindOfWork'], item['lecturer'], item['auditorium'])
+
+
+def parse_lessons(items):
+    return [Lesson.from_api(item) for item in items or []]
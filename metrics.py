@@ -0,0 +1,298 @@
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import (LOGIN_URL, SCHEDULE_GROUP_URL, SCHEDULE_TEACHER_URL, PROFILE_URL, DISCIPLINES_LIST_URL,
+                    DISCIPLINE_URL, SEARCH_URL)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# longest prefix first: DISCIPLINE_URL is a prefix of DISCIPLINES_LIST_URL
+UPSTREAM_ENDPOINTS = sorted([('login', LOGIN_URL),
+                             ('schedule_group', SCHEDULE_GROUP_URL),
+                             ('schedule_teacher', SCHEDULE_TEACHER_URL),
+                             ('profile', PROFILE_URL),
+                             ('disciplines_list', DISCIPLINES_LIST_URL),
+                             ('discipline', DISCIPLINE_URL),
+                             ('search', SEARCH_URL)],
+                            key=lambda endpoint: len(endpoint[1]), reverse=True)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.create_child())
+        return child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.render_samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def create_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render_samples(self):
+        for values, child in list(self.children.items()):
+            yield f'{self.name}{format_labels(self.labelnames, values)} {format_value(child.value)}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render_samples(self):
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, values, ('le', format_value(bound)))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labelnames, values)
+            yield f'{self.name}_sum{labels} {format_value(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    # values are read from callbacks at scrape time, so nothing is paid on the hot path
+    def set_function(self, values, collect):
+        with self.lock:
+            self.children[tuple(values)] = collect
+
+    def render_samples(self):
+        for values, collect in list(self.children.items()):
+            try:
+                value = collect()
+            except Exception:
+                continue
+            yield f'{self.name}{format_labels(self.labelnames, values)} {format_value(value)}'
+
+
+class CounterFunction(Gauge):
+    kind = 'counter'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def counter_function(self, name, documentation, labelnames=()):
+        return self.register(CounterFunction(name, documentation, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_duration = registry.histogram('bot_handler_duration_seconds', 'Time spent in a Telegram update handler',
+                                      ('handler',))
+handler_errors = registry.counter('bot_handler_errors_total', 'Exceptions raised by a Telegram update handler',
+                                  ('handler',))
+upstream_duration = registry.histogram('upstream_request_duration_seconds', 'Latency of outgoing HTTP requests',
+                                       ('endpoint',))
+upstream_requests = registry.counter('upstream_requests_total', 'Outgoing HTTP requests by status',
+                                     ('endpoint', 'status'))
+telegram_errors = registry.counter('telegram_api_errors_total', 'Telegram Bot API calls that returned an error',
+                                   ('method', 'code'))
+queue_depth = registry.gauge('bot_queue_depth', 'Items waiting in an internal queue', ('queue',))
+cache_metrics = {
+    'entries': registry.gauge('cache_entries', 'Entries held by a cache', ('cache',)),
+    'bytes': registry.gauge('cache_bytes', 'Estimated size of a cache in bytes', ('cache',)),
+    'hit_ratio': registry.gauge('cache_hit_ratio', 'Share of cache lookups that found an entry', ('cache',)),
+    'hits': registry.counter_function('cache_hits_total', 'Cache lookups that found an entry', ('cache',)),
+    'misses': registry.counter_function('cache_misses_total', 'Cache lookups that found nothing', ('cache',)),
+    'evictions': registry.counter_function('cache_evictions_total', 'Entries evicted to respect limits', ('cache',)),
+}
+
+
+def endpoint_name(url):
+    for name, prefix in UPSTREAM_ENDPOINTS:
+        if url.startswith(prefix):
+            return name
+    return 'other'
+
+
+def observe_upstream(endpoint, status, seconds):
+    upstream_duration.labels(endpoint).observe(seconds)
+    upstream_requests.labels(endpoint, str(status)).inc()
+
+
+def count_telegram_error(method, error):
+    code = getattr(error, 'error_code', None)
+    if code is not None:
+        telegram_errors.labels(method, str(code)).inc()
+
+
+def instrument(func, name):
+    duration = handler_duration.labels(name)
+    errors = handler_errors.labels(name)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                duration.observe(time.perf_counter() - started)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_handlers(bot):
+    for attribute, handlers in vars(bot).items():
+        if not attribute.endswith('_handlers') or not isinstance(handlers, list):
+            continue
+        for handler in handlers:
+            if isinstance(handler, dict) and 'function' in handler:
+                handler['function'] = instrument(handler['function'], handler['function'].__name__)
+
+
+def register_cache(name, cache):
+    for field, metric in cache_metrics.items():
+        metric.set_function((name,), lambda field=field: cache.stats()[field])
+
+
+def register_queue(name, depth):
+    queue_depth.set_function((name,), depth)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(offset=0, host=METRICS_HOST, port=METRICS_PORT):
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port + offset), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
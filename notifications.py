@@ -0,0 +1,214 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from common import SCHEDULE_GROUP_URL, SCHEDULE_TEACHER_URL, get_current_monday
+from lessons import Lesson
+from prefetch import upstream_is_busy
+from render import format_schedule_changes
+from search_index import search_index
+from semester import replace_window
+from subscriptions import subscriptions
+from upstream import fetch_schedule, fetch_schedule_async
+
+NOTIFY_ENABLED = os.getenv('NOTIFY_ENABLED', '1') == '1'
+NOTIFY_POLL_INTERVAL = int(os.getenv('NOTIFY_POLL_INTERVAL', 1800))
+NOTIFY_TICK = float(os.getenv('NOTIFY_TICK', 30))
+NOTIFY_WEEKS = int(os.getenv('NOTIFY_WEEKS', 2))
+NOTIFY_BATCH = int(os.getenv('NOTIFY_BATCH', 50))
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', 2))
+NOTIFY_SEND_WORKERS = int(os.getenv('NOTIFY_SEND_WORKERS', 4))
+NOTIFY_MAX_CHANGES = int(os.getenv('NOTIFY_MAX_CHANGES', 20))
+
+SCHEDULE_URLS = {'group': SCHEDULE_GROUP_URL, 'teacher': SCHEDULE_TEACHER_URL}
+
+
+def poll_window():
+    monday = get_current_monday()
+    return monday, monday + datetime.timedelta(weeks=NOTIFY_WEEKS, days=-1)
+
+
+def lesson_row(lesson):
+    return [lesson.date.isoformat(), lesson.begin, lesson.end, lesson.discipline, lesson.kind_of_work,
+            lesson.lecturer, lesson.auditorium]
+
+
+def row_lesson(row):
+    return Lesson(datetime.date.fromisoformat(row[0]), *row[1:])
+
+
+def lesson_order(lesson):
+    return lesson.discipline, lesson.kind_of_work, lesson.lecturer, lesson.auditorium, lesson.end
+
+
+def lesson_slots(lessons, start_date, end_date):
+    slots = {}
+    for lesson in lessons:
+        if start_date <= lesson.date <= end_date:
+            slots.setdefault((lesson.date, lesson.begin.zfill(5)), set()).add(lesson)
+    return slots
+
+
+# lessons are matched by their slot, so a moved room reads as one change rather than two
+def diff_lessons(old, new, start_date, end_date):
+    before = lesson_slots(old, start_date, end_date)
+    after = lesson_slots(new, start_date, end_date)
+    changes = []
+    for slot in sorted(before.keys() | after.keys()):
+        removed = before.get(slot, set()) - after.get(slot, set())
+        added = after.get(slot, set()) - before.get(slot, set())
+        if removed or added:
+            changes.append((slot[0], sorted(removed, key=lesson_order), sorted(added, key=lesson_order)))
+    return changes
+
+
+def record_snapshot(kind, entity_id, start_date, end_date, lessons):
+    snapshot = subscriptions.snapshot(kind, entity_id)
+    if snapshot is None:
+        subscriptions.save_snapshot(kind, entity_id, start_date, end_date, [lesson_row(lesson) for lesson in lessons])
+        return []
+    old_start, old_end, rows = snapshot
+    # only days both polls covered, from today on: a new week rolling in is not a change
+    compare_start, compare_end = max(old_start, datetime.date.today()), min(old_end, end_date)
+    old_lessons = [row_lesson(row) for row in rows]
+    if not lessons and lesson_slots(old_lessons, compare_start, compare_end):
+        # an empty answer for a busy timetable is far more often an upstream hiccup than a cancelled fortnight
+        subscriptions.touch_snapshot(kind, entity_id)
+        return []
+    subscriptions.save_snapshot(kind, entity_id, start_date, end_date, [lesson_row(lesson) for lesson in lessons])
+    changes = diff_lessons(old_lessons, lessons, compare_start, compare_end)
+    if changes:
+        replace_window(kind, entity_id, start_date, end_date, lessons)
+    return changes
+
+
+# the answer to a tap on the bell under a week view: (text, show_alert)
+def toggle_subscription(chat_id, kind, entity_id):
+    if entity_id is None:
+        return "Сначала выбери расписание", False
+    if subscriptions.subscribed(chat_id, kind, entity_id):
+        subscriptions.unsubscribe(chat_id, kind, entity_id)
+        return "Уведомления об изменениях отключены", False
+    label = search_index.label('person' if kind == 'teacher' else 'group', entity_id) or str(entity_id)
+    subscriptions.subscribe(chat_id, kind, entity_id, label)
+    return f"Пришлю сообщение, если расписание {label} изменится", True
+
+
+def unsubscribe_command(chat_id):
+    if subscriptions.unsubscribe(chat_id):
+        return 'Уведомления об изменениях в расписании отключены'
+    return 'Ты не подписан на изменения в расписании'
+
+
+def undeliverable(error):
+    return getattr(error, 'error_code', None) == 403
+
+
+def deliver(chat_ids, text, send, blocked):
+    def deliver_one(chat_id):
+        try:
+            send(chat_id, text)
+        except Exception as e:
+            if undeliverable(e):
+                blocked(chat_id)
+
+    # the outbound queue paces the bulk sends, the workers only keep it fed
+    with ThreadPoolExecutor(max_workers=NOTIFY_SEND_WORKERS, thread_name_prefix='notify-send') as pool:
+        list(pool.map(deliver_one, chat_ids))
+
+
+async def deliver_async(chat_ids, text, send, blocked):
+    semaphore = asyncio.Semaphore(NOTIFY_SEND_WORKERS)
+
+    async def deliver_one(chat_id):
+        async with semaphore:
+            try:
+                await send(chat_id, text)
+            except Exception as e:
+                if undeliverable(e):
+                    blocked(chat_id)
+
+    await asyncio.gather(*(deliver_one(chat_id) for chat_id in chat_ids))
+
+
+def poll_entity(kind, entity_id, label, send):
+    start_date, end_date = poll_window()
+    lessons = fetch_schedule(SCHEDULE_URLS[kind], entity_id, start_date, end_date)
+    changes = record_snapshot(kind, entity_id, start_date, end_date, lessons)
+    if changes:
+        text = format_schedule_changes(label, changes, NOTIFY_MAX_CHANGES)
+        deliver(subscriptions.subscribers(kind, entity_id), text, send, subscriptions.unsubscribe)
+
+
+async def poll_entity_async(kind, entity_id, label, send):
+    start_date, end_date = poll_window()
+    lessons = await fetch_schedule_async(SCHEDULE_URLS[kind], entity_id, start_date, end_date)
+    # the snapshot store and the cache tiers behind replace_window block, so they stay off the event loop
+    changes = await asyncio.to_thread(record_snapshot, kind, entity_id, start_date, end_date, lessons)
+    if changes:
+        text = format_schedule_changes(label, changes, NOTIFY_MAX_CHANGES)
+        await deliver_async(subscriptions.subscribers(kind, entity_id), text, send, subscriptions.unsubscribe)
+
+
+def due_entities():
+    subscriptions.prune_snapshots()
+    return subscriptions.due(time.time() - NOTIFY_POLL_INTERVAL, NOTIFY_BATCH)
+
+
+# one poll per distinct group or teacher, however many chats follow it
+def poll_due(send):
+    def poll(entity):
+        try:
+            poll_entity(*entity, send)
+        except Exception:
+            pass
+
+    with ThreadPoolExecutor(max_workers=NOTIFY_CONCURRENCY, thread_name_prefix='notify') as pool:
+        list(pool.map(poll, due_entities()))
+
+
+async def poll_due_async(send):
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+
+    async def poll(entity):
+        async with semaphore:
+            try:
+                await poll_entity_async(*entity, send)
+            except Exception:
+                pass
+
+    await asyncio.gather(*(poll(entity) for entity in due_entities()))
+
+
+def start_notifier(send):
+    if not NOTIFY_ENABLED:
+        return None
+
+    def run():
+        while True:
+            try:
+                if not upstream_is_busy():
+                    poll_due(send)
+            except Exception:
+                pass
+            time.sleep(NOTIFY_TICK)
+
+    thread = threading.Thread(target=run, name='notifier', daemon=True)
+    thread.start()
+    return thread
+
+
+async def run_notifier_async(send):
+    if not NOTIFY_ENABLED:
+        return
+    while True:
+        try:
+            if not upstream_is_busy():
+                await poll_due_async(send)
+        except Exception:
+            pass
+        await asyncio.sleep(NOTIFY_TICK)
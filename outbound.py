@@ -0,0 +1,438 @@
+import asyncio
+import collections
+import concurrent.futures
+import inspect
+import itertools
+import os
+import threading
+import time
+
+import telebot
+from telebot.async_telebot import AsyncTeleBot
+
+from metrics import count_telegram_error, register_queue
+
+OUTBOUND_QUEUE_ENABLED = os.getenv('OUTBOUND_QUEUE_ENABLED', '1') == '1'
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+OUTBOUND_GLOBAL_BURST = float(os.getenv('OUTBOUND_GLOBAL_BURST', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', 5))
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', 4))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+EDIT_METHODS = ('edit_message_text', 'edit_message_reply_markup')
+BUCKET_PRUNE_EVERY = 1024
+
+signatures = {}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic() if now is None else now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now):
+        self.refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundJob:
+    def __init__(self, method, args, kwargs, priority, future):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        arguments = bind_arguments(method, args, kwargs)
+        self.chat_id = arguments.get('chat_id')
+        message_id = arguments.get('message_id')
+        name = method.__name__
+        self.merge_key = (name, self.chat_id, message_id) if name in EDIT_METHODS and message_id else None
+        self.drop_keys = [(edit, self.chat_id, message_id) for edit in EDIT_METHODS] \
+            if name == 'delete_message' else []
+
+
+def bind_arguments(method, args, kwargs):
+    func = getattr(method, '__func__', method)
+    signature = signatures.get(func)
+    if signature is None:
+        signature = signatures[func] = inspect.signature(method)
+    return signature.bind_partial(*args, **kwargs).arguments
+
+
+def retry_after_seconds(error):
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    return (getattr(error, 'result_json', None) or {}).get('parameters', {}).get('retry_after', 1)
+
+
+def resolve(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class OutboundScheduler:
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, global_burst=OUTBOUND_GLOBAL_BURST,
+                 chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.queues = {priority: collections.OrderedDict() for priority in PRIORITY_NAMES}
+        self.depths = {priority: 0 for priority in PRIORITY_NAMES}
+        self.pending_edits = {}
+        self.in_flight = set()
+        self.paused_until = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.retried = 0
+        self.failed = 0
+        self.finished = itertools.count(1)
+
+    def chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def enqueue(self, job, front=False):
+        jobs = self.queues[job.priority].setdefault(job.chat_id, collections.deque())
+        if front:
+            jobs.appendleft(job)
+        else:
+            jobs.append(job)
+        if job.merge_key is not None:
+            self.pending_edits[job.merge_key] = job
+        self.depths[job.priority] += 1
+        self.max_depth = max(self.max_depth, self.depth())
+
+    def remove(self, job):
+        jobs = self.queues[job.priority][job.chat_id]
+        jobs.remove(job)
+        if not jobs:
+            del self.queues[job.priority][job.chat_id]
+        self.depths[job.priority] -= 1
+
+    # returns the futures of superseded edits; the caller resolves them outside its lock
+    def push(self, job):
+        superseded = []
+        pending = self.pending_edits.get(job.merge_key) if job.merge_key is not None else None
+        if pending is not None:
+            pending.args, pending.kwargs = job.args, job.kwargs
+            superseded.append(pending.future)
+            pending.future = job.future
+            self.merged += 1
+            return superseded
+        for key in job.drop_keys:
+            pending = self.pending_edits.pop(key, None)
+            if pending is not None:
+                self.remove(pending)
+                superseded.append(pending.future)
+                self.dropped += 1
+        self.enqueue(job)
+        return superseded
+
+    def next_job(self, now):
+        wait = max(self.paused_until - now, self.global_bucket.wait_time(now))
+        if wait > 0:
+            return None, wait if self.depth() else None
+        wait = None
+        for priority, queue in self.queues.items():
+            for chat_id in queue:
+                if chat_id in self.in_flight:
+                    continue
+                delay = self.chat_bucket(chat_id, now).wait_time(now)
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                return self.take(queue, chat_id, now), None
+        return None, wait
+
+    def take(self, queue, chat_id, now):
+        jobs = queue[chat_id]
+        job = jobs.popleft()
+        if jobs:
+            queue.move_to_end(chat_id)
+        else:
+            del queue[chat_id]
+        if job.merge_key is not None:
+            self.pending_edits.pop(job.merge_key, None)
+        self.depths[job.priority] -= 1
+        self.in_flight.add(chat_id)
+        self.global_bucket.take(now)
+        self.chat_bucket(chat_id, now).take(now)
+        job.attempts += 1
+        return job
+
+    def retry(self, job, retry_after, now):
+        self.in_flight.discard(job.chat_id)
+        self.paused_until = max(self.paused_until, now + retry_after)
+        self.retried += 1
+        if job.merge_key is not None and job.merge_key in self.pending_edits:
+            self.dropped += 1
+            return [job.future]
+        self.enqueue(job, front=True)
+        return []
+
+    def finish(self, job, failed=False):
+        self.in_flight.discard(job.chat_id)
+        if failed:
+            self.failed += 1
+        else:
+            self.sent += 1
+        if next(self.finished) % BUCKET_PRUNE_EVERY == 0:
+            self.prune_buckets(time.monotonic())
+
+    def prune_buckets(self, now):
+        busy = self.in_flight.union(*self.queues.values())
+        for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items()
+                        if chat_id not in busy and bucket.full(now)]:
+            del self.chat_buckets[chat_id]
+
+    def depth(self):
+        return sum(self.depths.values())
+
+    def stats(self):
+        stats = {f'depth_{name}': self.depths[priority] for priority, name in PRIORITY_NAMES.items()}
+        stats.update({
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'in_flight': len(self.in_flight),
+            'sent': self.sent,
+            'merged': self.merged,
+            'dropped': self.dropped,
+            'retried': self.retried,
+            'failed': self.failed,
+            'paused_for': max(0.0, self.paused_until - time.monotonic()),
+        })
+        return stats
+
+
+class SendQueue:
+    def __init__(self, workers=OUTBOUND_WORKERS, scheduler=None):
+        self.workers = workers
+        self.scheduler = scheduler or OutboundScheduler()
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers - len(self.threads)):
+            thread = threading.Thread(target=self.run, name=f'outbound-{len(self.threads)}', daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def submit(self, method, args, kwargs, priority=PRIORITY_INTERACTIVE):
+        future = concurrent.futures.Future()
+        job = OutboundJob(method, args, kwargs, priority, future)
+        with self.condition:
+            if not self.threads:
+                self.start()
+            superseded = self.scheduler.push(job)
+            self.condition.notify()
+        for stale in superseded:
+            resolve(stale, True)
+        return future
+
+    def call(self, method, args, kwargs, priority=PRIORITY_INTERACTIVE):
+        return self.submit(method, args, kwargs, priority).result()
+
+    def run(self):
+        while True:
+            with self.condition:
+                job, wait = self.scheduler.next_job(time.monotonic())
+                if job is None:
+                    self.condition.wait(wait)
+                    continue
+            self.execute(job)
+
+    def execute(self, job):
+        try:
+            result = job.method(*job.args, **job.kwargs)
+        except Exception as e:
+            count_telegram_error(job.method.__name__, e)
+            retry_after = retry_after_seconds(e)
+            with self.condition:
+                if retry_after is not None and job.attempts <= OUTBOUND_MAX_RETRIES:
+                    superseded = self.scheduler.retry(job, retry_after, time.monotonic())
+                else:
+                    self.scheduler.finish(job, failed=True)
+                    superseded = None
+                self.condition.notify_all()
+            if superseded is None:
+                resolve(job.future, error=e)
+            for stale in superseded or []:
+                resolve(stale, True)
+            return
+        with self.condition:
+            self.scheduler.finish(job)
+            self.condition.notify()
+        resolve(job.future, result)
+
+    def stats(self):
+        with self.condition:
+            return self.scheduler.stats()
+
+
+class AsyncSendQueue:
+    def __init__(self, workers=OUTBOUND_WORKERS, scheduler=None):
+        self.workers = workers
+        self.scheduler = scheduler or OutboundScheduler()
+        self.wakeup = None
+        self.tasks = set()
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        for i in range(self.workers):
+            task = asyncio.create_task(self.run())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def call(self, method, args, kwargs, priority=PRIORITY_INTERACTIVE):
+        if not self.tasks:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        for stale in self.scheduler.push(OutboundJob(method, args, kwargs, priority, future)):
+            resolve(stale, True)
+        self.wakeup.set()
+        return await future
+
+    async def run(self):
+        while True:
+            job, wait = self.scheduler.next_job(time.monotonic())
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.execute(job)
+
+    async def execute(self, job):
+        try:
+            result = await job.method(*job.args, **job.kwargs)
+        except Exception as e:
+            count_telegram_error(job.method.__name__, e)
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None and job.attempts <= OUTBOUND_MAX_RETRIES:
+                for stale in self.scheduler.retry(job, retry_after, time.monotonic()):
+                    resolve(stale, True)
+            else:
+                self.scheduler.finish(job, failed=True)
+                resolve(job.future, error=e)
+            self.wakeup.set()
+            return
+        self.scheduler.finish(job)
+        self.wakeup.set()
+        resolve(job.future, result)
+
+    def stats(self):
+        return self.scheduler.stats()
+
+    def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+
+def register_outbound_queue(send_queue):
+    for priority, name in PRIORITY_NAMES.items():
+        register_queue(f'outbound_{name}', lambda priority=priority: send_queue.scheduler.depths[priority])
+
+
+class QueuedTeleBot(telebot.TeleBot):
+    def __init__(self, *args, send_queue=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.send_queue = send_queue or SendQueue()
+        register_outbound_queue(self.send_queue)
+
+    def counted(self, method, args, kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            count_telegram_error(method.__name__, e)
+            raise
+
+    def queued(self, method, args, kwargs, priority):
+        if not OUTBOUND_QUEUE_ENABLED:
+            return self.counted(method, args, kwargs)
+        return self.send_queue.call(method, args, kwargs, priority)
+
+    def send_message(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.queued(super().send_message, args, kwargs, priority)
+
+    def edit_message_text(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.queued(super().edit_message_text, args, kwargs, priority)
+
+    def edit_message_reply_markup(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.queued(super().edit_message_reply_markup, args, kwargs, priority)
+
+    def delete_message(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.queued(super().delete_message, args, kwargs, priority)
+
+    def answer_callback_query(self, *args, **kwargs):
+        return self.counted(super().answer_callback_query, args, kwargs)
+
+    def set_my_commands(self, *args, **kwargs):
+        return self.counted(super().set_my_commands, args, kwargs)
+
+
+class QueuedAsyncTeleBot(AsyncTeleBot):
+    def __init__(self, *args, send_queue=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.send_queue = send_queue or AsyncSendQueue()
+        register_outbound_queue(self.send_queue)
+
+    async def counted(self, method, args, kwargs):
+        try:
+            return await method(*args, **kwargs)
+        except Exception as e:
+            count_telegram_error(method.__name__, e)
+            raise
+
+    async def queued(self, method, args, kwargs, priority):
+        if not OUTBOUND_QUEUE_ENABLED:
+            return await self.counted(method, args, kwargs)
+        return await self.send_queue.call(method, args, kwargs, priority)
+
+    async def send_message(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return await self.queued(super().send_message, args, kwargs, priority)
+
+    async def edit_message_text(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return await self.queued(super().edit_message_text, args, kwargs, priority)
+
+    async def edit_message_reply_markup(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return await self.queued(super().edit_message_reply_markup, args, kwargs, priority)
+
+    async def delete_message(self, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return await self.queued(super().delete_message, args, kwargs, priority)
+
+    async def answer_callback_query(self, *args, **kwargs):
+        return await self.counted(super().answer_callback_query, args, kwargs)
+
+    async def set_my_commands(self, *args, **kwargs):
+        return await self.counted(super().set_my_commands, args, kwargs)
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from cache import schedule_cache
+from common import get_week_dates, week_cache_key
+from metrics import register_queue
+from semester import fetch_week, fetch_week_async
+from upstream import upstream_load
+
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '1') == '1'
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 2))
+UPSTREAM_CONCURRENCY_BUDGET = int(os.getenv('UPSTREAM_CONCURRENCY_BUDGET', 8))
+PREFETCH_MAX_LATENCY = float(os.getenv('PREFETCH_MAX_LATENCY', 2.0))
+
+
+def upstream_is_busy():
+    return upstream_load.busy(UPSTREAM_CONCURRENCY_BUDGET, PREFETCH_MAX_LATENCY)
+
+
+def neighbour_weeks(offset):
+    for neighbour in (offset - 1, offset + 1):
+        yield get_week_dates(neighbour)[0]
+
+
+def prefetch_week(kind, url, entity_id, monday):
+    cache_key = week_cache_key(kind, entity_id, monday)
+    if schedule_cache.get(cache_key, namespace='schedule') is not None or upstream_is_busy():
+        return
+    end_date = monday + datetime.timedelta(days=6)
+    lessons = fetch_week(kind, url, entity_id, monday, end_date)
+    schedule_cache.set(cache_key, tuple(lessons), namespace='schedule')
+
+
+async def prefetch_week_async(kind, url, entity_id, monday):
+    cache_key = week_cache_key(kind, entity_id, monday)
+    if upstream_is_busy() or await schedule_cache.get_async(cache_key, namespace='schedule') is not None:
+        return
+    end_date = monday + datetime.timedelta(days=6)
+    lessons = await fetch_week_async(kind, url, entity_id, monday, end_date)
+    await schedule_cache.set_async(cache_key, tuple(lessons), namespace='schedule')
+
+
+class Prefetcher:
+    def __init__(self, max_workers=PREFETCH_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def prefetch_neighbours(self, kind, url, entity_id, offset):
+        if not PREFETCH_ENABLED:
+            return
+        for monday in neighbour_weeks(offset):
+            self.submit(week_cache_key(kind, entity_id, monday), prefetch_week, kind, url, entity_id, monday)
+
+    def submit(self, key, func, *args):
+        with self.lock:
+            if key in self.pending:
+                return
+            future = self.executor.submit(self._run, func, *args)
+            self.pending[key] = future
+        future.add_done_callback(lambda _: self._forget(key, future))
+
+    # a cancelled job finishes after a fresh submit for the same key and must not drop the new one
+    def _forget(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except Exception:
+            pass
+
+    def cancel(self, key):
+        with self.lock:
+            future = self.pending.pop(key, None)
+        if future:
+            future.cancel()
+
+    def cancel_all(self):
+        with self.lock:
+            futures = list(self.pending.values())
+            self.pending.clear()
+        for future in futures:
+            future.cancel()
+
+
+class AsyncPrefetcher:
+    def __init__(self, concurrency=PREFETCH_WORKERS):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending = {}
+
+    def prefetch_neighbours(self, kind, url, entity_id, offset):
+        if not PREFETCH_ENABLED:
+            return
+        for monday in neighbour_weeks(offset):
+            self.submit(week_cache_key(kind, entity_id, monday), prefetch_week_async, kind, url, entity_id, monday)
+
+    def submit(self, key, func, *args):
+        if key in self.pending:
+            return
+        task = asyncio.create_task(self._run(func, *args))
+        self.pending[key] = task
+        task.add_done_callback(lambda _: self._forget(key, task))
+
+    # a cancelled task finishes after a fresh submit for the same key and must not drop the new one
+    def _forget(self, key, task):
+        if self.pending.get(key) is task:
+            del self.pending[key]
+
+    async def _run(self, func, *args):
+        async with self.semaphore:
+            try:
+                await func(*args)
+            except Exception:
+                pass
+
+    def cancel(self, key):
+        task = self.pending.pop(key, None)
+        if task:
+            task.cancel()
+
+    def cancel_all(self):
+        for task in list(self.pending.values()):
+            task.cancel()
+        self.pending.clear()
+
+
+prefetcher = Prefetcher()
+async_prefetcher = AsyncPrefetcher()
+
+register_queue('prefetch', prefetcher.executor._work_queue.qsize)
@@ -0,0 +1,289 @@
+import collections
+import cProfile
+import functools
+import inspect
+import os
+import socketserver
+import sys
+import threading
+import time
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'data/profiles')
+PROFILE_ADMIN_IDS = {int(user_id) for user_id in os.getenv('PROFILE_ADMIN_IDS', '').split(',') if user_id.strip()}
+PROFILE_SOCKET = os.getenv('PROFILE_SOCKET', '')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_DEFAULT_SECONDS = int(os.getenv('PROFILE_DEFAULT_SECONDS', 60))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', 600))
+
+MODES = ('cprofile', 'sampling')
+USAGE = ("Использование:\n"
+         "/profile start <cprofile|sampling> <функция[,функция]> [<N>s|<N>]\n"
+         "/profile stop\n"
+         "/profile status\n"
+         "/profile targets")
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class ProfileSession:
+    def __init__(self, mode, targets, seconds, requests=None):
+        self.mode = mode
+        self.targets = targets
+        self.deadline = time.monotonic() + seconds
+        self.remaining = requests
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.threads = collections.Counter()
+        self.tasks = collections.Counter()
+        self.calls = 0
+        self.samples = collections.Counter()
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+
+    def enter(self, task=False):
+        with self.lock:
+            self.active += 1
+            (self.tasks if task else self.threads)[threading.get_ident()] += 1
+            # cProfile traces whole threads: in the asyncio runtime it also counts the other tasks
+            # that run on the loop while a profiled handler awaits
+            if self.profile is not None and self.active == 1:
+                try:
+                    self.profile.enable()
+                except ValueError:
+                    # another profiler owns the interpreter, keep counting calls
+                    pass
+
+    def exit(self, task=False):
+        with self.lock:
+            self.active -= 1
+            ident = threading.get_ident()
+            counter = self.tasks if task else self.threads
+            counter[ident] -= 1
+            if counter[ident] <= 0:
+                del counter[ident]
+            if self.profile is not None and self.active == 0:
+                self.profile.disable()
+            self.calls += 1
+            if self.remaining is not None:
+                self.remaining -= 1
+
+    def expired(self):
+        return time.monotonic() >= self.deadline or (self.remaining is not None and self.remaining <= 0)
+
+    # a thread inside a profiled function is sampled whole; on an event loop thread the profiled
+    # coroutine shares the thread with every other task, so only stacks running through it are kept
+    def sample(self):
+        with self.lock:
+            idents = list(self.threads)
+            tasks = [ident for ident in self.tasks if ident not in self.threads]
+        frames = sys._current_frames()
+        for ident in idents + tasks:
+            frame = frames.get(ident)
+            stack = []
+            task_depth = None
+            while frame is not None:
+                if frame.f_code is run_profiled.__code__:
+                    task_depth = len(stack)
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if ident in tasks:
+                if task_depth is None:
+                    continue
+                stack = stack[:task_depth]
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, directory=PROFILE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        started = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))
+        name = os.path.join(directory, f"{started}-{self.mode}-{'+'.join(self.targets)}")
+        if self.profile is not None:
+            with self.lock:
+                if self.active:
+                    self.profile.disable()
+            path = name + '.pstats'
+            self.profile.dump_stats(path)
+        else:
+            # collapsed stacks, readable by flamegraph.pl and speedscope
+            path = name + '.folded'
+            with open(path, 'w') as file:
+                for stack, count in self.samples.most_common():
+                    file.write(f'{stack} {count}\n')
+        return path
+
+    def status(self):
+        left = max(0, int(self.deadline - time.monotonic()))
+        requests = f", осталось вызовов: {self.remaining}" if self.remaining is not None else ''
+        return (f"Профилирование {self.mode}: {', '.join(self.targets)}\n"
+                f"Вызовов: {self.calls}, осталось секунд: {left}{requests}")
+
+
+# the sampler looks for this frame to tell the profiled task from the rest of the event loop
+async def run_profiled(func, session, args, kwargs):
+    session.enter(task=True)
+    try:
+        return await func(*args, **kwargs)
+    finally:
+        session.exit(task=True)
+
+
+def profiled(func, session):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            return await run_profiled(func, session, args, kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session.enter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            session.exit()
+
+    return wrapper
+
+
+class Profiler:
+    def __init__(self):
+        self.bot = None
+        self.namespace = {}
+        self.session = None
+        self.patches = []
+        self.on_finish = None
+        self.lock = threading.Lock()
+
+    def attach(self, bot, namespace):
+        self.bot = bot
+        self.namespace = namespace
+
+    def handlers(self):
+        for attribute, handlers in vars(self.bot).items():
+            if attribute.endswith('_handlers') and isinstance(handlers, list):
+                for handler in handlers:
+                    if isinstance(handler, dict) and 'function' in handler:
+                        yield handler
+
+    def targets(self):
+        names = {handler['function'].__name__ for handler in self.handlers()}
+        module = self.namespace.get('__name__')
+        names.update(name for name, value in self.namespace.items()
+                     if inspect.isfunction(value) and value.__module__ == module and not name.startswith('_'))
+        return names
+
+    # handlers are swapped in the bot's tables and functions in the module namespace, so a disabled
+    # profiler leaves no wrapper behind and costs nothing
+    def patch(self, session):
+        for handler in self.handlers():
+            if handler['function'].__name__ in session.targets:
+                original = handler['function']
+                handler['function'] = profiled(original, session)
+                self.patches.append((handler.__setitem__, 'function', original))
+        patched = {original.__name__ for _, _, original in self.patches}
+        for name in session.targets:
+            if name in patched or name not in self.namespace:
+                continue
+            func = self.namespace[name]
+            if hasattr(func, '__wrapped__'):
+                self.patches.append((functools.partial(setattr, func), '__wrapped__', func.__wrapped__))
+                func.__wrapped__ = profiled(func.__wrapped__, session)
+            else:
+                self.patches.append((self.namespace.__setitem__, name, func))
+                self.namespace[name] = profiled(func, session)
+
+    def restore(self):
+        while self.patches:
+            assign, key, original = self.patches.pop()
+            assign(key, original)
+
+    def start(self, mode, targets, seconds=PROFILE_DEFAULT_SECONDS, requests=None, on_finish=None):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим {mode}")
+        unknown = set(targets) - self.targets()
+        if unknown:
+            raise ValueError(f"Неизвестные функции: {', '.join(sorted(unknown))}")
+        with self.lock:
+            if self.session is not None:
+                raise ValueError("Профилирование уже запущено")
+            session = ProfileSession(mode, targets, min(seconds, PROFILE_MAX_SECONDS), requests)
+            self.session = session
+            self.on_finish = on_finish
+            self.patch(session)
+        threading.Thread(target=self.watch, args=(session,), name='profiler', daemon=True).start()
+
+    def watch(self, session):
+        interval = PROFILE_SAMPLE_INTERVAL if session.mode == 'sampling' else 0.2
+        while self.session is session and not session.expired():
+            if session.mode == 'sampling':
+                session.sample()
+            time.sleep(interval)
+        if self.session is session:
+            path = self.stop()
+            if path and self.on_finish is not None:
+                self.on_finish(path)
+
+    def stop(self):
+        with self.lock:
+            session = self.session
+            if session is None:
+                return None
+            self.restore()
+            self.session = None
+        return session.dump()
+
+    def status(self):
+        session = self.session
+        return session.status() if session is not None else "Профилирование не запущено"
+
+    def handle_command(self, text, on_finish=None):
+        parts = text.split()[1:]
+        try:
+            if not parts or parts[0] == 'status':
+                return self.status()
+            if parts[0] == 'stop':
+                path = self.stop()
+                return f"Профиль сохранён: {path}" if path else "Профилирование не запущено"
+            if parts[0] == 'targets':
+                return ', '.join(sorted(self.targets()))
+            if parts[0] == 'start' and len(parts) >= 3:
+                limit = parts[3] if len(parts) > 3 else f'{PROFILE_DEFAULT_SECONDS}s'
+                if limit.endswith('s'):
+                    seconds, requests = int(limit[:-1]), None
+                else:
+                    seconds, requests = PROFILE_MAX_SECONDS, int(limit)
+                self.start(parts[1], parts[2].split(','), seconds, requests, on_finish)
+                return f"Профилирование {parts[1]} запущено: {parts[2]}"
+        except ValueError as e:
+            return str(e)
+        return USAGE
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode().strip()
+        if line:
+            self.wfile.write((profiler.handle_command('/profile ' + line) + '\n').encode())
+
+
+def start_control_socket(suffix='', path=PROFILE_SOCKET):
+    if not path:
+        return None
+    path += suffix
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socketserver.ThreadingUnixStreamServer(path, ControlHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='profiler-control', daemon=True).start()
+    return server
+
+
+def is_admin(user_id):
+    return user_id in PROFILE_ADMIN_IDS
+
+
+profiler = Profiler()
@@ -0,0 +1,266 @@
+import datetime
+import functools
+
+from telebot import types
+from common import weekday_int_str, time_begin_to_pair
+
+
+class OutputFormat:
+    def __init__(self, week_header, week_empty, day_header, lesson, journal_header, journal_lesson, journal_footer,
+                 disciplines_header, discipline_item, report_header, report_item, report_missing, report_footer,
+                 changes_header, changes_day, change_removed, change_added, changes_more, digest_header):
+        self.week_header = week_header.format
+        self.week_empty = week_empty.format
+        self.day_header = day_header.format
+        self.lesson = lesson.format
+        self.journal_header = journal_header.format
+        self.journal_lesson = journal_lesson.format
+        self.journal_footer = journal_footer.format
+        self.disciplines_header = disciplines_header.format
+        self.discipline_item = discipline_item.format
+        self.report_header = report_header.format
+        self.report_item = report_item.format
+        self.report_missing = report_missing.format
+        self.report_footer = report_footer.format
+        self.changes_header = changes_header.format
+        self.changes_day = changes_day.format
+        self.change_removed = change_removed.format
+        self.change_added = change_added.format
+        self.changes_more = changes_more.format
+        self.digest_header = digest_header.format
+
+
+WEEK_EMPTY = "Расписание на неделю ({start} - {end}) отсутсвует"
+LESSON = ("{pair} пара: {discipline} - {kind_of_work}\n"
+          "👤 Преподаватель: {lecturer}\n"
+          "⏰ Время: {begin} - {end}\n"
+          "🚪 Аудитория {auditorium}\n\n")
+JOURNAL_HEADER = "Посещения и баллы за {quarter} ТКУ (Текущий контроль успеваемости)\n"
+JOURNAL_LESSON = ("📅 Дата и время: {date} {begin}-{end}\n"
+                  "📚 Тип: {kind_of_work}\n"
+                  "👤 Преподаватель: {teacher}\n"
+                  "👣 Статус посещения: {status}\n"
+                  "⭐ Баллы за занятие: {mark}\n"
+                  "----------------------------------------\n")
+JOURNAL_FOOTER = ("📊Всего занятий: {total}\n"
+                  "❌Отсутствовал: {missed}\n"
+                  "📈Процент посещаемости: {percent:.1f}%\n"
+                  "⭐Общая сумма баллов за ТКУ: {mark_sum:.1f}\n\n")
+REPORT_ITEM = "👣 {attended}/{total} ({percent:.0f}%)  ⭐ {mark_sum:.1f}\n"
+REPORT_MISSING = "Данные не найдены\n"
+CHANGE_LESSON = "{begin}-{end} {discipline} - {kind_of_work}\n👤 {lecturer}\n🚪 {auditorium}\n"
+CHANGES_MORE = "\n…и ещё изменений: {count}\n"
+
+HTML = OutputFormat(
+    week_header="<b>Расписание на неделю ({start} - {end})</b>\n",
+    week_empty=WEEK_EMPTY,
+    day_header="\n📅 <b>Дата: {date} ({weekday})</b>\n\n",
+    lesson=LESSON,
+    journal_header=JOURNAL_HEADER,
+    journal_lesson=JOURNAL_LESSON,
+    journal_footer=JOURNAL_FOOTER,
+    disciplines_header=("📊 <b>Ваша успеваемость</b>\n"
+                        "👣 Посещаемость: <b>{attendance}%</b>\n\n"
+                        "📚 <b>Выберите дисциплину:</b>\n\n"),
+    discipline_item="📖 <b>{name}</b>\n{teachers}\n────────────\n",
+    report_header="📊 <b>Сводка за семестр ({start} - {end})</b>\n👣 Посещаемость: <b>{attendance}%</b>\n\n",
+    report_item="📖 <b>{name}</b>\n" + REPORT_ITEM,
+    report_missing="📖 <b>{name}</b>\n" + REPORT_MISSING,
+    report_footer=("────────────\n"
+                   "📊 Всего занятий: <b>{total}</b>\n"
+                   "❌ Пропущено: <b>{missed}</b>\n"
+                   "📈 Процент посещаемости: <b>{percent:.1f}%</b>\n"
+                   "⭐ Сумма баллов: <b>{mark_sum:.1f}</b>\n"),
+    changes_header="🔔 <b>Изменения в расписании {label}</b>\n",
+    changes_day="\n📅 <b>{date} ({weekday})</b>\n",
+    change_removed="❌ Отменено: <s>{begin}-{end} {discipline} - {kind_of_work}</s>\n👤 {lecturer}\n🚪 {auditorium}\n",
+    change_added="✅ " + CHANGE_LESSON,
+    changes_more=CHANGES_MORE,
+    digest_header="☀️ <b>Пары на сегодня, {label}</b>\n",
+)
+
+TEXT = OutputFormat(
+    week_header="Расписание на неделю ({start} - {end})\n",
+    week_empty=WEEK_EMPTY,
+    day_header="\n📅 Дата: {date} ({weekday})\n\n",
+    lesson=LESSON,
+    journal_header=JOURNAL_HEADER,
+    journal_lesson=JOURNAL_LESSON,
+    journal_footer=JOURNAL_FOOTER,
+    disciplines_header=("📊 Ваша успеваемость\n"
+                        "👣 Посещаемость: {attendance}%\n\n"
+                        "📚 Выберите дисциплину:\n\n"),
+    discipline_item="📖 {name}\n{teachers}\n────────────\n",
+    report_header="📊 Сводка за семестр ({start} - {end})\n👣 Посещаемость: {attendance}%\n\n",
+    report_item="📖 {name}\n" + REPORT_ITEM,
+    report_missing="📖 {name}\n" + REPORT_MISSING,
+    report_footer=("────────────\n"
+                   "📊 Всего занятий: {total}\n"
+                   "❌ Пропущено: {missed}\n"
+                   "📈 Процент посещаемости: {percent:.1f}%\n"
+                   "⭐ Сумма баллов: {mark_sum:.1f}\n"),
+    changes_header="🔔 Изменения в расписании {label}\n",
+    changes_day="\n📅 {date} ({weekday})\n",
+    change_removed="❌ Отменено: " + CHANGE_LESSON,
+    change_added="✅ " + CHANGE_LESSON,
+    changes_more=CHANGES_MORE,
+    digest_header="☀️ Пары на сегодня, {label}\n",
+)
+
+output_formats = {
+    'html': HTML,
+    'text': TEXT,
+}
+
+
+def register_output_format(name, output_format):
+    output_formats[name] = output_format
+
+
+@functools.lru_cache(maxsize=1024)
+def format_lesson_date(date):
+    return date.strftime('%d.%m.%Y'), weekday_int_str[date.isoweekday()]
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_journal_date(date_str):
+    return datetime.datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')
+
+
+@functools.lru_cache(maxsize=256)
+def parse_journal_time(time_str):
+    return datetime.datetime.strptime(time_str, '%H:%M:%S').strftime('%H:%M')
+
+
+def format_empty_week(monday, output='html'):
+    return output_formats[output].week_empty(start=monday, end=monday + datetime.timedelta(weeks=1))
+
+
+def format_week_schedule(lessons, start_date, end_date, output='html'):
+    fmt = output_formats[output]
+    lessons_by_date = {}
+    for lesson in lessons:
+        lessons_by_date.setdefault(lesson.date, []).append(lesson)
+
+    parts = [fmt.week_header(start=start_date, end=end_date)]
+    for lesson_date, day_lessons in lessons_by_date.items():
+        format_day(fmt, parts, lesson_date, day_lessons)
+    return ''.join(parts)
+
+
+def format_day(fmt, parts, lesson_date, day_lessons):
+    date, weekday = format_lesson_date(lesson_date)
+    parts.append(fmt.day_header(date=date, weekday=weekday))
+    for i, lesson in enumerate(day_lessons, 1):
+        parts.append(fmt.lesson(pair=time_begin_to_pair.get(lesson.begin, i),
+                                discipline=lesson.discipline,
+                                kind_of_work=lesson.kind_of_work,
+                                lecturer=lesson.lecturer,
+                                begin=lesson.begin,
+                                end=lesson.end,
+                                auditorium=lesson.auditorium))
+
+
+def format_day_digest(label, lesson_date, lessons, output='html'):
+    fmt = output_formats[output]
+    parts = [fmt.digest_header(label=label)]
+    format_day(fmt, parts, lesson_date, lessons)
+    return ''.join(parts)
+
+
+def visit_status_text(visit_status):
+    if visit_status == 2 or visit_status is None:
+        return "✅ Присутствовал"
+    if visit_status == 4:
+        return "❌ Отсутствовал"
+    return f"❓ Неизвестный статус ({visit_status})"
+
+
+def format_discipline_info(discipline_data, student_id, quarter, output='html'):
+    fmt = output_formats[output]
+    student_data = discipline_data['rows'][str(student_id)]
+
+    lessons_info = {}
+    for lesson_id, lesson_data in student_data.get('lessons', {}).items():
+        lessons_info[int(lesson_id)] = (lesson_data.get('attendance', {}).get('visit_status_id'),
+                                        sum(mark.get('mark_val', 0) for mark in lesson_data.get('marks', [])))
+
+    parts = [fmt.journal_header(quarter=quarter)]
+    for lesson in discipline_data['lessons']:
+        visit_status, total_mark = lessons_info.get(lesson['id'], (None, 0))
+        parts.append(fmt.journal_lesson(
+            date=parse_journal_date(lesson['hold_at']),
+            begin=parse_journal_time(lesson['start_at']),
+            end=parse_journal_time(lesson['finish_at']),
+            kind_of_work=lesson.get('kind_of_work', 'Тип недоступен'),
+            teacher=lesson.get('profile_fio', 'Неизвестен'),
+            status=visit_status_text(visit_status),
+            mark=f"{total_mark:.1f}" if isinstance(total_mark, (int, float)) else "0.0"
+        ))
+
+    total_lessons = len(discipline_data['lessons'])
+    attended = sum(1 for visit_status, _ in lessons_info.values() if visit_status == 2 or visit_status is None)
+    parts.append(fmt.journal_footer(total=total_lessons,
+                                    missed=total_lessons - attended,
+                                    percent=(attended / total_lessons * 100) if total_lessons > 0 else 0,
+                                    mark_sum=float(student_data.get('mark_sum', 0))))
+    return ''.join(parts)
+
+
+def format_disciplines_list(disciplines_data, output='html'):
+    fmt = output_formats[output]
+    parts = [fmt.disciplines_header(attendance=disciplines_data.get("attendance_percent", "N/A"))]
+    buttons = []
+
+    for discipline in disciplines_data['disciplines']:
+        discipline_name = discipline.get('discipline_name', 'Без названия')
+        teachers = [teacher['fio'] for teacher in discipline.get('teachers', [])]
+        teacher_list = "\n".join([f"👤{t}" for t in teachers]) if teachers else "👤Преподаватель не указан"
+        parts.append(fmt.discipline_item(name=discipline_name, teachers=teacher_list))
+        btn_text = discipline_name
+        if len(btn_text) > 18:
+            btn_text = btn_text[:15] + "..."
+        buttons.append(
+            types.InlineKeyboardButton(btn_text, callback_data=f"discipline_{discipline['discipline_id']}_0"))
+
+    markup = types.InlineKeyboardMarkup()
+    for i in range(0, len(buttons), 2):
+        markup.row(*buttons[i:i + 2])
+    return ''.join(parts), markup
+
+
+def format_semester_report(report, output='html'):
+    fmt = output_formats[output]
+    parts = [fmt.report_header(start=parse_journal_date(report.start_date), end=parse_journal_date(report.end_date),
+                               attendance=report.attendance_percent)]
+    for summary in report.summaries():
+        if not summary['found']:
+            parts.append(fmt.report_missing(name=summary['name']))
+            continue
+        attended = summary['total'] - summary['missed']
+        parts.append(fmt.report_item(name=summary['name'], attended=attended, total=summary['total'],
+                                     percent=attended / summary['total'] * 100 if summary['total'] else 0,
+                                     mark_sum=summary['mark_sum']))
+    parts.append(fmt.report_footer(**report.totals()))
+    return ''.join(parts)
+
+
+def lesson_fields(lesson):
+    return {'begin': lesson.begin, 'end': lesson.end, 'discipline': lesson.discipline,
+            'kind_of_work': lesson.kind_of_work, 'lecturer': lesson.lecturer, 'auditorium': lesson.auditorium}
+
+
+def format_schedule_changes(label, changes, limit=20, output='html'):
+    fmt = output_formats[output]
+    parts = [fmt.changes_header(label=label)]
+    previous_date = None
+    for lesson_date, removed, added in changes[:limit]:
+        if lesson_date != previous_date:
+            date, weekday = format_lesson_date(lesson_date)
+            parts.append(fmt.changes_day(date=date, weekday=weekday))
+            previous_date = lesson_date
+        parts.extend(fmt.change_removed(**lesson_fields(lesson)) for lesson in removed)
+        parts.extend(fmt.change_added(**lesson_fields(lesson)) for lesson in added)
+    if len(changes) > limit:
+        parts.append(fmt.changes_more(count=len(changes) - limit))
+    return ''.join(parts)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import schedule_cache
+from common import get_current_semester
+from upstream import fetch_disciplines, fetch_journal, fetch_disciplines_async, fetch_journal_async
+
+REPORT_FAN_OUT = int(os.getenv('REPORT_FAN_OUT', 4))
+REPORT_REFRESH_INTERVAL = int(os.getenv('REPORT_REFRESH_INTERVAL', 600))
+
+
+def report_key(student_id, start_date):
+    return f"report_{student_id}_{start_date}"
+
+
+def summarize_journal(discipline, journal, student_id):
+    summary = {'name': discipline.get('discipline_name', 'Без названия'), 'total': 0, 'missed': 0,
+               'mark_sum': 0.0, 'found': False, 'refreshed_at': time.time()}
+    if journal.get('error') == 1 or str(student_id) not in journal.get('rows', {}):
+        return summary
+    student_data = journal['rows'][str(student_id)]
+    # counted like the footer of the discipline card
+    attended = sum(1 for lesson in student_data.get('lessons', {}).values()
+                   if lesson.get('attendance', {}).get('visit_status_id') in (2, None))
+    summary['total'] = len(journal['lessons'])
+    summary['missed'] = summary['total'] - attended
+    summary['mark_sum'] = float(student_data.get('mark_sum', 0))
+    summary['found'] = True
+    return summary
+
+
+class SemesterReport:
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.attendance_percent = 'N/A'
+        self.order = []
+        self.disciplines = {}
+
+    # summaries are replaced, never changed in place, so a shallow copy is enough
+    def copy(self):
+        report = SemesterReport(self.start_date, self.end_date)
+        report.attendance_percent = self.attendance_percent
+        report.order = list(self.order)
+        report.disciplines = dict(self.disciplines)
+        return report
+
+    def update(self, disciplines_data):
+        self.attendance_percent = disciplines_data.get('attendance_percent', 'N/A')
+        self.order = [str(discipline['discipline_id']) for discipline in disciplines_data['disciplines']]
+        self.disciplines = {discipline_id: self.disciplines[discipline_id] for discipline_id in self.order
+                            if discipline_id in self.disciplines}
+
+    def stale(self, disciplines_data):
+        now = time.time()
+        return [discipline for discipline in disciplines_data['disciplines']
+                if now - self.disciplines.get(str(discipline['discipline_id']), {}).get('refreshed_at', 0)
+                >= REPORT_REFRESH_INTERVAL]
+
+    def store(self, discipline, summary):
+        self.disciplines[str(discipline['discipline_id'])] = summary
+
+    def summaries(self):
+        return [self.disciplines[discipline_id] for discipline_id in self.order if discipline_id in self.disciplines]
+
+    def totals(self):
+        summaries = [summary for summary in self.summaries() if summary['found']]
+        total = sum(summary['total'] for summary in summaries)
+        missed = sum(summary['missed'] for summary in summaries)
+        return {
+            'total': total,
+            'missed': missed,
+            'percent': (total - missed) / total * 100 if total else 0,
+            'mark_sum': sum(summary['mark_sum'] for summary in summaries),
+        }
+
+
+# the cached report is only replaced once a build finished, a failed fan-out leaves it as it was
+def load_report(student_id):
+    start_date, end_date = get_current_semester()
+    report = schedule_cache.get(report_key(student_id, start_date), namespace='report')
+    return report.copy() if report is not None else SemesterReport(start_date, end_date)
+
+
+async def load_report_async(student_id):
+    start_date, end_date = get_current_semester()
+    report = await schedule_cache.get_async(report_key(student_id, start_date), namespace='report')
+    return report.copy() if report is not None else SemesterReport(start_date, end_date)
+
+
+def save_report(student_id, report):
+    schedule_cache.set(report_key(student_id, report.start_date), report, namespace='report')
+
+
+async def save_report_async(student_id, report):
+    await schedule_cache.set_async(report_key(student_id, report.start_date), report, namespace='report')
+
+
+def build_report(user_session, student_id):
+    report = load_report(student_id)
+    disciplines_data = fetch_disciplines(user_session, student_id, report.start_date, report.end_date)
+    report.update(disciplines_data)
+    stale = report.stale(disciplines_data)
+    if stale:
+        # only disciplines older than REPORT_REFRESH_INTERVAL are fetched again
+        with ThreadPoolExecutor(max_workers=REPORT_FAN_OUT, thread_name_prefix='report') as pool:
+            journals = pool.map(lambda discipline: fetch_journal(user_session, student_id,
+                                                                 discipline['discipline_id'],
+                                                                 report.start_date, report.end_date), stale)
+            for discipline, journal in zip(stale, journals):
+                report.store(discipline, summarize_journal(discipline, journal, student_id))
+    save_report(student_id, report)
+    return report
+
+
+async def build_report_async(user_session, student_id):
+    report = await load_report_async(student_id)
+    disciplines_data = await fetch_disciplines_async(user_session, student_id, report.start_date, report.end_date)
+    report.update(disciplines_data)
+    semaphore = asyncio.Semaphore(REPORT_FAN_OUT)
+
+    async def refresh(discipline):
+        async with semaphore:
+            journal = await fetch_journal_async(user_session, student_id, discipline['discipline_id'],
+                                                report.start_date, report.end_date)
+        return discipline, summarize_journal(discipline, journal, student_id)
+
+    for discipline, summary in await asyncio.gather(*(refresh(discipline)
+                                                      for discipline in report.stale(disciplines_data))):
+        report.store(discipline, summary)
+    await save_report_async(student_id, report)
+    return report
@@ -0,0 +1,276 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'data/search_index.json')
+SEARCH_INDEX_REFRESH = int(os.getenv('SEARCH_INDEX_REFRESH', 24 * 3600))
+SEARCH_INDEX_REFRESH_DELAY = float(os.getenv('SEARCH_INDEX_REFRESH_DELAY', 0.5))
+SEARCH_INDEX_SEEDS = os.getenv('SEARCH_INDEX_SEEDS', 'абвгдежзиклмнопрстуфхцчшщэюя')
+SEARCH_TOP_N = int(os.getenv('SEARCH_TOP_N', 5))
+SEARCH_MAX_TYPOS = int(os.getenv('SEARCH_MAX_TYPOS', 2))
+SEARCH_FUZZY_CANDIDATES = 50
+
+SEARCH_TYPES = ('group', 'person')
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+
+# punctuation separates words, so "ПИ21-1" and "ПИ2-11" stay apart; only compact() glues them for ranking
+def normalize(text):
+    return ''.join(TRANSLIT.get(ch, ch) if ch.isalnum() else ' ' for ch in text.lower())
+
+
+def compact(text):
+    return ''.join(normalize(text).split())
+
+
+def search_keys(label):
+    # every word suffix of the label, so "Иванов Иван Иванович" is found by "иван" and by "иванович"
+    words = normalize(label).split()
+    return [(''.join(words[position:]), position) for position in range(len(words))]
+
+
+def trigrams(text):
+    text = f'^{text}$'
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def edit_distance(a, b, limit):
+    # optimal string alignment: a swapped pair of letters counts as a single typo
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def exact_match(text, item):
+    return normalize(text).split() == normalize(item['label']).split()
+
+
+# upstream answers follow the index ranking; a label matching the typed text goes first
+def merge_candidates(text, candidates, found, limit=SEARCH_TOP_N):
+    merged = {}
+    for item in list(candidates) + list(found):
+        merged.setdefault(item['id'], item)
+    return sorted(merged.values(), key=lambda item: not exact_match(text, item))[:limit]
+
+
+def clean_item(item):
+    return {'id': item['id'], 'label': item['label'], 'description': item.get('description') or ''}
+
+
+class SearchIndex:
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {search_type: {} for search_type in SEARCH_TYPES}
+        self.keys = {search_type: [] for search_type in SEARCH_TYPES}
+        self.grams = {search_type: {} for search_type in SEARCH_TYPES}
+        self.refreshed_at = 0
+        self.dirty = False
+        self.mtime = None
+        self.load()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries.values())
+
+    def lookup(self, search_type, text, limit=SEARCH_TOP_N):
+        query = compact(text)
+        if not query:
+            return []
+        self.reload()
+        with self.lock:
+            entries = self.entries[search_type]
+            scores = self._prefix_scores(search_type, query) or self._fuzzy_scores(search_type, query)
+            words = normalize(text).split()
+
+            # the label typed in full goes first, ahead of labels that only differ in punctuation
+            def rank(item_id):
+                label = entries[item_id]['label']
+                return normalize(label).split() != words, scores[item_id], label
+
+            ranked = sorted(scores, key=rank)
+            return [entries[item_id] for item_id in ranked[:limit]]
+
+    def label(self, search_type, item_id):
+        # ids picked from a keyboard come back as strings
+        with self.lock:
+            entries = self.entries[search_type]
+            item = entries.get(item_id) or entries.get(str(item_id))
+            if item is None and str(item_id).isdigit():
+                item = entries.get(int(item_id))
+        return item['label'] if item is not None else None
+
+    def add(self, search_type, items):
+        items = [clean_item(item) for item in items or [] if item.get('id') is not None and item.get('label')]
+        with self.lock:
+            entries = self.entries[search_type]
+            rebuild = False
+            for item in items:
+                known = entries.get(item['id'])
+                if known == item:
+                    continue
+                entries[item['id']] = item
+                self.dirty = True
+                if known is None:
+                    self._index(search_type, item)
+                else:
+                    rebuild = True
+            if rebuild:
+                self._rebuild(search_type)
+        return items
+
+    def refresh(self, fetch):
+        for search_type in SEARCH_TYPES:
+            for seed in SEARCH_INDEX_SEEDS:
+                self.add(search_type, fetch(search_type, seed))
+                time.sleep(SEARCH_INDEX_REFRESH_DELAY)
+        self.refreshed_at = time.time()
+        self.save()
+
+    async def refresh_async(self, fetch):
+        for search_type in SEARCH_TYPES:
+            for seed in SEARCH_INDEX_SEEDS:
+                self.add(search_type, await fetch(search_type, seed))
+                await asyncio.sleep(SEARCH_INDEX_REFRESH_DELAY)
+        self.refreshed_at = time.time()
+        self.save()
+
+    def refresh_due(self):
+        return time.time() - self.refreshed_at >= SEARCH_INDEX_REFRESH
+
+    def start_refresher(self, fetch):
+        def run():
+            while True:
+                try:
+                    if self.refresh_due():
+                        self.refresh(fetch)
+                    elif self.dirty:
+                        self.save()
+                except Exception:
+                    pass
+                time.sleep(60)
+
+        thread = threading.Thread(target=run, name='search-index', daemon=True)
+        thread.start()
+        return thread
+
+    async def run_refresher_async(self, fetch):
+        while True:
+            try:
+                if self.refresh_due():
+                    await self.refresh_async(fetch)
+                elif self.dirty:
+                    self.save()
+            except Exception:
+                pass
+            await asyncio.sleep(60)
+
+    def file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    # only one shard refreshes the index, the others pick up what it saves
+    def reload(self):
+        mtime = self.file_mtime()
+        if mtime is not None and mtime != self.mtime:
+            self.load()
+
+    def load(self):
+        mtime = self.file_mtime()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.mtime = mtime
+        self.refreshed_at = max(self.refreshed_at, snapshot.get('refreshed_at', 0))
+        dirty = self.dirty
+        for search_type in SEARCH_TYPES:
+            self.add(search_type, snapshot.get('entries', {}).get(search_type, []))
+        self.dirty = dirty
+
+    def save(self):
+        with self.lock:
+            snapshot = {
+                'refreshed_at': self.refreshed_at,
+                'entries': {search_type: list(entries.values()) for search_type, entries in self.entries.items()},
+            }
+            self.dirty = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+        self.mtime = self.file_mtime()
+
+    def _index(self, search_type, item):
+        for key, position in search_keys(item['label']):
+            entry = (key, position, item['id'])
+            bisect.insort(self.keys[search_type], entry, key=lambda e: (e[0], e[1], str(e[2])))
+            for gram in trigrams(key):
+                self.grams[search_type].setdefault(gram, set()).add(entry)
+
+    def _rebuild(self, search_type):
+        self.keys[search_type] = []
+        self.grams[search_type] = {}
+        for item in self.entries[search_type].values():
+            self._index(search_type, item)
+
+    def _prefix_scores(self, search_type, query):
+        keys = self.keys[search_type]
+        entries = self.entries[search_type]
+        scores = {}
+        index = bisect.bisect_left(keys, query, key=lambda e: e[0])
+        while index < len(keys) and keys[index][0].startswith(query):
+            key, position, item_id = keys[index]
+            score = (0, key != query, position, len(entries[item_id]['label']))
+            if item_id not in scores or score < scores[item_id]:
+                scores[item_id] = score
+            index += 1
+        return scores
+
+    def _fuzzy_scores(self, search_type, query):
+        limit = min(SEARCH_MAX_TYPOS, max(0, len(query) // 3))
+        if not limit:
+            return {}
+        entries = self.entries[search_type]
+        overlaps = {}
+        for gram in trigrams(query):
+            for entry in self.grams[search_type].get(gram, ()):
+                overlaps[entry] = overlaps.get(entry, 0) + 1
+        candidates = sorted(overlaps, key=overlaps.get, reverse=True)[:SEARCH_FUZZY_CANDIDATES]
+        scores = {}
+        for key, position, item_id in candidates:
+            distance = min(edit_distance(query, key[:len(query)], limit), edit_distance(query, key, limit))
+            if distance > limit:
+                continue
+            score = (1 + distance, False, position, len(entries[item_id]['label']))
+            if item_id not in scores or score < scores[item_id]:
+                scores[item_id] = score
+        return scores
+
+
+search_index = SearchIndex()
@@ -0,0 +1,196 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+
+from cache import schedule_cache
+from common import get_current_semester, get_current_monday, week_cache_key
+from upstream import fetch_schedule, fetch_schedule_async
+
+SEMESTER_FETCH_ENABLED = os.getenv('SEMESTER_FETCH_ENABLED', '1') == '1'
+SEMESTER_REFRESH_INTERVAL = int(os.getenv('SEMESTER_REFRESH_INTERVAL', 900))
+SEMESTER_REFRESH_WEEKS = int(os.getenv('SEMESTER_REFRESH_WEEKS', 4))
+
+refreshing = set()
+refreshing_lock = threading.Lock()
+background_tasks = set()
+
+
+def semester_bounds():
+    start_date, end_date = get_current_semester()
+    return datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)
+
+
+def semester_key(kind, entity_id, start_date):
+    return f"semester_{kind}_{entity_id}_{start_date.isoformat()}"
+
+
+def refresh_window(semester):
+    start_date = max(semester.start_date, get_current_monday())
+    end_date = min(semester.end_date, start_date + datetime.timedelta(weeks=SEMESTER_REFRESH_WEEKS, days=-1))
+    return start_date, end_date
+
+
+class SemesterSchedule:
+    def __init__(self, start_date, end_date, lessons):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.by_date = {}
+        self.refreshed_at = 0
+        self.update(start_date, end_date, lessons)
+
+    def update(self, start_date, end_date, lessons):
+        by_date = {day: items for day, items in self.by_date.items() if not start_date <= day <= end_date}
+        for lesson in lessons or []:
+            by_date.setdefault(lesson.date, []).append(lesson)
+        self.by_date = by_date
+        self.refreshed_at = time.time()
+
+    def covers(self, start_date, end_date):
+        return self.start_date <= start_date and end_date <= self.end_date
+
+    def stale(self):
+        return time.time() - self.refreshed_at >= SEMESTER_REFRESH_INTERVAL
+
+    def lessons_between(self, start_date, end_date):
+        lessons = []
+        for day in range((end_date - start_date).days + 1):
+            lessons.extend(self.by_date.get(start_date + datetime.timedelta(days=day), ()))
+        return lessons
+
+    def day(self, date):
+        return self.lessons_between(date, date)
+
+    def month(self, year, month):
+        start_date = max(self.start_date, datetime.date(year, month, 1))
+        next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+        return self.lessons_between(start_date, min(self.end_date, next_month - datetime.timedelta(days=1)))
+
+
+def drop_weeks(kind, entity_id, start_date, end_date):
+    monday = start_date - datetime.timedelta(days=start_date.weekday())
+    while monday <= end_date:
+        schedule_cache.delete(week_cache_key(kind, entity_id, monday), namespace='schedule')
+        monday += datetime.timedelta(weeks=1)
+
+
+def apply_refresh(kind, entity_id, semester, start_date, end_date, lessons):
+    semester.update(start_date, end_date, lessons)
+    drop_weeks(kind, entity_id, start_date, end_date)
+
+
+def claim_refresh(key):
+    with refreshing_lock:
+        if key in refreshing:
+            return False
+        refreshing.add(key)
+        return True
+
+
+def release_refresh(key):
+    with refreshing_lock:
+        refreshing.discard(key)
+
+
+def refresh_semester(kind, url, entity_id, semester, key):
+    try:
+        start_date, end_date = refresh_window(semester)
+        apply_refresh(kind, entity_id, semester, start_date, end_date,
+                      fetch_schedule(url, entity_id, start_date, end_date))
+        schedule_cache.set(key, semester, namespace='semester')
+    except Exception:
+        pass
+    finally:
+        release_refresh(key)
+
+
+async def refresh_semester_async(kind, url, entity_id, semester, key):
+    try:
+        start_date, end_date = refresh_window(semester)
+        lessons = await fetch_schedule_async(url, entity_id, start_date, end_date)
+        # dropping the cached weeks goes through the shared tier, which blocks
+        await asyncio.to_thread(apply_refresh, kind, entity_id, semester, start_date, end_date, lessons)
+        await schedule_cache.set_async(key, semester, namespace='semester')
+    except Exception:
+        pass
+    finally:
+        release_refresh(key)
+
+
+# lessons fetched outside the read path, e.g. by the change poller, replace what readers are served
+def replace_window(kind, entity_id, start_date, end_date, lessons):
+    key, semester = lookup_semester(kind, entity_id, start_date, end_date)
+    if semester is None:
+        drop_weeks(kind, entity_id, start_date, end_date)
+        return
+    apply_refresh(kind, entity_id, semester, start_date, end_date, lessons)
+    schedule_cache.set(key, semester, namespace='semester')
+
+
+def semester_lookup_key(kind, entity_id, start_date, end_date):
+    if not SEMESTER_FETCH_ENABLED:
+        return None
+    semester_start, semester_end = semester_bounds()
+    if not (semester_start <= start_date and end_date <= semester_end):
+        return None
+    return semester_key(kind, entity_id, semester_start)
+
+
+def lookup_semester(kind, entity_id, start_date, end_date):
+    key = semester_lookup_key(kind, entity_id, start_date, end_date)
+    if key is None:
+        return None, None
+    return key, schedule_cache.get(key, namespace='semester')
+
+
+async def lookup_semester_async(kind, entity_id, start_date, end_date):
+    key = semester_lookup_key(kind, entity_id, start_date, end_date)
+    if key is None:
+        return None, None
+    return key, await schedule_cache.get_async(key, namespace='semester')
+
+
+def load_semester(kind, url, entity_id, start_date, end_date):
+    key, semester = lookup_semester(kind, entity_id, start_date, end_date)
+    if key is None:
+        return None
+    if semester is None:
+        semester_start, semester_end = semester_bounds()
+        semester = SemesterSchedule(semester_start, semester_end,
+                                    fetch_schedule(url, entity_id, semester_start, semester_end))
+        schedule_cache.set(key, semester, namespace='semester')
+    elif semester.stale() and claim_refresh(key):
+        threading.Thread(target=refresh_semester, args=(kind, url, entity_id, semester, key),
+                         name='semester-refresh', daemon=True).start()
+    return semester
+
+
+async def load_semester_async(kind, url, entity_id, start_date, end_date):
+    key, semester = await lookup_semester_async(kind, entity_id, start_date, end_date)
+    if key is None:
+        return None
+    if semester is None:
+        semester_start, semester_end = semester_bounds()
+        semester = SemesterSchedule(semester_start, semester_end,
+                                    await fetch_schedule_async(url, entity_id, semester_start, semester_end))
+        await schedule_cache.set_async(key, semester, namespace='semester')
+    elif semester.stale() and claim_refresh(key):
+        task = asyncio.create_task(refresh_semester_async(kind, url, entity_id, semester, key))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    return semester
+
+
+def fetch_week(kind, url, entity_id, start_date, end_date):
+    semester = load_semester(kind, url, entity_id, start_date, end_date)
+    if semester is None:
+        return fetch_schedule(url, entity_id, start_date, end_date)
+    return semester.lessons_between(start_date, end_date)
+
+
+async def fetch_week_async(kind, url, entity_id, start_date, end_date):
+    semester = await load_semester_async(kind, url, entity_id, start_date, end_date)
+    if semester is None:
+        return await fetch_schedule_async(url, entity_id, start_date, end_date)
+    return semester.lessons_between(start_date, end_date)
@@ -0,0 +1,116 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import zlib
+
+import telebot
+from telebot import apihelper
+from telebot.types import BotCommandScopeDefault
+
+from common import BOT_TOKEN, BOT_MODE, BOT_WORKERS, not_auth_commands
+from metrics import register_queue, start_metrics_server
+from webhook import run_webhook
+
+SHARD_POLL_TIMEOUT = int(os.getenv('SHARD_POLL_TIMEOUT', 25))
+SHARD_STOP_TIMEOUT = float(os.getenv('SHARD_STOP_TIMEOUT', 10))
+
+
+def update_chat_id(payload):
+    for body in payload.values():
+        if not isinstance(body, dict):
+            continue
+        chat = body.get('chat') or (body.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = body.get('from') or body.get('user')
+        if user:
+            return user['id']
+    return 0
+
+
+def shard_for(chat_id, shards):
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+class ShardRouter:
+    def __init__(self, serve, workers=BOT_WORKERS):
+        # spawn keeps the workers free of the front process threads and sockets
+        self.context = multiprocessing.get_context('spawn')
+        self.serve = serve
+        self.queues = [self.context.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.routed = [0] * workers
+        self.restarts = 0
+
+    def start(self):
+        for shard in range(len(self.queues)):
+            self.spawn(shard)
+            register_queue(f'shard_{shard}', self.queues[shard].qsize)
+
+    def spawn(self, shard):
+        process = self.context.Process(target=self.serve, args=(self.queues[shard], shard),
+                                       name=f'bot-shard-{shard}', daemon=True)
+        process.start()
+        self.processes[shard] = process
+
+    def route(self, payload):
+        shard = shard_for(update_chat_id(payload), len(self.queues))
+        if not self.processes[shard].is_alive():
+            self.restarts += 1
+            self.spawn(shard)
+        self.queues[shard].put(payload)
+        self.routed[shard] += 1
+
+    async def route_async(self, payload):
+        self.route(payload)
+
+    def poll(self):
+        offset = None
+        while True:
+            try:
+                updates = apihelper.get_updates(BOT_TOKEN, offset=offset, timeout=SHARD_POLL_TIMEOUT,
+                                                long_polling_timeout=SHARD_POLL_TIMEOUT)
+            except Exception:
+                time.sleep(1)
+                continue
+            for payload in updates:
+                offset = payload['update_id'] + 1
+                self.route(payload)
+
+    def stop(self, timeout=SHARD_STOP_TIMEOUT):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+    def stats(self):
+        return {
+            'workers': len(self.queues),
+            'alive': sum(1 for process in self.processes if process is not None and process.is_alive()),
+            'routed': list(self.routed),
+            'restarts': self.restarts,
+        }
+
+
+def run_sharded(serve, workers=BOT_WORKERS):
+    router = ShardRouter(serve, workers)
+    router.start()
+    # the front serves metrics on METRICS_PORT, shard n on METRICS_PORT + n + 1
+    start_metrics_server()
+    front = telebot.TeleBot(BOT_TOKEN)
+    front.set_my_commands(not_auth_commands, scope=BotCommandScopeDefault())
+
+    async def register_webhook(**kwargs):
+        await asyncio.to_thread(front.set_webhook, **kwargs)
+
+    try:
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(router.route_async, register_webhook))
+        else:
+            router.poll()
+    finally:
+        router.stop()
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def in_flight(self):
+        return len(self.calls)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        # a cancelled waiter must not cancel the request the others are waiting on
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self.calls)
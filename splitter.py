@@ -0,0 +1,121 @@
+import re
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# text runs are capped so that a multi-megabyte run is never measured as a whole for every part
+HTML_TOKEN_PATTERN = re.compile(r'(<[^<>]*>)|(&#?\w+;)|([^<&]{1,8192}|[<&])')
+PLAIN_TOKEN_PATTERN = re.compile(r'()()([\s\S]{1,8192})')
+TAG_NAME_PATTERN = re.compile(r'</?\s*([a-zA-Z][\w-]*)')
+TAG_PATTERN = re.compile(r'<[^<>]*>')
+
+BREAK_LINE = 1
+BREAK_BLANK_LINE = 2
+BREAK_DAY = 3
+
+
+def utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def utf16_offset(text, budget):
+    if len(text) == utf16_length(text):
+        return min(budget, len(text))
+    length = 0
+    for i, char in enumerate(text):
+        length += 2 if ord(char) > 0xFFFF else 1
+        if length > budget:
+            return i
+    return len(text)
+
+
+def break_priority(text, position):
+    if text.startswith('📅', position):
+        return BREAK_DAY
+    if text.startswith('\n', position):
+        return BREAK_BLANK_LINE
+    return BREAK_LINE
+
+
+def apply_tag(stack, tag):
+    match = TAG_NAME_PATTERN.match(tag)
+    if match is None:
+        return stack
+    name = match.group(1).lower()
+    if not tag.startswith('</'):
+        return stack + ((name, tag),)
+    for i in range(len(stack) - 1, -1, -1):
+        if stack[i][0] == name:
+            return stack[:i] + stack[i + 1:]
+    return stack
+
+
+def closing_tags(stack):
+    return ''.join(f'</{name}>' for name, _ in reversed(stack))
+
+
+def opening_tags(stack):
+    return ''.join(tag for _, tag in stack)
+
+
+def skip_whitespace(text, position):
+    while position < len(text) and text[position] in ' \n':
+        position += 1
+    return position
+
+
+def add_breaks(breaks, text, run, run_start, visible, stack, end=None):
+    newline = run.find('\n', 0, end)
+    while newline != -1:
+        position = run_start + newline + 1
+        breaks[break_priority(text, position)] = (position, visible + newline + 1, stack)
+        newline = run.find('\n', newline + 1, end)
+
+
+def find_cut(text, start, stack, limit, pattern):
+    visible = 0
+    breaks = {}
+    for match in pattern.finditer(text, start):
+        tag, entity, run = match.groups()
+        if tag:
+            stack = apply_tag(stack, tag)
+            continue
+        size = 1 if entity else utf16_length(run)
+        if visible + size <= limit:
+            if not entity:
+                add_breaks(breaks, text, run, match.start(), visible, stack)
+            visible += size
+            continue
+
+        offset = 0 if entity else utf16_offset(run, limit - visible)
+        if offset:
+            add_breaks(breaks, text, run, match.start(), visible, stack, offset)
+        for priority in (BREAK_DAY, BREAK_BLANK_LINE, BREAK_LINE):
+            if priority in breaks and breaks[priority][1] >= limit // 2:
+                return breaks[priority][0], breaks[priority][2]
+        if breaks:
+            position, _, break_stack = max(breaks.values())
+            return position, break_stack
+        space = run.rfind(' ', 0, offset) if offset else -1
+        if space > offset // 2:
+            offset = space + 1
+        if offset == 0 and visible == 0:
+            offset = 1
+        return match.start() + offset, stack
+    return len(text), stack
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT, html=True):
+    pattern = HTML_TOKEN_PATTERN if html else PLAIN_TOKEN_PATTERN
+    start = skip_whitespace(text, 0)
+    stack = ()
+    while start < len(text):
+        cut, cut_stack = find_cut(text, start, stack, limit, pattern)
+        part = text[start:cut].rstrip(' \n')
+        if part and (not html or TAG_PATTERN.sub('', part).strip(' \n')):
+            yield opening_tags(stack) + part + closing_tags(cut_stack)
+        stack = cut_stack
+        start = skip_whitespace(text, cut)
+
+
+def split_long_message(text, parse_mode='HTML'):
+    return list(split_message(text, html=parse_mode == 'HTML'))
@@ -0,0 +1,390 @@
+import atexit
+import json
+import os
+import socket
+import sqlite3
+import threading
+
+from urllib.parse import urlparse
+from telebot.storage import StateMemoryStorage, StateStorageBase, StateDataContext
+from telebot.asyncio_storage import StateMemoryStorage as AsyncStateMemoryStorage
+from telebot.asyncio_storage import StateStorageBase as AsyncStateStorageBase
+from telebot.asyncio_storage import StateDataContext as AsyncStateDataContext
+
+STATE_STORAGE = os.getenv('STATE_STORAGE', 'sqlite')
+STATE_SQLITE_PATH = os.getenv('STATE_SQLITE_PATH', 'data/state.sqlite3')
+STATE_REDIS_URL = os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0')
+STATE_KEY_PREFIX = os.getenv('STATE_KEY_PREFIX', 'telebot')
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', 1.0))
+STATE_FLUSH_BATCH = int(os.getenv('STATE_FLUSH_BATCH', 500))
+
+# never written to disk or redis, only kept for the lifetime of the process
+TRANSIENT_KEYS = ('user_password',)
+
+
+def serialize_record(record):
+    data = {key: value for key, value in record['data'].items() if key not in TRANSIENT_KEYS}
+    return json.dumps({'state': record['state'], 'data': data}, ensure_ascii=False, separators=(',', ':'))
+
+
+def deserialize_record(raw):
+    if isinstance(raw, bytes):
+        raw = raw.decode()
+    return json.loads(raw)
+
+
+class SQLiteBackend:
+    def __init__(self, path=STATE_SQLITE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS states (key TEXT PRIMARY KEY, record TEXT NOT NULL)')
+        self.connection.commit()
+
+    def load_all(self):
+        for key, raw in self.connection.execute('SELECT key, record FROM states'):
+            yield key, deserialize_record(raw)
+
+    def write_batch(self, upserts, deletes):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO states (key, record) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET record = excluded.record',
+                upserts.items()
+            )
+            self.connection.executemany('DELETE FROM states WHERE key = ?', ((key,) for key in deletes))
+
+    def close(self):
+        self.connection.close()
+
+
+class RespError(Exception):
+    pass
+
+
+class RespClient:
+    def __init__(self, url=STATE_REDIS_URL, timeout=5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self._call(('AUTH', self.password))
+        if self.db:
+            self._call(('SELECT', self.db))
+
+    def close(self):
+        if self.sock:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        if not commands:
+            return []
+        try:
+            if self.sock is None:
+                self.connect()
+            return self._send(commands)
+        except (OSError, ConnectionError):
+            self.close()
+            self.connect()
+            return self._send(commands)
+
+    def _call(self, command):
+        return self._send([command])[0]
+
+    def _send(self, commands):
+        self.sock.sendall(b''.join(self._encode(command) for command in commands))
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    @staticmethod
+    def _encode(command):
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            return RespError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            value = self.reader.read(length + 2)
+            return value[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read() for _ in range(length)]
+        raise RespError(f'unexpected reply {line!r}')
+
+
+class RedisBackend:
+    def __init__(self, url=STATE_REDIS_URL, prefix=STATE_KEY_PREFIX):
+        self.client = RespClient(url)
+        self.prefix = prefix
+
+    def load_all(self):
+        cursor = b'0'
+        while True:
+            cursor, keys = self.client.execute('SCAN', cursor, 'MATCH', f'{self.prefix}*', 'COUNT', 1000)
+            if keys:
+                for key, raw in zip(keys, self.client.execute('MGET', *keys)):
+                    if raw is not None:
+                        yield key.decode(), deserialize_record(raw)
+            if cursor == b'0':
+                break
+
+    def write_batch(self, upserts, deletes):
+        commands = [('SET', key, raw) for key, raw in upserts.items()]
+        if deletes:
+            commands.append(('DEL', *deletes))
+        self.client.pipeline(commands)
+
+    def close(self):
+        self.client.close()
+
+
+class StateStore:
+    def __init__(self, backend, flush_interval=STATE_FLUSH_INTERVAL, batch_size=STATE_FLUSH_BATCH):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.records = dict(backend.load_all())
+        self.dirty = set()
+        self.deleted = set()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.flusher = threading.Thread(target=self._flush_loop, name='state-flush', daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def put(self, key, record):
+        with self.lock:
+            self.records[key] = record
+            self.dirty.add(key)
+            self.deleted.discard(key)
+            if len(self.dirty) >= self.batch_size:
+                self.wakeup.set()
+
+    def delete(self, key):
+        with self.lock:
+            if self.records.pop(key, None) is None:
+                return False
+            self.dirty.discard(key)
+            self.deleted.add(key)
+            return True
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                upserts = {key: serialize_record(self.records[key]) for key in self.dirty}
+                deletes = set(self.deleted)
+                self.dirty.clear()
+                self.deleted.clear()
+            if not upserts and not deletes:
+                return
+            try:
+                self.backend.write_batch(upserts, deletes)
+            except Exception:
+                with self.lock:
+                    self.dirty.update(key for key in upserts if key in self.records)
+                    self.deleted.update(key for key in deletes if key not in self.records)
+                raise
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.flusher.join(timeout=5)
+        self.flush()
+        self.backend.close()
+
+    def _flush_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+
+def create_state_store():
+    if STATE_STORAGE == 'redis':
+        return StateStore(RedisBackend(STATE_REDIS_URL, STATE_KEY_PREFIX))
+    return StateStore(SQLiteBackend(STATE_SQLITE_PATH))
+
+
+class PersistentStateMixin:
+    def __init__(self, store_factory=create_state_store, separator=':', prefix=STATE_KEY_PREFIX):
+        self.separator = separator
+        self.prefix = prefix
+        self.store_factory = store_factory
+        self._store = None
+        self._store_lock = threading.Lock()
+
+    @property
+    def store(self):
+        # opened lazily so that importing the threaded runtime does not open the database
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = self.store_factory()
+        return self._store
+
+    def _key(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._get_key(chat_id, user_id, self.prefix, self.separator,
+                             business_connection_id, message_thread_id, bot_id)
+
+    def _set_state(self, key, state):
+        if hasattr(state, 'name'):
+            state = state.name
+        record = self.store.get(key)
+        self.store.put(key, {'state': state, 'data': record['data'] if record else {}})
+        return True
+
+    def _get_state(self, key):
+        record = self.store.get(key)
+        return record['state'] if record else None
+
+    def _set_data(self, key, name, value):
+        record = self.store.get(key)
+        if record is None:
+            raise RuntimeError(f"PersistentStateStorage: key {key} does not exist.")
+        self.store.put(key, {'state': record['state'], 'data': {**record['data'], name: value}})
+        return True
+
+    def _get_data(self, key):
+        record = self.store.get(key)
+        return record['data'] if record else {}
+
+    def _reset_data(self, key):
+        record = self.store.get(key)
+        if record is None:
+            return False
+        self.store.put(key, {'state': record['state'], 'data': {}})
+        return True
+
+    def _save(self, key, data):
+        record = self.store.get(key)
+        if record is None:
+            return False
+        self.store.put(key, {'state': record['state'], 'data': data})
+        return True
+
+
+class PersistentStateStorage(PersistentStateMixin, StateStorageBase):
+    def set_state(self, chat_id, user_id, state, business_connection_id=None, message_thread_id=None,
+                  bot_id=None):
+        return self._set_state(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id), state)
+
+    def get_state(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._get_state(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    def delete_state(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self.store.delete(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    def set_data(self, chat_id, user_id, key, value, business_connection_id=None, message_thread_id=None,
+                 bot_id=None):
+        return self._set_data(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id),
+                              key, value)
+
+    def get_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._get_data(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    def reset_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._reset_data(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    def get_interactive_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None,
+                             bot_id=None):
+        return StateDataContext(self, chat_id=chat_id, user_id=user_id,
+                                business_connection_id=business_connection_id,
+                                message_thread_id=message_thread_id, bot_id=bot_id)
+
+    def save(self, chat_id, user_id, data, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._save(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id), data)
+
+
+class AsyncPersistentStateStorage(PersistentStateMixin, AsyncStateStorageBase):
+    async def set_state(self, chat_id, user_id, state, business_connection_id=None, message_thread_id=None,
+                        bot_id=None):
+        return self._set_state(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id), state)
+
+    async def get_state(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._get_state(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    async def delete_state(self, chat_id, user_id, business_connection_id=None, message_thread_id=None,
+                           bot_id=None):
+        return self.store.delete(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    async def set_data(self, chat_id, user_id, key, value, business_connection_id=None, message_thread_id=None,
+                       bot_id=None):
+        return self._set_data(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id),
+                              key, value)
+
+    async def get_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._get_data(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    async def reset_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None,
+                         bot_id=None):
+        return self._reset_data(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+
+    def get_interactive_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None,
+                             bot_id=None):
+        return AsyncStateDataContext(self, chat_id=chat_id, user_id=user_id,
+                                     business_connection_id=business_connection_id,
+                                     message_thread_id=message_thread_id, bot_id=bot_id)
+
+    async def save(self, chat_id, user_id, data, business_connection_id=None, message_thread_id=None,
+                   bot_id=None):
+        return self._save(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id), data)
+
+
+def create_state_storage():
+    if STATE_STORAGE == 'memory':
+        return StateMemoryStorage(prefix=STATE_KEY_PREFIX)
+    return PersistentStateStorage()
+
+
+def create_async_state_storage():
+    if STATE_STORAGE == 'memory':
+        return AsyncStateMemoryStorage(prefix=STATE_KEY_PREFIX)
+    return AsyncPersistentStateStorage()
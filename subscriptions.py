@@ -0,0 +1,133 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SUBSCRIPTIONS_SQLITE_PATH = os.getenv('SUBSCRIPTIONS_SQLITE_PATH', 'data/subscriptions.sqlite3')
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS subscriptions (chat_id INTEGER NOT NULL, kind TEXT NOT NULL, '
+    'entity_id TEXT NOT NULL, label TEXT NOT NULL, created_at REAL NOT NULL, '
+    'PRIMARY KEY (chat_id, kind, entity_id))',
+    'CREATE INDEX IF NOT EXISTS subscriptions_entity ON subscriptions (kind, entity_id)',
+    'CREATE TABLE IF NOT EXISTS snapshots (kind TEXT NOT NULL, entity_id TEXT NOT NULL, '
+    'start_date TEXT NOT NULL, end_date TEXT NOT NULL, lessons TEXT NOT NULL, checked_at REAL NOT NULL, '
+    'PRIMARY KEY (kind, entity_id))',
+    'CREATE TABLE IF NOT EXISTS digests (chat_id INTEGER PRIMARY KEY, group_id TEXT NOT NULL, '
+    'label TEXT NOT NULL, send_at INTEGER NOT NULL, last_sent TEXT NOT NULL, enabled INTEGER NOT NULL, '
+    'updated_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS digests_updated ON digests (updated_at)',
+)
+DIGEST_COLUMNS = 'chat_id, group_id, label, send_at, last_sent, enabled, updated_at'
+
+
+# every shard writes here and the background jobs on shard 0 read from here
+class SubscriptionStore:
+    def __init__(self, path=SUBSCRIPTIONS_SQLITE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            self.connection = connection
+        return self.connection
+
+    def query(self, statement, params=()):
+        with self.lock:
+            return self.connect().execute(statement, params).fetchall()
+
+    def execute(self, statement, params=()):
+        with self.lock, self.connect():
+            return self.connection.execute(statement, params).rowcount
+
+    def subscribe(self, chat_id, kind, entity_id, label):
+        self.execute('INSERT INTO subscriptions (chat_id, kind, entity_id, label, created_at) VALUES (?, ?, ?, ?, ?) '
+                     'ON CONFLICT(chat_id, kind, entity_id) DO UPDATE SET label = excluded.label',
+                     (chat_id, kind, str(entity_id), label, time.time()))
+
+    def unsubscribe(self, chat_id, kind=None, entity_id=None):
+        if kind is None:
+            return self.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+        return self.execute('DELETE FROM subscriptions WHERE chat_id = ? AND kind = ? AND entity_id = ?',
+                            (chat_id, kind, str(entity_id)))
+
+    def subscribed(self, chat_id, kind, entity_id):
+        return bool(self.query('SELECT 1 FROM subscriptions WHERE chat_id = ? AND kind = ? AND entity_id = ?',
+                               (chat_id, kind, str(entity_id))))
+
+    def subscribers(self, kind, entity_id):
+        return [row[0] for row in self.query('SELECT chat_id FROM subscriptions WHERE kind = ? AND entity_id = ?',
+                                             (kind, str(entity_id)))]
+
+    # one row per distinct group or teacher, longest unchecked first
+    def due(self, checked_before, limit):
+        return self.query('SELECT s.kind, s.entity_id, MAX(s.label) FROM subscriptions s '
+                          'LEFT JOIN snapshots n ON n.kind = s.kind AND n.entity_id = s.entity_id '
+                          'WHERE n.checked_at IS NULL OR n.checked_at <= ? '
+                          'GROUP BY s.kind, s.entity_id ORDER BY MAX(COALESCE(n.checked_at, 0)) LIMIT ?',
+                          (checked_before, limit))
+
+    def snapshot(self, kind, entity_id):
+        rows = self.query('SELECT start_date, end_date, lessons FROM snapshots WHERE kind = ? AND entity_id = ?',
+                          (kind, str(entity_id)))
+        if not rows:
+            return None
+        start_date, end_date, lessons = rows[0]
+        return datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date), json.loads(lessons)
+
+    def save_snapshot(self, kind, entity_id, start_date, end_date, lessons):
+        self.execute('INSERT INTO snapshots (kind, entity_id, start_date, end_date, lessons, checked_at) '
+                     'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(kind, entity_id) DO UPDATE SET '
+                     'start_date = excluded.start_date, end_date = excluded.end_date, '
+                     'lessons = excluded.lessons, checked_at = excluded.checked_at',
+                     (kind, str(entity_id), start_date.isoformat(), end_date.isoformat(),
+                      json.dumps(lessons, ensure_ascii=False, separators=(',', ':')), time.time()))
+
+    def touch_snapshot(self, kind, entity_id):
+        self.execute('UPDATE snapshots SET checked_at = ? WHERE kind = ? AND entity_id = ?',
+                     (time.time(), kind, str(entity_id)))
+
+    # a group nobody follows any more starts from a fresh baseline if it is subscribed to again
+    def prune_snapshots(self):
+        return self.execute('DELETE FROM snapshots WHERE NOT EXISTS (SELECT 1 FROM subscriptions s '
+                            'WHERE s.kind = snapshots.kind AND s.entity_id = snapshots.entity_id)')
+
+    # send_at is minutes after midnight; last_sent survives a change of time so a digest is never sent twice a day
+    def set_digest(self, chat_id, group_id, label, send_at):
+        self.execute(f'INSERT INTO digests ({DIGEST_COLUMNS}) VALUES (?, ?, ?, ?, ?, 1, ?) '
+                     'ON CONFLICT(chat_id) DO UPDATE SET group_id = excluded.group_id, label = excluded.label, '
+                     'send_at = excluded.send_at, enabled = 1, updated_at = excluded.updated_at',
+                     (chat_id, str(group_id), label, send_at, '', time.time()))
+
+    # rows are disabled rather than deleted, so the scheduler of another process sees the change
+    def cancel_digest(self, chat_id):
+        return self.execute('UPDATE digests SET enabled = 0, updated_at = ? WHERE chat_id = ? AND enabled = 1',
+                            (time.time(), chat_id))
+
+    def digest(self, chat_id):
+        rows = self.query(f'SELECT {DIGEST_COLUMNS} FROM digests WHERE chat_id = ? AND enabled = 1', (chat_id,))
+        return rows[0] if rows else None
+
+    def digests_changed(self, since):
+        return self.query(f'SELECT {DIGEST_COLUMNS} FROM digests WHERE updated_at >= ? ORDER BY updated_at',
+                          (since,))
+
+    def mark_digests_sent(self, chat_ids, date):
+        with self.lock, self.connect():
+            self.connection.executemany('UPDATE digests SET last_sent = ? WHERE chat_id = ?',
+                                        ((date.isoformat(), chat_id) for chat_id in chat_ids))
+
+
+subscriptions = SubscriptionStore()
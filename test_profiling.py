@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+
+from profiling import ProfileSession, profiled
+
+
+def spin(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+# longer than the interpreter switch interval, so the sampler gets the GIL in the middle of a spin
+async def target_handler(rounds):
+    for _ in range(rounds):
+        spin(0.02)
+        await asyncio.sleep(0)
+
+
+async def other_task(rounds):
+    for _ in range(rounds):
+        spin(0.02)
+        await asyncio.sleep(0)
+
+
+def test_async_sampling_keeps_only_the_profiled_task():
+    session = ProfileSession('sampling', ['target_handler'], 60)
+    handler = profiled(target_handler, session)
+    done = threading.Event()
+
+    async def main():
+        await asyncio.gather(handler(10), other_task(20))
+        done.set()
+
+    loop_thread = threading.Thread(target=asyncio.run, args=(main(),))
+    loop_thread.start()
+    while not done.is_set():
+        session.sample()
+        time.sleep(0.001)
+    loop_thread.join()
+
+    assert session.samples
+    assert all(stack.startswith('target_handler') for stack in session.samples)
+    assert not any('other_task' in stack for stack in session.samples)
+    assert session.calls == 1 and not session.tasks
+
+
+def test_thread_sampling_keeps_the_whole_stack():
+    session = ProfileSession('sampling', ['spin'], 60)
+    worker = threading.Thread(target=profiled(spin, session), args=(0.2,))
+    worker.start()
+    while worker.is_alive():
+        session.sample()
+        time.sleep(0.005)
+    worker.join()
+
+    assert session.samples
+    assert all(stack.startswith('_bootstrap') and 'spin' in stack for stack in session.samples)
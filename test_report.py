@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import report
+from cache import schedule_cache
+
+STUDENT_ID = 'test-report-student'
+DISCIPLINES = {'attendance_percent': 90, 'disciplines': [{'discipline_id': 1, 'discipline_name': 'Физика'},
+                                                         {'discipline_id': 2, 'discipline_name': 'Химия'}]}
+JOURNAL = {'lessons': {'1': {}, '2': {}},
+           'rows': {STUDENT_ID: {'mark_sum': 5, 'lessons': {'1': {'attendance': {'visit_status_id': 2}}}}}}
+
+
+def failing_journal(user_session, student_id, discipline_id, start_date, end_date):
+    if discipline_id == 2:
+        raise ConnectionError('journal unavailable')
+    return JOURNAL
+
+
+async def failing_journal_async(*args):
+    return failing_journal(*args)
+
+
+async def disciplines_async(*args):
+    return DISCIPLINES
+
+
+@pytest.fixture
+def cached_report(monkeypatch):
+    monkeypatch.setattr(report, 'fetch_disciplines', lambda *args: DISCIPLINES)
+    monkeypatch.setattr(report, 'fetch_disciplines_async', disciplines_async)
+    monkeypatch.setattr(report, 'fetch_journal', failing_journal)
+    monkeypatch.setattr(report, 'fetch_journal_async', failing_journal_async)
+    cached = report.load_report(STUDENT_ID)
+    report.save_report(STUDENT_ID, cached)
+    yield cached
+    schedule_cache.delete(report.report_key(STUDENT_ID, cached.start_date))
+
+
+def test_failed_fan_out_leaves_cached_report_untouched(cached_report):
+    with pytest.raises(ConnectionError):
+        report.build_report(None, STUDENT_ID)
+    assert cached_report.order == [] and cached_report.disciplines == {}
+
+
+def test_failed_async_fan_out_leaves_cached_report_untouched(cached_report):
+    with pytest.raises(ConnectionError):
+        asyncio.run(report.build_report_async(None, STUDENT_ID))
+    assert cached_report.order == [] and cached_report.disciplines == {}
+
+
+def test_successful_build_replaces_cached_report(cached_report, monkeypatch):
+    monkeypatch.setattr(report, 'fetch_journal', lambda *args: JOURNAL)
+    built = report.build_report(None, STUDENT_ID)
+    assert built is not cached_report
+    assert report.load_report(STUDENT_ID).totals() == {'total': 4, 'missed': 2, 'percent': 50.0, 'mark_sum': 10.0}
@@ -0,0 +1,101 @@
+import random
+import re
+
+import pytest
+
+from splitter import TELEGRAM_MESSAGE_LIMIT, split_long_message, split_message, utf16_length
+
+TOKEN_PATTERN = re.compile(r'(<[^<>]*>)|(&#?\w+;)|([\s\S])')
+TAG_NAME_PATTERN = re.compile(r'</?([a-z]+)')
+
+TAGS = ('b', 'i', 'u', 's', 'code', 'pre', 'a')
+WORDS = ('пара', 'Лекция', 'ауд. 305', 'Иванов И.И.', '09:00', '😀', '👩‍💻', 'x', 'a' * 40)
+MARKUP = ('<b>', '</i>', '<a href="x">', '&amp;', '&lt;', '<', '&', '>')
+
+
+def random_text(rng, markup=False):
+    pieces = []
+    for _ in range(rng.randint(1, 12)):
+        roll = rng.random()
+        if roll < 0.15:
+            pieces.append(rng.choice(('\n', '\n\n', '\n📅 Понедельник\n')))
+        elif roll < 0.2:
+            pieces.append(rng.choice('абвгxyz😀') * rng.randint(50, 600))
+        elif roll < 0.3:
+            pieces.append(rng.choice(MARKUP) if markup else rng.choice(('&lt;', '&gt;', '&amp;', '&#39;')))
+        else:
+            pieces.append(rng.choice(WORDS))
+        pieces.append(rng.choice(('', ' ', ' ', '  ')))
+    return ''.join(pieces)
+
+
+def random_html(rng, depth=0):
+    pieces = []
+    for _ in range(rng.randint(1, 8)):
+        if depth < 3 and rng.random() < 0.3:
+            name = rng.choice(TAGS)
+            opening = f'<a href="https://example.com/{rng.randint(1, 99)}">' if name == 'a' else f'<{name}>'
+            pieces.append(f'{opening}{random_html(rng, depth + 1)}</{name}>')
+        else:
+            pieces.append(random_text(rng))
+    return ''.join(pieces)
+
+
+# (char, enclosing tags) for every visible character except the spaces and newlines a cut may swallow;
+# fails on a closing tag that does not match the innermost open one or on a tag left open
+def visible_chars(html):
+    stack = []
+    chars = []
+    for tag, entity, char in TOKEN_PATTERN.findall(html):
+        if tag:
+            name = TAG_NAME_PATTERN.match(tag).group(1)
+            if tag.startswith('</'):
+                assert stack and stack[-1] == name, html
+                stack.pop()
+            else:
+                stack.append(name)
+        elif entity or char not in ' \n':
+            chars.append((entity or char, tuple(stack)))
+    assert not stack, html
+    return chars
+
+
+def visible_length(html):
+    return sum(1 if entity else utf16_length(char) for tag, entity, char in TOKEN_PATTERN.findall(html) if not tag)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_html_parts_fit_and_keep_formatting(seed):
+    rng = random.Random(seed)
+    text = random_html(rng)
+    limit = rng.choice((20, 50, 100, 300, 1000))
+    parts = list(split_message(text, limit))
+    assert all(visible_length(part) <= limit for part in parts)
+    assert [char for part in parts for char in visible_chars(part)] == visible_chars(text)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_plain_parts_fit_and_are_never_parsed(seed):
+    rng = random.Random(seed)
+    text = random_text(rng, markup=True)
+    limit = rng.choice((20, 50, 100, 300, 1000))
+    parts = list(split_message(text, limit, html=False))
+    assert all(part and utf16_length(part) <= limit for part in parts)
+    # nothing is added or unescaped: each part is a verbatim slice of the input
+    assert all(part in text for part in parts)
+    assert ''.join(''.join(parts).split()) == ''.join(text.split())
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_telegram_limit(seed):
+    rng = random.Random(seed)
+    text = ''.join(random_html(rng) for _ in range(40))
+    parts = split_long_message(text)
+    assert len(parts) > 1
+    assert all(visible_length(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert [char for part in parts for char in visible_chars(part)] == visible_chars(text)
+
+
+def test_short_message_is_one_part():
+    assert split_long_message('<b>Пн</b> 09:00 &lt;ауд&gt;') == ['<b>Пн</b> 09:00 &lt;ауд&gt;']
+    assert split_long_message('<b>Пн</b>', parse_mode=None) == ['<b>Пн</b>']
@@ -0,0 +1,203 @@
+import fnmatch
+import socketserver
+import threading
+
+import pytest
+
+from state_storage import RedisBackend, RespClient, SQLiteBackend, StateStore, serialize_record
+
+# SCAN pages are kept small so that the cursor loop in RedisBackend.load_all is exercised
+SCAN_PAGE = 2
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = [self.rfile.read(int(self.rfile.readline()[1:-2]) + 2)[:-2] for _ in range(int(line[1:-2]))]
+            self.wfile.write(self.server.execute(command[0].decode().upper(), command[1:]))
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        super().__init__(('127.0.0.1', 0), RespHandler)
+        self.password = password
+        self.data = {}
+        self.commands = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        auth = f':{self.password}@' if self.password else ''
+        return f'redis://{auth}127.0.0.1:{self.server_address[1]}/1'
+
+    def execute(self, name, args):
+        with self.lock:
+            self.commands.append(name)
+            if name == 'AUTH':
+                return b'+OK\r\n' if args[0].decode() == self.password else b'-WRONGPASS invalid password\r\n'
+            if name == 'SELECT':
+                return b'+OK\r\n'
+            if name == 'SET':
+                self.data[args[0]] = args[1]
+                return b'+OK\r\n'
+            if name == 'GET':
+                return bulk(self.data.get(args[0]))
+            if name == 'MGET':
+                return b'*%d\r\n' % len(args) + b''.join(bulk(self.data.get(key)) for key in args)
+            if name == 'DEL':
+                removed = [self.data.pop(key) for key in args if key in self.data]
+                return b':%d\r\n' % len(removed)
+            if name == 'SCAN':
+                pattern = args[args.index(b'MATCH') + 1].decode()
+                keys = sorted(key for key in self.data if fnmatch.fnmatchcase(key.decode(), pattern))
+                cursor = int(args[0])
+                following = cursor + SCAN_PAGE if cursor + SCAN_PAGE < len(keys) else 0
+                page = keys[cursor:cursor + SCAN_PAGE]
+                return b'*2\r\n' + bulk(str(following).encode()) + b'*%d\r\n' % len(page) + b''.join(map(bulk, page))
+            return b'-ERR unknown command\r\n'
+
+
+def bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class RecordingBackend:
+    def __init__(self, backend):
+        self.backend = backend
+        self.batches = []
+        self.written = threading.Event()
+
+    def load_all(self):
+        return self.backend.load_all()
+
+    def write_batch(self, upserts, deletes):
+        self.batches.append((dict(upserts), set(deletes)))
+        self.backend.write_batch(upserts, deletes)
+        self.written.set()
+
+    def close(self):
+        self.backend.close()
+
+
+@pytest.fixture
+def resp_server():
+    server = RespServer(password='secret')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def make_backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return lambda: SQLiteBackend(str(tmp_path / 'state' / 'state.sqlite3'))
+    server = request.getfixturevalue('resp_server')
+    return lambda: RedisBackend(server.url, prefix='telebot')
+
+
+def record(state, **data):
+    return {'state': state, 'data': data}
+
+
+def test_resp_client_round_trip(resp_server):
+    client = RespClient(resp_server.url)
+    assert client.execute('SET', 'telebot:1', 'значение') == b'OK'
+    assert client.execute('GET', 'telebot:1') == 'значение'.encode()
+    assert client.execute('GET', 'missing') is None
+    assert client.pipeline([('DEL', 'telebot:1'), ('DEL', 'telebot:1')]) == [1, 0]
+    assert resp_server.commands[:2] == ['AUTH', 'SELECT']
+    client.close()
+
+
+def test_resp_client_reconnects_after_dropped_connection(resp_server):
+    client = RespClient(resp_server.url)
+    client.execute('SET', 'telebot:1', 'a')
+    client.sock.close()
+    assert client.execute('GET', 'telebot:1') == b'a'
+    client.close()
+
+
+def test_backend_write_and_load(make_backend):
+    backend = make_backend()
+    records = {f'telebot:{n}:{n}': record('menu', group_id=n) for n in range(5)}
+    backend.write_batch({key: serialize_record(value) for key, value in records.items()}, set())
+    backend.write_batch({}, {'telebot:0:0', 'telebot:missing'})
+    del records['telebot:0:0']
+    assert dict(backend.load_all()) == records
+    backend.close()
+
+    # a fresh connection sees what the previous one wrote
+    backend = make_backend()
+    assert dict(backend.load_all()) == records
+    backend.close()
+
+
+def test_store_warm_loads_existing_records(make_backend):
+    backend = make_backend()
+    backend.write_batch({'telebot:1:1': serialize_record(record('menu', student_id=7))}, set())
+    backend.close()
+
+    store = StateStore(make_backend(), flush_interval=60)
+    assert store.get('telebot:1:1') == record('menu', student_id=7)
+    store.close()
+
+
+def test_store_flushes_a_full_batch_at_once(make_backend):
+    backend = RecordingBackend(make_backend())
+    store = StateStore(backend, flush_interval=60, batch_size=3)
+    for n in range(3):
+        store.put(f'telebot:{n}:{n}', record('menu', group_id=n))
+    assert backend.written.wait(5)
+    assert backend.batches == [({f'telebot:{n}:{n}': serialize_record(record('menu', group_id=n))
+                                 for n in range(3)}, set())]
+    store.close()
+
+
+def test_store_deletes_after_logout(make_backend):
+    store = StateStore(make_backend(), flush_interval=60)
+    store.put('telebot:1:1', record('menu', student_id=7))
+    store.flush()
+    assert store.delete('telebot:1:1')
+    assert not store.delete('telebot:1:1')
+    store.close()
+
+    store = StateStore(make_backend(), flush_interval=60)
+    assert store.get('telebot:1:1') is None
+    store.close()
+
+
+def test_store_never_persists_transient_keys(make_backend):
+    store = StateStore(make_backend(), flush_interval=60)
+    store.put('telebot:1:1', record('password', user_login='ivanov', user_password='hunter2'))
+    assert store.get('telebot:1:1')['data']['user_password'] == 'hunter2'
+    store.close()
+
+    store = StateStore(make_backend(), flush_interval=60)
+    assert store.get('telebot:1:1') == record('password', user_login='ivanov')
+    store.close()
+
+
+def test_store_flushes_pending_writes_on_close(make_backend):
+    backend = RecordingBackend(make_backend())
+    store = StateStore(backend, flush_interval=60)
+    store.put('telebot:1:1', record('menu', group_id=1))
+    store.put('telebot:2:2', record('menu', group_id=2))
+    store.delete('telebot:2:2')
+    assert backend.batches == []
+    store.close()
+    assert not store.flusher.is_alive()
+    assert backend.batches == [({'telebot:1:1': serialize_record(record('menu', group_id=1))}, {'telebot:2:2'})]
+
+    store = StateStore(make_backend(), flush_interval=60)
+    assert dict(store.records) == {'telebot:1:1': record('menu', group_id=1)}
+    store.close()
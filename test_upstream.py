@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import upstream
+from http_client import close_connector, open_async_session
+from upstream import UNAUTHORIZED_MARKER, ProfileUnavailable, parse_profile
+
+
+def test_profile_with_student_id_is_authorized():
+    assert parse_profile('[{"id": 12345, "name": "Иванов"}]') == {'authorized': True, 'student_id': 12345}
+
+
+def test_unauthorized_marker():
+    assert parse_profile(f'<html>{UNAUTHORIZED_MARKER}</html>') == {'authorized': False, 'student_id': None}
+
+
+@pytest.mark.parametrize('text', [
+    '<html><title>502 Bad Gateway</title></html>',
+    '',
+    '[]',
+    '{"error": 1}',
+    '[{"name": "Иванов"}]',
+    '[{"id": null}]',
+])
+def test_unparsed_profile_is_unavailable(text):
+    with pytest.raises(ProfileUnavailable):
+        parse_profile(text)
+
+
+def test_shared_journal_request_outlives_a_cancelled_leader(monkeypatch):
+    async def journal(request):
+        await asyncio.sleep(0.2)
+        return web.json_response({'cookie': request.cookies.get('PHPSESSID')})
+
+    async def fetch():
+        async with open_async_session({'PHPSESSID': 'abc'}) as user_session:
+            return await upstream.fetch_journal_async(user_session, 1, 2, '2024-09-01', '2024-12-31')
+
+    async def main():
+        app = web.Application()
+        app.router.add_post('/journal', journal)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        monkeypatch.setattr(upstream, 'DISCIPLINE_URL', f'http://127.0.0.1:{runner.addresses[0][1]}/journal')
+        try:
+            leader = asyncio.create_task(fetch())
+            follower = asyncio.create_task(fetch())
+            # both joined the flight, the leader goes away before the shared request has started
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+        finally:
+            await runner.cleanup()
+            await close_connector()
+
+    assert asyncio.run(main()) == {'cookie': 'abc'}
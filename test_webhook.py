@@ -0,0 +1,95 @@
+import asyncio
+
+import aiohttp
+
+from fake_telegram import FakeTelegramClient
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'test-secret'
+
+
+async def ignore(payload):
+    pass
+
+
+def base_url(server):
+    return f'http://127.0.0.1:{server.runner.addresses[0][1]}'
+
+
+def run(scenario, process_update=ignore, **kwargs):
+    async def main():
+        server = WebhookServer(process_update, secret=SECRET, **kwargs)
+        await server.start('127.0.0.1', 0)
+        client = FakeTelegramClient(base_url(server), secret=SECRET)
+        client.session = aiohttp.ClientSession()
+        try:
+            return await scenario(server, client)
+        finally:
+            await client.close()
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+async def get(server, client, path):
+    async with client.session.get(base_url(server) + path) as response:
+        return response.status
+
+
+def test_wrong_or_missing_secret_is_rejected():
+    async def scenario(server, client):
+        assert await client.post(client.message(1, '/start'), secret='wrong') == 401
+        async with client.session.post(client.url, json=client.message(1, '/start')) as response:
+            assert response.status == 401
+        assert server.stats()['rejected'] == 2
+        assert server.stats()['received'] == 0
+
+    run(scenario)
+
+
+def test_non_json_body_is_rejected():
+    async def scenario(server, client):
+        headers = {SECRET_HEADER: SECRET, 'Content-Type': 'application/json'}
+        async with client.session.post(client.url, data=b'{not json', headers=headers) as response:
+            assert response.status == 400
+
+    run(scenario)
+
+
+def test_full_queue_answers_503():
+    async def scenario(server, client):
+        assert await client.send_message(1, 'first') == 200
+        assert await client.send_message(1, 'second') == 503
+        assert server.stats()['queue_depth'] == 1
+
+    run(scenario, queue_size=1, workers=0)
+
+
+def test_health_and_readiness():
+    server = WebhookServer(ignore, secret=SECRET)
+    assert asyncio.run(server.handle_ready(None)).status == 503
+
+    async def scenario(server, client):
+        assert await get(server, client, '/healthz') == 200
+        assert await get(server, client, '/readyz') == 200
+
+    run(scenario)
+
+
+def test_posted_update_reaches_process_update():
+    updates = []
+
+    async def process_update(payload):
+        updates.append(payload)
+
+    async def scenario(server, client):
+        update = client.message(42, 'ПИ21-1')
+        assert await client.post(update) == 200
+        for _ in range(100):
+            if updates:
+                break
+            await asyncio.sleep(0.01)
+        assert updates == [update]
+        assert server.stats()['processed'] == 1
+
+    run(scenario, process_update)
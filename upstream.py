@@ -0,0 +1,321 @@
+import contextlib
+import json
+import re
+import threading
+import time
+
+from cache import schedule_cache
+from common import DISCIPLINES_LIST_URL, DISCIPLINE_URL, LOGIN_URL, PROFILE_URL, SEARCH_URL, upstream_headers
+from http_client import export_async_cookies, open_session, open_async_session
+from lessons import parse_lessons
+from otp_sum_checker import otpchksum
+from single_flight import SingleFlight, AsyncSingleFlight
+
+
+UNAUTHORIZED_MARKER = '<title>Unauthorized</title>'
+
+
+class Unauthorized(Exception):
+    pass
+
+
+class ProfileUnavailable(Exception):
+    pass
+
+
+class UpstreamLoad:
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.latency = 0.0
+
+    @contextlib.contextmanager
+    def track(self):
+        started = time.monotonic()
+        with self.lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.in_flight -= 1
+                self.latency = self.alpha * elapsed + (1 - self.alpha) * self.latency
+
+    def busy(self, max_in_flight, max_latency):
+        return self.in_flight >= max_in_flight or self.latency >= max_latency
+
+
+flights = SingleFlight()
+async_flights = AsyncSingleFlight()
+upstream_load = UpstreamLoad()
+
+
+def decode_response(text):
+    if UNAUTHORIZED_MARKER in text:
+        raise Unauthorized
+    return json.loads(text)
+
+
+# only a parsed profile with a student id proves the session; a 5xx page or an error payload is not cached
+def parse_profile(text):
+    if UNAUTHORIZED_MARKER in text:
+        return {'authorized': False, 'student_id': None}
+    try:
+        student_id = json.loads(text)[0]['id']
+    except (ValueError, LookupError, TypeError):
+        student_id = None
+    if student_id is None:
+        raise ProfileUnavailable(text[:200])
+    return {'authorized': True, 'student_id': student_id}
+
+
+def login_form(user_login, user_password):
+    return {
+        "AUTH_FORM": "Y",
+        "TYPE": "AUTH",
+        "backurl": "/login/",
+        "USER_LOGIN": user_login,
+        "USER_PASSWORD": user_password
+    }
+
+
+def code_form(user_code, session_id):
+    return {
+        "JS_VALID": "1",
+        "TYPE": "OTP",
+        "OTP_CODE": user_code,
+        "OTP_CODE_CHECKSUM0": otpchksum(user_code),
+        "sessid": session_id
+    }
+
+
+# None for rejected credentials, otherwise the address the code was sent to and the bitrix session id
+def parse_login_page(text):
+    if re.search(r"Неверный логин или пароль", text):
+        return None
+    user_email = re.search(r"[a-zA-Z0-9]+@[a-zA-Z0-9.-]+\.[a-zA-Z]+", text).group()
+    session_id = re.search(r"'bitrix_sessid':'([a-zA-Z0-9]+)'", text).group(1)
+    return user_email, session_id
+
+
+def schedule_key(url, entity_id, start_date, end_date):
+    return url, str(entity_id), str(start_date), str(end_date)
+
+
+def journal_key(student_id, discipline_id, start_date, end_date):
+    return DISCIPLINE_URL, str(student_id), str(discipline_id), str(start_date), str(end_date)
+
+
+def disciplines_key(student_id, start_date, end_date):
+    return DISCIPLINES_LIST_URL, str(student_id), str(start_date), str(end_date)
+
+
+def search_key(search_type, term):
+    return SEARCH_URL, search_type, term
+
+
+def fetch_schedule(url, entity_id, start_date, end_date):
+    return flights.do(schedule_key(url, entity_id, start_date, end_date),
+                      request_schedule, url, entity_id, start_date, end_date)
+
+
+def request_schedule(url, entity_id, start_date, end_date):
+    with upstream_load.track():
+        response = open_session().post(
+            url=f'{url}/{entity_id}',
+            params={
+                "start": start_date,
+                "finish": end_date,
+                "lng": 1,
+            },
+            headers=upstream_headers(url),
+            allow_redirects=True
+        )
+    return parse_lessons(response.json())
+
+
+def search_cache_key(search_type, term):
+    return f"search_{search_type}_{term}"
+
+
+def search(search_type, term):
+    key = search_cache_key(search_type, term)
+    items = schedule_cache.get(key, namespace='search')
+    if items is None:
+        items = flights.do(search_key(search_type, term), request_search, search_type, term)
+        schedule_cache.set(key, items, namespace='search')
+    return items
+
+
+def request_search(search_type, term):
+    with upstream_load.track():
+        response = open_session().get(url=SEARCH_URL,
+                                      params={
+                                          'type': search_type,
+                                          'term': term
+                                      })
+    return response.json()
+
+
+def fetch_journal(user_session, student_id, discipline_id, start_date, end_date):
+    return flights.do(journal_key(student_id, discipline_id, start_date, end_date),
+                      request_journal, user_session, student_id, discipline_id, start_date, end_date)
+
+
+def request_journal(user_session, student_id, discipline_id, start_date, end_date):
+    with upstream_load.track():
+        response = user_session.post(url=DISCIPLINE_URL,
+                                     json={
+                                         "date_from": start_date,
+                                         "date_to": end_date,
+                                         'discipline_id': discipline_id,
+                                         'kind_of_works': [],
+                                         'student_id': student_id
+                                     },
+                                     headers=upstream_headers(DISCIPLINE_URL),
+                                     allow_redirects=True
+                                     )
+    return decode_response(response.text)
+
+
+def fetch_disciplines(user_session, student_id, start_date, end_date):
+    return flights.do(disciplines_key(student_id, start_date, end_date),
+                      request_disciplines, user_session, student_id, start_date, end_date)
+
+
+def request_disciplines(user_session, student_id, start_date, end_date):
+    with upstream_load.track():
+        response = user_session.post(url=DISCIPLINES_LIST_URL,
+                                     json={
+                                         "date_from": start_date,
+                                         "date_to": end_date,
+                                         "student_id": student_id
+                                     },
+                                     headers=upstream_headers(DISCIPLINES_LIST_URL),
+                                     allow_redirects=True
+                                     )
+    return decode_response(response.text)
+
+
+def fetch_profile(user_session):
+    with upstream_load.track():
+        response = user_session.get(url=PROFILE_URL)
+    return parse_profile(response.text)
+
+
+def submit_login(user_session, user_login, user_password):
+    response = user_session.post(url=LOGIN_URL, data=login_form(user_login, user_password),
+                                 headers=upstream_headers(LOGIN_URL), allow_redirects=True)
+    return parse_login_page(response.text)
+
+
+def submit_code(user_session, user_code, session_id):
+    user_session.post(url=LOGIN_URL, data=code_form(user_code, session_id),
+                      headers=upstream_headers(LOGIN_URL), allow_redirects=True)
+
+
+async def fetch_schedule_async(url, entity_id, start_date, end_date):
+    return await async_flights.do(schedule_key(url, entity_id, start_date, end_date),
+                                  request_schedule_async, url, entity_id, start_date, end_date)
+
+
+async def request_schedule_async(url, entity_id, start_date, end_date):
+    with upstream_load.track():
+        async with open_async_session() as session:
+            async with session.post(
+                url=f'{url}/{entity_id}',
+                params={
+                    "start": str(start_date),
+                    "finish": str(end_date),
+                    "lng": 1,
+                },
+                headers=upstream_headers(url),
+                allow_redirects=True
+            ) as response:
+                return parse_lessons(await response.json(content_type=None))
+
+
+async def search_async(search_type, term):
+    key = search_cache_key(search_type, term)
+    items = await schedule_cache.get_async(key, namespace='search')
+    if items is None:
+        items = await async_flights.do(search_key(search_type, term), request_search_async, search_type, term)
+        await schedule_cache.set_async(key, items, namespace='search')
+    return items
+
+
+async def request_search_async(search_type, term):
+    with upstream_load.track():
+        async with open_async_session() as session:
+            async with session.get(url=SEARCH_URL,
+                                   params={
+                                       'type': search_type,
+                                       'term': term
+                                   }) as response:
+                return await response.json(content_type=None)
+
+
+# the shared request opens its own session on the shared connector with the caller's cookies:
+# the caller's session is closed as soon as it returns or is cancelled, while the others still wait
+async def fetch_journal_async(user_session, student_id, discipline_id, start_date, end_date):
+    return await async_flights.do(journal_key(student_id, discipline_id, start_date, end_date),
+                                  request_journal_async, export_async_cookies(user_session), student_id,
+                                  discipline_id, start_date, end_date)
+
+
+async def request_journal_async(cookies, student_id, discipline_id, start_date, end_date):
+    with upstream_load.track():
+        async with open_async_session(cookies) as session:
+            async with session.post(url=DISCIPLINE_URL,
+                                    json={
+                                        "date_from": start_date,
+                                        "date_to": end_date,
+                                        'discipline_id': discipline_id,
+                                        'kind_of_works': [],
+                                        'student_id': student_id
+                                    },
+                                    headers=upstream_headers(DISCIPLINE_URL),
+                                    allow_redirects=True
+                                    ) as response:
+                return decode_response(await response.text())
+
+
+async def fetch_disciplines_async(user_session, student_id, start_date, end_date):
+    return await async_flights.do(disciplines_key(student_id, start_date, end_date),
+                                  request_disciplines_async, export_async_cookies(user_session), student_id,
+                                  start_date, end_date)
+
+
+async def request_disciplines_async(cookies, student_id, start_date, end_date):
+    with upstream_load.track():
+        async with open_async_session(cookies) as session:
+            async with session.post(url=DISCIPLINES_LIST_URL,
+                                    json={
+                                        "date_from": start_date,
+                                        "date_to": end_date,
+                                        "student_id": student_id
+                                    },
+                                    headers=upstream_headers(DISCIPLINES_LIST_URL),
+                                    allow_redirects=True
+                                    ) as response:
+                return decode_response(await response.text())
+
+
+async def fetch_profile_async(user_session):
+    with upstream_load.track():
+        async with user_session.get(url=PROFILE_URL) as response:
+            return parse_profile(await response.text())
+
+
+async def submit_login_async(user_session, user_login, user_password):
+    async with user_session.post(url=LOGIN_URL, data=login_form(user_login, user_password),
+                                 headers=upstream_headers(LOGIN_URL), allow_redirects=True) as response:
+        return parse_login_page(await response.text())
+
+
+async def submit_code_async(user_session, user_code, session_id):
+    async with user_session.post(url=LOGIN_URL, data=code_form(user_code, session_id),
+                                 headers=upstream_headers(LOGIN_URL), allow_redirects=True) as response:
+        await response.read()
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import hmac
+import os
+
+from aiohttp import web
+
+from common import BOT_TOKEN
+from metrics import register_queue
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    def __init__(self, process_update, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH,
+                 queue_size=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS):
+        self.process_update = process_update
+        self.secret = secret.encode()
+        self.path = path
+        self.queue_size = queue_size
+        self.workers = workers
+        self.queue = None
+        self.tasks = set()
+        self.runner = None
+        self.ready = False
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        app.router.add_get('/readyz', self.handle_ready)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+    async def on_startup(self, app):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        register_queue('webhook', self.queue.qsize)
+        for i in range(self.workers):
+            task = asyncio.create_task(self.run_worker())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def on_cleanup(self, app):
+        self.ready = False
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def handle_update(self, request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Telegram redelivers the update after a non-2xx answer
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def handle_health(self, request):
+        return web.json_response({'status': 'ok'})
+
+    async def handle_ready(self, request):
+        stats = self.stats()
+        ready = self.ready and bool(self.tasks) and stats['queue_depth'] < self.queue_size
+        return web.json_response(stats, status=200 if ready else 503)
+
+    async def run_worker(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                await self.process_update(payload)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        self.runner = web.AppRunner(self.create_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.ready = True
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'received': self.received,
+            'rejected': self.rejected,
+            'processed': self.processed,
+            'failed': self.failed,
+        }
+
+
+async def run_webhook(process_update, register=None):
+    server = WebhookServer(process_update)
+    await server.start()
+    try:
+        # replicas share one webhook: it is registered on start but never removed on shutdown
+        if register is not None and WEBHOOK_URL:
+            await register(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                           secret_token=WEBHOOK_SECRET,
+                           max_connections=WEBHOOK_MAX_CONNECTIONS)
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()